@@ -7,39 +7,54 @@ Base Hue
 
 """
 
-from urllib.request import Request
-from urllib import request
-from random import randint, uniform
+from urllib.parse import urlsplit
 from hue.exceptions import (InvalidLightAttr, InvalidLightAttrValue,
                                 InvalidHueHub, HueLightDoesNotExist,
                                 HueGroupDoesNotExist, HueError,
                                 InvalidHueSchedule, HueGroupInvalid, 
-                                HueLightDoesNotExist, InvalidLight, )
-from urllib.error import HTTPError, URLError
-from socket import timeout
-from datetime import datetime, timedelta
-import json
+                                HueLightDoesNotExist, InvalidLight,
+                                HueScheduleDoesNotExist, )
+from hue.validators import ALLOWED_STATES, is_valid, validate_many
+from hue.randomize import default_random
+from hue.state import LightState, STATE_KEYS
+from hue.index import HueIndex
+from hue import codec
+from hue.metrics import metrics
+from hue.transport import get_pool, DEFAULT_TIMEOUT, DEFAULT_POOL_SIZE
+from hue.scheduler import HueCommandScheduler, LIGHT_RATE, GROUP_RATE
+from datetime import datetime
+from time import monotonic, perf_counter
+from threading import Lock
+from hue.sync import (HueChangeSet, HueChangeStream, HuePoller,
+                        DEFAULT_INTERVAL, )
 
 
 FRMT_STR = '%Y-%m-%dT%I:%M:%S'
-ALLOWED_STATES = { 'on' : bool,
-                   'bri' : [0, 254],
-                    'hue' : [0, 65535],
-                    'sat' : [0, 254],
-                    'xy' : [0, 0.9],
-                    'ct' : [154, 500],
-                    'alert' : ('select', 'lselect'),
-                    'effect' : (None, ),
-                    'reachable' : bool }
+# Attrs that trigger an action instead of describing state, always sent
+ACTION_STATES = ('alert', )
+# Attrs modifying how a change is made, sent only along with a change
+MODIFIER_STATES = ('transitiontime', )
+# apply_many sends this many lights sharing a payload through a group
+MIN_BATCH_GROUP = 3
+# Cached state lacks an attr
+MISSING = object()
+BATCH_GROUP_NAME = 'hue-batch'
+
+
+def validate_state(attr):
+    """Validate light or group attrs against ALLOWED_STATES"""
+    validate_many(attr)
+
 
 class HueLight:
     """A Hue Light"""
 
+    __slots__ = ('id', 'manager', 'name', 'model_id', 'version',
+                    'light_type', 'point_symbols', 'state')
+
     def __init__(self, manager, id, light_data=None):
         """Initialize Object to represent a Hue Light"""
         self.id = str(id)
-        self.uri = '/lights/%s' % self.id
-        self.state_url = manager.url + self.uri + '/state'
         self.manager = manager
         if light_data:
             self.name = light_data['name']
@@ -47,8 +62,22 @@ class HueLight:
             self.version = light_data['swversion']
             self.light_type = light_data['type']
             self.point_symbols = light_data['pointsymbol']
-            self.state = light_data['state']
+            self.state = LightState(light_data['state'])
+
+    @property
+    def uri(self):
+        return '/lights/%s' % self.id
 
+    @property
+    def state_url(self):
+        return self.manager.url + self.uri + '/state'
+
+    def as_dict(self):
+        """Light as the bridge's /lights/<id> payload"""
+        return { 'name' : self.name, 'modelid' : self.model_id,
+                 'swversion' : self.version, 'type' : self.light_type,
+                 'pointsymbol' : self.point_symbols,
+                 'state' : self.state.as_dict() }
 
     def get_point(self, pointno=None):
         try:
@@ -63,97 +92,135 @@ class HueLight:
  
 
     def get_state_status(self, state_attr=None):
-        """Get current light value for state attr"""
+        """Get current light value for state attr, a dict of them all
+            when no attr is given
+        """
         try:
             if not state_attr:
-                return self.state
-            elif state_attr in self.state:
-                return self.state[state_attr]
-            else:
-                return None
+                return self.state.as_dict()
+            return self.state.get(state_attr)
         except AttributeError:
             return None
 
     def _set_state_status(self, state_attr, val):
         """Update state status"""
-        try:
-            if self._compare(val, ALLOWED_STATES[state_attr]):
-                self.state[state_attr] = val
-        except KeyError:
-            return None
+        if is_valid(state_attr, val):
+            self.state[state_attr] = val
 
     def turn_on(self):
         """Turn Light On"""
-        req = Request(self.state_url, 
-                    data=bytearray('{ "on" : true}', 'utf-8'))
-        req.get_method = lambda: 'PUT'
-        response = request.urlopen(req)
-        self.state['on'] = True
-        return response.read()
+        response = self.manager._send_state(self.state_url, { 'on' : True })
+        self._update_state({ 'on' : True })
+        return response
 
     def turn_off(self):
         """Turn Light Off"""
-        req = Request(self.state_url, 
-                    data=bytearray('{ "on" : false}', 'utf-8'))
-        req.get_method = lambda: 'PUT'
-        response = request.urlopen(req)
-        self.state['on'] = False
-        return response.read()
-
-    def set_light_attr(self, attr):
-        """Set a current HueLight Object to accepted Hue attrs"""
-        for key in attr.keys():
-            try:
-                if type(ALLOWED_STATES[key]) == bool:
-                    if attr[key] not in (True, False):
-                        raise InvalidLightAttrValue(key, attr[key])
-                elif type(ALLOWED_STATES[key]) == tuple:
-                    if attr[key] not in ALLOWED_STATES[key]:
-                        raise InvalidLightAttrValue(key, attr[key])
-                else:
-                    if not self._compare(attr[key], ALLOWED_STATES[key]):
-                        raise InvalidLightAttrValue(key, attr[key])
-                    else:
-                        self._set_state_status(key, attr[key])
-            except KeyError as key_err:
-                raise InvalidLightAttr(key_err.args)
-        response = self.manager._connect_hue(self.state_url, data=attr, method='PUT')
+        response = self.manager._send_state(self.state_url, { 'on' : False })
+        self._update_state({ 'on' : False })
         return response
 
-    def get_light_attr_random(self, attr):
-        """Take a Hue Light attr and get a random value in accepted range"""
-        try:
-            if type(ALLOWED_STATES[attr]) == list:
-                allowed_range = ALLOWED_STATES[attr]
-                if type(allowed_range[1]) == int:
-                    rand_func = randint
-                else:
-                    rand_func = uniform
-                return rand_func(allowed_range[0], allowed_range[1])
-            elif type(ALLOWED_STATES[attr]) == bool:
-                return randint(0, 1) == True
-            elif type(ALLOWED_STATES[attr]) == tuple:
-                range_x = len(ALLOWED_STATES[attr]) -1
-                return ALLOWED_STATES[attr][randint(0, range_x)]
-        except KeyError as key_err:
-            raise InvalidLightAttr(key_err.args)
-
-    def _compare(self, val, accepted_values):
-        """Compare Value to accepted Range"""
-        if type(val) in (list, tuple):
-            ret_val = True
-            for value in val:
-                ret_val = self._compare(value, accepted_values)
-                if not ret_val:
-                    return ret_val
-            return ret_val
-        elif type(val) == accepted_values:
-            return True
-        elif float(val) >= accepted_values[0] \
-                    and float(val) <= accepted_values[1]:
-            return True
-        else:
-            return False
+    def set_light_attr(self, attr, force=False):
+        """Set a current HueLight Object to accepted Hue attrs
+            Only attrs differing from the cached state are sent, nothing
+            is sent when they all match
+            -force [send every attr, for when cached state may be stale]
+        """
+        self._validate_attr(attr)
+        if not force:
+            attr = self._state_delta(attr)
+            if not attr:
+                return None
+        response = self.manager._send_state(self.state_url, attr)
+        self._update_state(attr)
+        return response
+
+    def _state_delta(self, attr):
+        """Attrs whose value differs from the cached state"""
+        state = getattr(self, 'state', {})
+        delta = {}
+        for key, val in attr.items():
+            if key in MODIFIER_STATES:
+                continue
+            # Slot reads, mapping access costs a python call per attr
+            old = getattr(state, key, MISSING) if key in STATE_KEYS \
+                    else state.get(key, MISSING)
+            if key in ACTION_STATES or old is MISSING:
+                delta[key] = val
+            elif type(val) in (list, tuple):
+                if list(val) != list(old):
+                    delta[key] = val
+            elif val != old:
+                delta[key] = val
+        if delta:
+            for key in MODIFIER_STATES:
+                if key in attr:
+                    delta[key] = attr[key]
+        return delta
+
+    def _update_state(self, attr):
+        """Record sent attrs in the cached state, and those that changed
+            in the manager's history recorder when it has one
+        """
+        state = getattr(self, 'state', None)
+        if state is None:
+            return
+        changed = {}
+        for key, val in attr.items():
+            if key in ACTION_STATES or key in MODIFIER_STATES:
+                continue
+            if key in STATE_KEYS:
+                old = getattr(state, key, None)
+                setattr(state, key, val)
+            else:
+                old = state.get(key)
+                state[key] = val
+            if type(val) in (list, tuple):
+                if old is None or list(val) != list(old):
+                    changed[key] = val
+            elif val != old:
+                changed[key] = val
+        # Sent colour attrs switch the light's colormode, xy winning
+        # over ct over hue and sat as on the bridge
+        colormode = getattr(state, 'colormode', None)
+        if colormode is not None:
+            mode = 'xy' if 'xy' in attr else 'ct' if 'ct' in attr else \
+                    'hs' if 'hue' in attr or 'sat' in attr else None
+            if mode and colormode != mode:
+                state.colormode = mode
+                changed['colormode'] = mode
+        # The cache no longer matches the bridge payload last seen, so
+        # the next refresh compares it in full, correcting commands
+        # that did not take effect
+        hashes = getattr(self.manager, '_hashes', None)
+        if hashes is not None:
+            hashes.pop(('light', self.id), None)
+        history = getattr(self.manager, 'history', None)
+        if changed and history is not None:
+            history.record(self.manager.host, self.id, changed)
+
+    def _forget_state(self, attr):
+        """Drop attrs from the cached state, their value is unknown
+            until the next refresh
+        """
+        state = getattr(self, 'state', None)
+        if state is None:
+            return
+        for key in attr:
+            if key not in ACTION_STATES and key not in MODIFIER_STATES:
+                state.pop(key, None)
+        hashes = getattr(self.manager, '_hashes', None)
+        if hashes is not None:
+            hashes.pop(('light', self.id), None)
+
+    def _validate_attr(self, attr):
+        """Validate attrs against ALLOWED_STATES"""
+        validate_state(attr)
+
+    def get_light_attr_random(self, attr, rng=None):
+        """Take a Hue Light attr and get a random value in accepted range
+            -rng [HueRandom to draw from, shared generator by default]
+        """
+        return (rng or default_random).values(attr, 1)[0]
 
 
 class HueConfig:
@@ -174,10 +241,23 @@ class HueConfig:
         self.version = config_data['swversion']
         self.whitelist = config_data['whitelist']
 
+    def as_dict(self):
+        """Config as the bridge's /config payload"""
+        return { 'dhcp' : self.dhcp, 'gateway' : self.gateway,
+                 'ipaddress' : self.ip_addr, 'linkbutton' : self.link_button,
+                 'mac' : self.mac, 'name' : self.name,
+                 'netmask' : self.netmask,
+                 'portalservices' : self.portalservice,
+                 'proxyaddress' : self.proxy_addr,
+                 'swupdate' : self.swupdate, 'swversion' : self.version,
+                 'whitelist' : self.whitelist }
+
 
 class HueGroup:
     """Represent a Hue Grouping of Lights"""
 
+    __slots__ = ('manager', 'name', 'lights', 'id')
+
     def __init__(self, manager, name, lights, key=None):
         """Represents a Grouping of Hue Lights"""
         self.manager = manager
@@ -187,14 +267,61 @@ class HueGroup:
             self._create_group()
         else:
             self.id = key
-            self.uri = "/groups/%s" % self.id
-            self.state_url = manager.url + self.uri + '/state'
 
+    @property
+    def uri(self):
+        return "/groups/%s" % self.id
+
+    @property
+    def state_url(self):
+        return self.manager.url + self.uri + '/action'
+
+    def as_dict(self):
+        """Group as the bridge's /groups/<id> payload"""
+        return { 'name' : self.name,
+                 'lights' : [str(getattr(light, 'id', light))
+                                for light in self.lights] }
+
+    def turn_on(self, force=False):
+        """Turn every light in group on with one group action"""
+        return self.set_attr({ 'on' : True }, force=force)
+
+    def turn_off(self, force=False):
+        """Turn every light in group off with one group action"""
+        return self.set_attr({ 'on' : False }, force=force)
+
+    def set_attr(self, attr, force=False):
+        """Set every light in group to attrs with one group action
+            Nothing is sent when every light already matches
+            -force [send every attr, for when cached state may be stale]
+        """
+        validate_state(attr)
+        members = [light for light in self.lights
+                    if isinstance(light, HueLight)]
+        if not force and members:
+            delta = {}
+            for light in members:
+                delta.update(light._state_delta(attr))
+            if not delta:
+                return None
+            attr = dict((key, attr[key]) for key in delta)
+        response = self.manager._send_state(self.state_url, attr,
+                                            kind='group')
+        for light in members:
+            light._update_state(attr)
+        return response
 
     def update(self, manager=None):
         """Add/Remove Lights from a Hue Group
             -lights [list of lights in Hue Group]
             -group_id [Hue group id]"""
+        resp = self.manager._connect_hue(self.manager.url + self.uri,
+                                        data=self._update_payload(),
+                                        method='PUT')
+        self._updated(resp)
+
+    def _update_payload(self):
+        """Body of a group update"""
         try:
             lights = []
             for light in self.lights:
@@ -202,16 +329,16 @@ class HueGroup:
                     lights.append(light.id)
                 else:
                     lights.append(light)
-            data = { 'lights' : lights, 'name' : self.name }
+            return { 'lights' : lights, 'name' : self.name }
         except TypeError:
             raise HueGroupInvalid
 
-        resp = self.manager._connect_hue(self.manager.url + self.uri,
-                                        data=data, method='PUT')
-        resp = resp.decode('utf-8')
-        resp = json.loads(resp)[0]
+    def _updated(self, resp):
+        """Check the bridge response to a group update"""
+        resp = codec.loads(resp)[0]
         if not 'success' in resp:
-            raise HueError(key_err)
+            raise HueError(resp)
+        self.manager.index.set_group(self)
 
     def _create_group(self):
         """Create a new Hue group of lights
@@ -222,14 +349,14 @@ class HueGroup:
             data = { "lights" : [light.id for light in self.lights],
                      "name" : self.name }
             resp = self.manager._connect_hue(url, data=data)
-            resp = resp.decode('utf-8')
-            data_resp = json.loads(resp)
+            data_resp = codec.loads(resp)
             if 'success' in data_resp[0]:
                 group_id = data_resp[0]['success']['id']
-                group_id = group_id.split('/')[-1]
-                self.manager.groups[group_id] = self
-                self.uri = "/groups/%s" % self.id
-                self.state_url = manager.url + self.uri + '/state'
+                self.id = group_id.split('/')[-1]
+                self.manager.groups[self.id] = self
+                self.manager.index.set_group(self)
+            else:
+                raise HueError(data_resp[0])
         except IndexError:
             raise HueError
         except AttributeError:
@@ -238,20 +365,27 @@ class HueGroup:
     def delete(self):
         """Delete a Hue lighting group"""
         try:
-            resp = self.manager._connect_hue(self.state_url,
-                                  method='DELETE').decode('utf-8')
-            resp = json.loads(resp)
-            if 'success' in resp:
-                del self.manager.groups[self.id]
-            else:
-                raise HueGroupDoesNotExist(resp)
+            resp = self.manager._connect_hue(self.manager.url + self.uri,
+                                  method='DELETE')
         except AttributeError:
             raise HueGroupInvalid
+        self._deleted(resp)
+
+    def _deleted(self, resp):
+        """Check the bridge response to a group delete"""
+        resp = codec.loads(resp)[0]
+        if 'success' in resp:
+            del self.manager.groups[self.id]
+            self.manager.index.remove_group(self.id)
+        else:
+            raise HueGroupDoesNotExist(resp)
 
 
 class HueCommand:
     """ A command for use in schedules"""
 
+    __slots__ = ('address', 'body', 'method')
+
     def __init__(self, address, body, method='PUT'):
         """Represent a Hue Command
             -address [uri where command is to be executed at]
@@ -270,6 +404,9 @@ class HueCommand:
 class HueSchedule:
     """ Represent a Schedule for Hue Hub """
 
+    __slots__ = ('manager', 'name', 'description', 'date_time', 'command',
+                    'id')
+
     def __init__(self, manager, name, description,
                         time_stamp, command, read_only=False, key=None):
         """A Hue Schedule object"""
@@ -286,8 +423,6 @@ class HueSchedule:
 
         if key:
             self.id = key
-            self.uri = "/schedules/%s" % self.id
-            self.state_url = "%s/schedules/%s" % (self.manager.url, self.id)
 
         if type(command) == dict:
             try:
@@ -303,20 +438,36 @@ class HueSchedule:
         if not key:
             self._create()
 
+    @property
+    def uri(self):
+        return "/schedules/%s" % self.id
+
+    @property
+    def state_url(self):
+        return self.manager.url + self.uri
+
     def get_iso_time(self):
         return self.date_time.isoformat()
 
+    def as_dict(self):
+        """Schedule as the bridge's /schedules/<id> payload"""
+        time_stamp = self.date_time
+        if isinstance(time_stamp, datetime):
+            time_stamp = time_stamp.strftime(FRMT_STR)
+        return { 'name' : self.name, 'description' : self.description,
+                 'time' : time_stamp, 'command' : self.command.__dict__() }
+
     def _convert_date(self, time_stamp, format):
         datetime.strptime(time_stamp, FRMT_STR)
 
     def delete(self):
         """Delete a scheduled Hue event"""
-        resp = self._connect_hue(self.state_url, method='DELETE').decode('utf-8')
-        resp = json.loads(resp)[0]
+        resp = self.manager._connect_hue(self.state_url, method='DELETE')
+        resp = codec.loads(resp)[0]
         if 'success' in resp:
-            del self.schedules[schedule_key]
+            del self.manager.schedules[self.id]
         else:
-            raise HueScheduleDoesNotExist
+            raise HueScheduleDoesNotExist(resp)
 
     def _create(self):
         url = self.manager.url + '/schedules'
@@ -324,105 +475,392 @@ class HueSchedule:
                         'description' : self.description,
                         'name' : self.name, 
                         'time' : self.get_iso_time()}
-        resp = self._connect_hue(url, data=self.command.__dict__).decode('utf-8')
-        resp = json.loads(resp)[0]
+        resp = self.manager._connect_hue(url, data=data)
+        resp = codec.loads(resp)[0]
         if 'success' in resp:
-            schedule_id = resp['success']['id'].split('/')[-1]
-            self.manager.schedules[schedule_id] = self
-            self.id = key
-            self.uri = "/schedules/%s" % self.id
-            self.state_url = "%s/schedules/%s" % (self.manager.url, self.id)
+            self.id = resp['success']['id'].split('/')[-1]
+            self.manager.schedules[self.id] = self
         else:
             raise InvalidHueSchedule(resp)
 
 class Hue:
     """Object Representing Hue Interface"""
 
-    def __init__(self, host, app_key, port=80, load_now=True):
-        """Initialize Object for communicating with Hue Base Station"""
+    light_class = HueLight
+    group_class = HueGroup
+
+    def __init__(self, host, app_key, port=80, load_now=True, lazy=False,
+                    timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE):
+        """Initialize Object for communicating with Hue Base Station
+            -lazy [load lights, groups, schedules and config from their
+                    own endpoints on first access instead of all at once]
+            -timeout [seconds to wait on a bridge response]
+            -pool_size [max keep-alive connections to the bridge]
+        """
         self.app_key = app_key
         self.host = host
         self.port = port
         self.uri = '/api/%s' % self.app_key
         self.url = 'http://%s:%d%s' % (self.host, self.port, self.uri)
-        self.lights = {}
-        self.groups = {}
-        self.schedules = {}
-        self.config = None
-        if load_now:
+        self.transport = get_pool(host, port, timeout=timeout,
+                                    pool_size=pool_size)
+        self.lazy = lazy
+        self._lights = {}
+        self._groups = {}
+        self._schedules = {}
+        self._config = None
+        self._loaded = {}
+        self._hashes = {}
+        self.index = HueIndex()
+        # Held from moving the batch group's lights to sending its action
+        self._batch_lock = Lock()
+        self.scheduler = None
+        self.poller = None
+        self.history = None
+        if load_now and not lazy:
             self.load_hue()
 
+    def _lazy_load(self, resource):
+        if self.lazy and resource not in self._loaded:
+            getattr(self, 'load_%s' % resource)()
+
+    @property
+    def lights(self):
+        self._lazy_load('lights')
+        return self._lights
+
+    @property
+    def groups(self):
+        self._lazy_load('groups')
+        return self._groups
+
+    @property
+    def schedules(self):
+        self._lazy_load('schedules')
+        return self._schedules
+
+    @property
+    def config(self):
+        self._lazy_load('config')
+        return self._config
+
+    def loaded_at(self, resource):
+        """Monotonic time resource was last loaded, None if never"""
+        return self._loaded.get(resource)
+
     def _connect_hue(self, url, data=None, method=None):
         """Connect To Hue Hub"""
         try:
-            req = Request(url)
+            parts = urlsplit(url)
+            transport = self.transport
+            if (parts.hostname, parts.port or 80) != (self.host, self.port):
+                transport = get_pool(parts.hostname, parts.port or 80)
         except ValueError as exc:
             raise HueError(exc)
+        if parts.scheme != 'http':
+            raise HueError('Unsupported url %s' % url)
+        body = None
         if data:
-            json_str = json.dumps(data)
-            json_bytes = bytearray(json_str, 'utf-8')
-            req.add_data(json_bytes)
-        if method:
-            req.get_method = lambda : method
-        try:
-            response = request.urlopen(req)
-            return response.read()
-        except (HTTPError, URLError) as error:
-            raise InvalidHueHub(error)
-        except timeout as error:
-            raise InvalidHueHub(error)
-        except NameError as error:
-            raise HueError(error)
+            body = codec.encode_body(data)
+        if not method:
+            method = 'POST' if body is not None else 'GET'
+        if metrics.enabled:
+            return metrics.request(transport, method, parts.path, body=body)
+        return transport.request(method, parts.path, body=body)
+
+    def _send_state(self, url, data, kind='light'):
+        """PUT state data, through the command scheduler when enabled"""
+        if self.scheduler:
+            return self.scheduler.submit(url, data, kind=kind)
+        return self._connect_hue(url, data=data, method='PUT')
+
+    def enable_scheduler(self, light_rate=LIGHT_RATE, group_rate=GROUP_RATE,
+                            max_pending=None):
+        """Queue state commands and pace them to the bridge
+            State commands then return Futures instead of responses
+        """
+        if not self.scheduler:
+            self.scheduler = HueCommandScheduler(self, light_rate=light_rate,
+                                                    group_rate=group_rate,
+                                                    max_pending=max_pending)
+            self.scheduler.start()
+        return self.scheduler
+
+    def disable_scheduler(self):
+        """Send state commands immediately again
+            Queued commands fail and their lights' cached attrs are dropped
+        """
+        if self.scheduler:
+            self.scheduler.stop()
+            self.scheduler = None
+
+    def _command_dropped(self, url, attr):
+        """Forget cached attrs of a queued state command never sent"""
+        parts = url[len(self.url):].strip('/').split('/')
+        if len(parts) < 2:
+            return
+        if parts[0] == 'lights':
+            light = self._lights.get(parts[1])
+            lights = [light] if light else []
+        elif parts[0] == 'groups':
+            group = self._groups.get(parts[1])
+            lights = group.lights if group else []
+        else:
+            return
+        for light in lights:
+            if isinstance(light, HueLight):
+                light._forget_state(attr)
 
     def load_hue(self):
         """Load default Hue Response into Hue objects"""
+        if not metrics.enabled:
+            resp = self._connect_hue(self.url)
+            self._load_document(self._load_json(resp))
+            return
+        start = perf_counter()
         resp = self._connect_hue(self.url)
-        resp = self._load_json(resp.decode('utf-8'))
+        start = metrics.phase('fetch', start)
+        resp = self._load_json(resp)
+        metrics.phase('parse', start)
+        self._load_document(resp)
+
+    def _load_document(self, resp):
+        """Load a full Hue state document into Hue objects"""
+        if not metrics.enabled:
+            self._load_lights(resp['lights'])
+            self._load_config(resp['config'])
+            self._load_groups(resp['groups'])
+            self._load_schedules(resp['schedules'])
+            return
+        start = perf_counter()
         self._load_lights(resp['lights'])
+        start = metrics.phase('lights', start)
         self._load_config(resp['config'])
+        start = metrics.phase('config', start)
         self._load_groups(resp['groups'])
+        start = metrics.phase('groups', start)
         self._load_schedules(resp['schedules'])
+        metrics.phase('schedules', start)
 
-    def _load_json(self, str_data):
-        """Load json string into python data"""
-        doc = json.loads(str_data)
-        return doc
+    def state_document(self):
+        """Loaded state as a bridge full state document"""
+        return { 'lights' : dict((key, light.as_dict())
+                                    for key, light in self.lights.items()),
+                 'groups' : dict((key, group.as_dict())
+                                    for key, group in self.groups.items()),
+                 'config' : self.config.as_dict(),
+                 'schedules' : dict((key, schedule.as_dict())
+                                    for key, schedule in self.schedules.items()) }
+
+    def _load_json(self, data):
+        """Load json bytes or string into python data"""
+        return codec.loads(data)
+
+    def _get_json(self, uri):
+        """GET uri below the api url as python data"""
+        return self._load_json(self._connect_hue(self.url + uri))
+
+    def _get_resource(self, uri, detail_key):
+        """GET a resource collection, fetching members listed by name only"""
+        resources = self._get_json(uri)
+        for key in resources.keys():
+            if detail_key not in resources[key]:
+                resources[key] = self._get_json('%s/%s' % (uri, key))
+        return resources
+
+    def load_lights(self):
+        """(Re)load lights from /lights
+            Loaded HueLights are updated in place, so groups and effects
+            holding them see the new state
+        """
+        for key in [key for key in self._hashes
+                        if isinstance(key, tuple) and key[0] == 'light']:
+            del self._hashes[key]
+        self._refresh_lights(self._get_resource('/lights', 'state'),
+                                HueChangeSet())
+
+    def load_groups(self):
+        """(Re)load groups from /groups"""
+        self._groups.clear()
+        self.index.clear_groups()
+        self._load_groups(self._get_resource('/groups', 'lights'))
+
+    def load_schedules(self):
+        """(Re)load schedules from /schedules"""
+        self._schedules.clear()
+        self._load_schedules(self._get_resource('/schedules', 'command'))
+
+    def load_config(self):
+        """(Re)load config from /config"""
+        self._load_config(self._get_json('/config'))
 
     def _load_lights(self, lights_dict):
         """Load Hue Lights into HueLight Objects"""
         for key in lights_dict.keys():
-            self.lights[key] = HueLight(self, int(key), lights_dict[key])
+            self._add_light(key, lights_dict[key])
+        self._loaded['lights'] = monotonic()
+
+    def _add_light(self, key, light_data):
+        light = self.light_class(self, int(key), light_data)
+        self._lights[key] = light
+        self.index.add_light(light)
+        return light
+
+    def _add_group(self, key, name, lights):
+        group = self.group_class(self, name, lights, key=key)
+        self._groups[key] = group
+        self.index.set_group(group)
+        return group
+
+    def _resolve_lights(self, light_ids):
+        """HueLights of a group payload's light ids"""
+        lights = self.lights
+        try:
+            return [lights[light_id] for light_id in light_ids]
+        except KeyError as key_err:
+            raise HueLightDoesNotExist(key_err)
 
     def _load_config(self, config):
         """Load Hue Config data into HueConfig object"""
-        self.config = HueConfig(config)
+        self._config = HueConfig(config)
+        self._hashes['config'] = self._payload_hash(config)
+        self._loaded['config'] = monotonic()
 
     def _load_groups(self, groups):
         """Load Hue Groups into HueGroup objects"""
-        def load_lights(light_ids):
-            lights = []
-            try:
-                for light_id in light_ids:
-                    lights.append(self.lights[light_id])
-            except KeyError as key_err:
-                raise HueLightDoesNotExist(key_err)
-            else:
-                return lights
-
         for key in groups.keys():
-            lights = load_lights(groups[key]['lights'])
-            self.groups[key] = HueGroup(self, groups[key]['name'], lights, key=key)
+            self._add_group(key, groups[key]['name'],
+                            self._resolve_lights(groups[key]['lights']))
         if '0' not in groups:
-            #There exists a 0 zero group of all lights
-            group_zero = \
-            self._connect_hue(self.url + '/groups/0').decode('utf-8')
-            group_zero = json.loads(group_zero)
-            lights = load_lights(group_zero['lights'])
-            self.groups['0'] = HueGroup(self, group_zero['name'],
-                                                lights, key='0')
+            self._add_group_zero()
+        self._loaded['groups'] = monotonic()
+
+    def _add_group_zero(self):
+        """There exists a 0 zero group of all lights, fetch it on its own"""
+        group_zero = self._get_json('/groups/0')
+        self._add_group('0', group_zero['name'],
+                        self._resolve_lights(group_zero['lights']))
 
     def create_group(self, lights, group_name):
-        return HueGroup(self, group_name, lights)
+        return self.group_class(self, group_name, lights)
+
+    def find_lights(self, **criteria):
+        """Lights matching every field=value, from the indexes
+            -criteria [name, light_type, model_id, reachable]
+            Returns HueLights ordered by id
+        """
+        lights = self.lights
+        return [lights[light_id] for light_id in
+                    sorted(self.index.light_ids(**criteria), key=int)
+                    if light_id in lights]
+
+    def groups_of(self, light):
+        """Groups a HueLight or light id belongs to, ordered by id"""
+        light_id = getattr(light, 'id', light)
+        groups = self.groups
+        return [groups[group_id] for group_id in
+                    sorted(self.index.group_ids(light_id), key=int)
+                    if group_id in groups]
+
+    def apply_many(self, light_attrs, force=False):
+        """Set many lights to their own attrs in the fewest requests
+            -light_attrs [dict of light id: attrs]
+            -force [send every attr, not only those differing from state]
+            Lights sharing a payload are sent one group action, through
+            a group of exactly those lights or the reused batch group.
+            The batch group is not used while the scheduler is enabled,
+            as queued actions would reach its next members, and callers
+            in other threads take turns with it.
+            Returns dict of light id: response, None when nothing was sent
+        """
+        results, batches = self._batches(light_attrs, force)
+        for attr, light_ids in batches:
+            group = None
+            if len(light_ids) > 1:
+                group = self._group_of(light_ids)
+            response = None
+            if group:
+                response = group.set_attr(attr, force=True)
+            elif len(light_ids) >= MIN_BATCH_GROUP and not self.scheduler:
+                with self._batch_lock:
+                    group = self._batch_group(light_ids)
+                    response = group.set_attr(attr, force=True)
+            if group:
+                for light_id in light_ids:
+                    results[light_id] = response
+            else:
+                for light_id in light_ids:
+                    results[light_id] = \
+                        self.lights[light_id].set_light_attr(attr, force=True)
+        return results
+
+    def _batches(self, light_attrs, force):
+        """Validate apply_many payloads and gather lights sharing one
+            Returns (results of None per light, list of (attrs, light ids))
+        """
+        payloads = {}
+        for light_id, attr in light_attrs.items():
+            light_id = str(light_id)
+            if light_id not in self.lights:
+                raise HueLightDoesNotExist(light_id)
+            validate_state(attr)
+            payloads[light_id] = attr
+
+        results = dict((light_id, None) for light_id in payloads)
+        batches = {}
+        for light_id, attr in payloads.items():
+            if not force:
+                attr = self.lights[light_id]._state_delta(attr)
+                if not attr:
+                    continue
+            key = codec.dumps(attr, sort_keys=True)
+            batches.setdefault(key, (attr, []))[1].append(light_id)
+        return results, list(batches.values())
+
+    def _group_of(self, light_ids):
+        """Loaded group holding exactly light_ids, None if there is none
+            The batch group is left out, its lights change under the lock
+        """
+        members = set(light_ids)
+        for group in self.groups.values():
+            if group.name == BATCH_GROUP_NAME:
+                continue
+            if set(getattr(light, 'id', light) for light in group.lights) \
+                    == members:
+                return group
+        return None
+
+    def _batch_group(self, light_ids):
+        """The group used by apply_many, updated to hold light_ids"""
+        lights = [self.lights[light_id] for light_id in light_ids]
+        group = self._find_batch_group()
+        if group:
+            if group.lights != lights:
+                group.lights = lights
+                group.update()
+            return group
+        return self.create_group(lights, BATCH_GROUP_NAME)
+
+    def _group_action_cost(self, light_ids):
+        """Requests apply_many takes to send light_ids one group action,
+            None when it would send them one by one
+        """
+        if len(light_ids) > 1 and self._group_of(light_ids):
+            return 1
+        if len(light_ids) < MIN_BATCH_GROUP or self.scheduler:
+            return None
+        group = self._find_batch_group()
+        if group and set(getattr(light, 'id', light) for light in group.lights) \
+                == set(light_ids):
+            return 1
+        # Moving or creating the batch group comes first
+        return 2
+
+    def _find_batch_group(self):
+        for group in self.groups.values():
+            if group.name == BATCH_GROUP_NAME:
+                return group
+        return None
 
     def _load_schedules(self, schedules):
         """Load Hue Schedule into HueSchedule Objects"""
@@ -432,9 +870,164 @@ class Hue:
                                     schedules[schedule]['description'], 
                                     schedules[schedule]['time'],
                                     schedules[schedule]['command'], key=schedule)
-                self.schedules[schedule] = hue_schedule
+                self._schedules[schedule] = hue_schedule
             except KeyError as key_err:
                 raise HueError(key_err)
+        self._hashes['schedules'] = self._payload_hash(schedules)
+        self._loaded['schedules'] = monotonic()
+
+    def _payload_hash(self, data):
+        """Hash of a json payload, equal payloads hash equal"""
+        return hash(codec.dumps(data, sort_keys=True))
+
+    def _payload_changed(self, key, data):
+        """Check payload against the hash last seen for key"""
+        digest = self._payload_hash(data)
+        if self._hashes.get(key) == digest:
+            return False
+        self._hashes[key] = digest
+        return True
+
+    def refresh(self):
+        """Poll the bridge and update loaded objects in place
+            Returns a HueChangeSet of what changed
+        """
+        return self._refresh_document(
+                            self._load_json(self._connect_hue(self.url)))
+
+    def _refreshes(self, resource):
+        """A lazy Hue leaves resources it never loaded to the lazy loader"""
+        return not self.lazy or resource in self._loaded
+
+    def _refresh_document(self, resp):
+        """Update loaded objects in place from a full state document"""
+        changes = HueChangeSet()
+        if self._refreshes('lights'):
+            self._refresh_lights(resp['lights'], changes)
+        if self.history is not None:
+            for light_id, attrs in changes.lights_changed.items():
+                state = dict((attr, new) for attr, (old, new) in attrs.items()
+                                if attr != 'name')
+                if state:
+                    self.history.record(self.host, light_id, state,
+                                        source='bridge')
+        if self._refreshes('groups'):
+            self._refresh_groups(resp['groups'], changes)
+        if self._refreshes('config') and \
+                self._payload_changed('config', resp['config']):
+            self._load_config(resp['config'])
+            changes.config_changed = True
+        if self._refreshes('schedules') and \
+                self._payload_changed('schedules', resp['schedules']):
+            self._schedules.clear()
+            self._load_schedules(resp['schedules'])
+            changes.schedules_changed = True
+        return changes
+
+    def _refresh_lights(self, lights_dict, changes):
+        """Update HueLights in place from a /lights payload"""
+        for key, light_data in lights_dict.items():
+            if not self._payload_changed(('light', key), light_data):
+                continue
+            light = self._lights.get(key)
+            if light is None:
+                self._add_light(key, light_data)
+                changes.lights_added.append(key)
+            else:
+                self._refresh_light(light, light_data, changes)
+        for key in list(self._lights.keys()):
+            if key not in lights_dict:
+                light = self._lights.pop(key)
+                self._hashes.pop(('light', key), None)
+                self.index.remove_light(key)
+                for group in self._groups.values():
+                    if light in group.lights:
+                        group.lights.remove(light)
+                changes.lights_removed.append(key)
+        if (changes.lights_added or changes.lights_removed) \
+                and '0' in self._groups:
+            self._groups['0'].lights[:] = list(self._lights.values())
+            self.index.set_group(self._groups['0'])
+        self._loaded['lights'] = monotonic()
+
+    def _refresh_light(self, light, light_data, changes):
+        """Update a HueLight in place, recording changed attrs"""
+        if light.name != light_data['name']:
+            changes.light_changed(light.id, 'name', light.name,
+                                    light_data['name'])
+        light.name = light_data['name']
+        light.model_id = light_data['modelid']
+        light.version = light_data['swversion']
+        light.light_type = light_data['type']
+        light.point_symbols = light_data['pointsymbol']
+        state = light.state
+        for attr, val in light_data['state'].items():
+            old = getattr(state, attr, None) if attr in STATE_KEYS \
+                    else state.get(attr)
+            if old != val:
+                changes.light_changed(light.id, attr, old, val)
+                state[attr] = val
+        self.index.update_light(light)
+
+    def _refresh_groups(self, groups, changes):
+        """Update HueGroups in place from a /groups payload"""
+        for key, group_data in groups.items():
+            if not self._payload_changed(('group', key), group_data):
+                continue
+            lights = self._resolve_lights(group_data['lights'])
+            group = self._groups.get(key)
+            if group is None:
+                self._add_group(key, group_data['name'], lights)
+                changes.groups_added.append(key)
+            elif group.name != group_data['name'] or group.lights != lights:
+                group.name = group_data['name']
+                group.lights[:] = lights
+                self.index.set_group(group)
+                changes.groups_changed.append(key)
+        for key in list(self._groups.keys()):
+            # Group 0 of all lights is never listed in /groups
+            if key not in groups and key != '0':
+                del self._groups[key]
+                self._hashes.pop(('group', key), None)
+                self.index.remove_group(key)
+                changes.groups_removed.append(key)
+        if '0' not in self._groups:
+            self._add_group_zero()
+        self._loaded['groups'] = monotonic()
+
+    def start_polling(self, interval=DEFAULT_INTERVAL):
+        """Refresh from the bridge every interval seconds in the background"""
+        if not self.poller:
+            self.poller = HuePoller(self, interval=interval)
+        self.poller.interval = interval
+        self.poller.start()
+        return self.poller
+
+    def stop_polling(self):
+        """Stop background refreshes"""
+        if self.poller:
+            self.poller.stop()
+
+    def subscribe(self, callback, lights=None, groups=None, attrs=None,
+                    interval=DEFAULT_INTERVAL):
+        """Call callback(light, changes) when watched lights change
+            -lights, groups, attrs [ids and attrs to watch, all when None]
+            Every subscriber shares this Hue's poller
+        """
+        poller = self.poller
+        if not poller or not poller.running:
+            poller = self.start_polling(interval=interval)
+        return poller.subscribe(callback, lights=lights, groups=groups,
+                                attrs=attrs)
+
+    def changes(self, lights=None, groups=None, attrs=None,
+                    interval=DEFAULT_INTERVAL):
+        """Async iterator of (light, changes), call from a running loop"""
+        poller = self.poller
+        if not poller or not poller.running:
+            poller = self.start_polling(interval=interval)
+        return HueChangeStream(poller, lights=lights, groups=groups,
+                                attrs=attrs)
 
 
     def create_schedule(self, name, commands, description=None,
@@ -447,39 +1040,40 @@ class Hue:
             -time [datetime object]
             -repeats [optional dict with keys times = times to repeats,
                         interval dict of interval parameters]
+            Every occurrence is validated before any is created
+            Returns the HueSchedules created
         """
-        if repeats:
-            try:
-                if repeats['times'] > 1:
-                    repeats['times'] -= 1
-                    self.create_schedule(name, commands, description=description,
-                        time=time + timedelta(**repeats['interval']),
-                        repeats=repeats)
-                else:
-                    self.create_schedule(name, commands, description=description,
-                        time=time + timedelta(**repeats['interval']),
-                        repeats=None)
-            except KeyError:
-                raise InvalidHueSchedule
-        if time == None:
-           time_str = (datetime.now() + timedelta(days=1)).strftime(FRMT_STR)
-        else:
-            try:
-                time_str = time.strftime(FRMT_STR)
-            except AttributeError:
-                raise InvalidHueSchedule
+        from hue.schedules import schedule_occurrences
         if not description:
             description = 'N/A'
-        for command in commands:
-            HueSchedule(self, name, description, time_str, command)
+        return [HueSchedule(self, name, description, time_str, command)
+                    for time_str, command in
+                    schedule_occurrences(commands, time=time, repeats=repeats)]
+
+    def create_schedules(self, name, commands, description=None, time=None,
+                            repeats=None, **kwargs):
+        """Create a repeating schedule concurrently, see
+            hue.schedules.create_schedules, returns a ScheduleBatch
+        """
+        from hue.schedules import create_schedules
+        return create_schedules(self, name, commands, description=description,
+                                time=time, repeats=repeats, **kwargs)
 
     def scan_lights(self):
+        """Search for new lights, returns ids of lights added"""
         light_url = self.url + '/lights'
         self._connect_hue(light_url, method='POST')
-        resp = self._connect_hue(light_url).decode('utf-8')
-        data = json.loads(resp)
-        for light_key in data.keys():
-            if light_key not in self.lights:
-                light_data = self._connect_hue(light_url +
-                                        '/%s' % light_key).decode('utf-8')
-                self.lights[light_key] = HueLight(self, int(light_key), json.loads(light_data))
+        data = self._get_json('/lights')
+        added = []
+        for light_key in self._new_lights(data):
+            light_data = data[light_key]
+            if 'state' not in light_data:
+                light_data = self._get_json('/lights/%s' % light_key)
+            self._add_light(light_key, light_data)
+            added.append(light_key)
+        return added
+
+    def _new_lights(self, data):
+        """Ids of a /lights payload not loaded yet"""
+        return [light_key for light_key in data.keys()
+                    if light_key not in self.lights]
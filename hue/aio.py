@@ -0,0 +1,245 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Asyncio Hue, commands to many lights are sent concurrently
+
+"""
+
+from asyncio import Lock, Semaphore, gather, get_running_loop
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from functools import partial
+from hue import (Hue, HueLight, HueGroup, validate_state, MIN_BATCH_GROUP,
+                    BATCH_GROUP_NAME, )
+from hue.exceptions import HueError
+from hue.transport import DEFAULT_TIMEOUT
+
+
+DEFAULT_CONCURRENCY = 10
+
+
+def _sync_only(name):
+    """A Hue method AsyncHue cannot offer, raising TypeError"""
+    def method(self, *args, **kwargs):
+        raise TypeError('%s is not supported by AsyncHue' % name)
+    method.__name__ = name
+    method.__doc__ = 'Not supported by AsyncHue, raises TypeError'
+    return method
+
+
+class AsyncHueLight(HueLight):
+    """A Hue Light with awaitable commands"""
+
+    __slots__ = ()
+
+    async def turn_on(self):
+        """Turn Light On"""
+        response = await self.manager._connect_hue(self.state_url,
+                                    data={ 'on' : True }, method='PUT')
+        self._update_state({ 'on' : True })
+        return response
+
+    async def turn_off(self):
+        """Turn Light Off"""
+        response = await self.manager._connect_hue(self.state_url,
+                                    data={ 'on' : False }, method='PUT')
+        self._update_state({ 'on' : False })
+        return response
+
+    async def set_light_attr(self, attr, force=False):
+        """Set a current HueLight Object to accepted Hue attrs
+            -force [send every attr, not only those differing from state]
+        """
+        self._validate_attr(attr)
+        if not force:
+            attr = self._state_delta(attr)
+            if not attr:
+                return None
+        response = await self.manager._connect_hue(self.state_url, data=attr,
+                                                    method='PUT')
+        self._update_state(attr)
+        return response
+
+
+class AsyncHueGroup(HueGroup):
+    """A Hue Group whose commands fan out to every light at once"""
+
+    __slots__ = ()
+
+    async def turn_on(self, force=False):
+        """Turn every light in group on with one group action"""
+        return await self.set_attr({ 'on' : True }, force=force)
+
+    async def turn_off(self, force=False):
+        """Turn every light in group off with one group action"""
+        return await self.set_attr({ 'on' : False }, force=force)
+
+    async def set_attr(self, attr, force=False):
+        """Set every light in group to attrs with one group action"""
+        validate_state(attr)
+        if not force:
+            delta = {}
+            for light in self.lights:
+                delta.update(light._state_delta(attr))
+            if not delta:
+                return None
+            attr = dict((key, attr[key]) for key in delta)
+        response = await self.manager._connect_hue(self.state_url, data=attr,
+                                                    method='PUT')
+        for light in self.lights:
+            light._update_state(attr)
+        return response
+
+    async def set_light_attr(self, attr, force=False):
+        """Set every light in group to the same attrs, one PUT per light"""
+        return await gather(*[light.set_light_attr(dict(attr), force=force)
+                                for light in self.lights])
+
+    async def update(self, manager=None):
+        """Send the group's lights and name to the bridge"""
+        resp = await self.manager._connect_hue(self.manager.url + self.uri,
+                                        data=self._update_payload(),
+                                        method='PUT')
+        self._updated(resp)
+
+    async def delete(self):
+        """Delete a Hue lighting group"""
+        resp = await self.manager._connect_hue(self.manager.url + self.uri,
+                                                method='DELETE')
+        self._deleted(resp)
+
+
+class AsyncHue(Hue):
+    """Hue Interface for asyncio, load with await hue.load_hue()"""
+
+    light_class = AsyncHueLight
+    group_class = AsyncHueGroup
+
+    def __init__(self, host, app_key, port=80,
+                    concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT):
+        """Initialize Object for communicating with Hue Base Station
+            -concurrency [max requests in flight to the bridge]
+        """
+        super().__init__(host, app_key, port=port, load_now=False,
+                            timeout=timeout, pool_size=concurrency)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(concurrency)
+        self._semaphore = Semaphore(concurrency)
+        self._batch_lock = Lock()
+
+    async def _connect_hue(self, url, data=None, method=None):
+        """Connect To Hue Hub without blocking the event loop"""
+        call = partial(copy_context().run, super()._connect_hue, url,
+                        data=data, method=method)
+        async with self._semaphore:
+            return await get_running_loop().run_in_executor(self._executor,
+                                                            call)
+
+    async def load_hue(self):
+        """Load default Hue Response into Hue objects"""
+        resp = await self._connect_hue(self.url)
+        resp = self._load_json(resp)
+        if '0' not in resp['groups']:
+            #There exists a 0 zero group of all lights
+            group_zero = await self._connect_hue(self.url + '/groups/0')
+            resp['groups']['0'] = self._load_json(group_zero)
+        self._load_document(resp)
+        return self
+
+    async def create_group(self, lights, group_name):
+        """Create a new Hue group of lights"""
+        data = { 'lights' : [light.id for light in lights],
+                 'name' : group_name }
+        resp = await self._connect_hue(self.url + '/groups', data=data)
+        try:
+            group_id = self._load_json(resp)[0]['success']['id']
+        except (IndexError, KeyError):
+            raise HueError(resp)
+        group_id = group_id.split('/')[-1]
+        return self._add_group(group_id, group_name, lights)
+
+    async def refresh(self):
+        """Poll the bridge and update loaded objects in place
+            Returns a HueChangeSet of what changed
+        """
+        return self._refresh_document(
+                            self._load_json(await self._connect_hue(self.url)))
+
+    async def scan_lights(self):
+        """Search for new lights, returns ids of lights added"""
+        await self._connect_hue(self.url + '/lights', method='POST')
+        data = self._load_json(await self._connect_hue(self.url + '/lights'))
+        added = []
+        for light_key in self._new_lights(data):
+            light_data = data[light_key]
+            if 'state' not in light_data:
+                light_data = self._load_json(await self._connect_hue(
+                                    '%s/lights/%s' % (self.url, light_key)))
+            self._add_light(light_key, light_data)
+            added.append(light_key)
+        return added
+
+    async def apply_many(self, light_attrs, force=False):
+        """Set many lights to their own attrs in the fewest requests
+            Lights sharing a payload are sent one group action, the
+            rest are sent concurrently. Concurrent callers take turns
+            with the batch group.
+            Returns dict of light id: response, None when nothing was sent
+        """
+        results, batches = self._batches(light_attrs, force)
+        singles = []
+        for attr, light_ids in batches:
+            group = None
+            if len(light_ids) > 1:
+                group = self._group_of(light_ids)
+            response = None
+            if group:
+                response = await group.set_attr(attr, force=True)
+            elif len(light_ids) >= MIN_BATCH_GROUP:
+                async with self._batch_lock:
+                    group = await self._batch_group(light_ids)
+                    response = await group.set_attr(attr, force=True)
+            if group:
+                for light_id in light_ids:
+                    results[light_id] = response
+            else:
+                singles.extend((light_id, attr) for light_id in light_ids)
+        responses = await gather(*[
+                        self.lights[light_id].set_light_attr(attr, force=True)
+                        for light_id, attr in singles])
+        for (light_id, attr), response in zip(singles, responses):
+            results[light_id] = response
+        return results
+
+    async def _batch_group(self, light_ids):
+        """The group used by apply_many, updated to hold light_ids"""
+        lights = [self.lights[light_id] for light_id in light_ids]
+        group = self._find_batch_group()
+        if group:
+            if group.lights != lights:
+                group.lights = lights
+                await group.update()
+            return group
+        return await self.create_group(lights, BATCH_GROUP_NAME)
+
+    # Blocking loaders, the scheduler, the poller and schedules are sync
+    load_lights = _sync_only('load_lights')
+    load_groups = _sync_only('load_groups')
+    load_schedules = _sync_only('load_schedules')
+    load_config = _sync_only('load_config')
+    enable_scheduler = _sync_only('enable_scheduler')
+    start_polling = _sync_only('start_polling')
+    subscribe = _sync_only('subscribe')
+    changes = _sync_only('changes')
+    create_schedule = _sync_only('create_schedule')
+    create_schedules = _sync_only('create_schedules')
+
+    async def apply(self, commands):
+        """Await many light commands together, bounded by concurrency"""
+        return await gather(*commands)
+
+    def close(self):
+        """Stop the worker threads used for requests"""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,319 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Keyframe animations, the bridge interpolates between commands using
+transitiontime so smooth changes need few requests
+
+"""
+
+from hue.effects import HueEffect, get_engine
+from hue.exceptions import HueError
+from hue.validators import ALLOWED_STATES
+
+
+# Seconds per transitiontime step
+TRANSITION_STEP = 0.1
+MAX_TRANSITION = ALLOWED_STATES['transitiontime'][1]
+# Largest allowed gap between a keyframe and the bridge's interpolation,
+# as a fraction of each attr's range
+DEFAULT_TOLERANCE = 0.02
+FRAME_INTERVAL = 0.1
+
+# Color gamut triangles (red, green, blue) by gamut name
+GAMUTS = { 'A' : ((0.704, 0.296), (0.2151, 0.7106), (0.138, 0.08)),
+           'B' : ((0.675, 0.322), (0.409, 0.518), (0.167, 0.04)),
+           'C' : ((0.692, 0.308), (0.17, 0.7), (0.153, 0.048)) }
+MODEL_GAMUTS = { 'LCT001' : 'B', 'LCT002' : 'B', 'LCT003' : 'B',
+                 'LCT007' : 'B', 'LLM001' : 'B',
+                 'LLC001' : 'A', 'LLC005' : 'A', 'LLC006' : 'A',
+                 'LLC007' : 'A', 'LLC010' : 'A', 'LLC011' : 'A',
+                 'LLC012' : 'A', 'LLC013' : 'A', 'LST001' : 'A',
+                 'LCT010' : 'C', 'LCT014' : 'C', 'LST002' : 'C' }
+HUE_STEPS = 256
+SAT_STEPS = 64
+
+_xy_tables = {}
+
+
+def _closest_on_segment(point, start, end):
+    dx, dy = end[0] - start[0], end[1] - start[1]
+    t = ((point[0] - start[0]) * dx + (point[1] - start[1]) * dy) / \
+            (dx * dx + dy * dy)
+    t = min(1.0, max(0.0, t))
+    return (start[0] + t * dx, start[1] + t * dy)
+
+def _in_gamut(point, gamut):
+    (x1, y1), (x2, y2), (x3, y3) = gamut
+    px, py = point
+    d1 = (px - x2) * (y1 - y2) - (x1 - x2) * (py - y2)
+    d2 = (px - x3) * (y2 - y3) - (x2 - x3) * (py - y3)
+    d3 = (px - x1) * (y3 - y1) - (x3 - x1) * (py - y1)
+    negative = d1 < 0 or d2 < 0 or d3 < 0
+    positive = d1 > 0 or d2 > 0 or d3 > 0
+    return not (negative and positive)
+
+def clamp_to_gamut(point, gamut):
+    """Closest xy inside gamut triangle"""
+    if gamut is None or _in_gamut(point, gamut):
+        return point
+    red, green, blue = gamut
+    candidates = [_closest_on_segment(point, red, green),
+                  _closest_on_segment(point, green, blue),
+                  _closest_on_segment(point, blue, red)]
+    return min(candidates, key=lambda c: (c[0] - point[0]) ** 2 +
+                                            (c[1] - point[1]) ** 2)
+
+def _gamma(channel):
+    if channel > 0.04045:
+        return ((channel + 0.055) / 1.055) ** 2.4
+    return channel / 12.92
+
+def _hue_sat_to_xy(hue, sat, gamut):
+    """Exact hue/sat to xy through wide gamut RGB"""
+    h = (hue / 65535.0) * 6.0
+    s = sat / 254.0
+    sector = int(h) % 6
+    f = h - int(h)
+    p, q, t = 1.0 - s, 1.0 - s * f, 1.0 - s * (1.0 - f)
+    r, g, b = ((1.0, t, p), (q, 1.0, p), (p, 1.0, t),
+               (p, q, 1.0), (t, p, 1.0), (1.0, p, q))[sector]
+    r, g, b = _gamma(r), _gamma(g), _gamma(b)
+    x = r * 0.664511 + g * 0.154324 + b * 0.162028
+    y = r * 0.283881 + g * 0.668433 + b * 0.047685
+    z = r * 0.000088 + g * 0.072310 + b * 0.986039
+    total = x + y + z
+    return clamp_to_gamut((x / total, y / total), gamut)
+
+def xy_table(model_id=None):
+    """Hue by sat grid of xy for a light model, built once per gamut"""
+    gamut_name = MODEL_GAMUTS.get(model_id)
+    if gamut_name not in _xy_tables:
+        gamut = GAMUTS.get(gamut_name)
+        _xy_tables[gamut_name] = [
+            [_hue_sat_to_xy(hue * 65535.0 / (HUE_STEPS - 1),
+                            sat * 254.0 / (SAT_STEPS - 1), gamut)
+                for sat in range(SAT_STEPS)]
+            for hue in range(HUE_STEPS)]
+    return _xy_tables[gamut_name]
+
+def hue_sat_to_xy(hue, sat, model_id=None):
+    """xy for hue/sat on a light model, from its precomputed table"""
+    row = xy_table(model_id)[int(round(hue * (HUE_STEPS - 1) / 65535.0))]
+    return list(row[int(round(sat * (SAT_STEPS - 1) / 254.0))])
+
+def ct_to_xy(ct, model_id=None):
+    """xy on the black body curve for a color temperature in mireds"""
+    kelvin = 1000000.0 / ct
+    if kelvin <= 4000:
+        x = (-0.2661239e9 / kelvin ** 3 - 0.2343589e6 / kelvin ** 2 +
+                0.8776956e3 / kelvin + 0.179910)
+    else:
+        x = (-3.0258469e9 / kelvin ** 3 + 2.1070379e6 / kelvin ** 2 +
+                0.2226347e3 / kelvin + 0.240390)
+    if kelvin <= 2222:
+        y = -1.1063814 * x ** 3 - 1.34811020 * x ** 2 + 2.18555832 * x - 0.20219683
+    elif kelvin <= 4000:
+        y = -0.9549476 * x ** 3 - 1.37418593 * x ** 2 + 2.09137015 * x - 0.16748867
+    else:
+        y = 3.0817580 * x ** 3 - 5.87338670 * x ** 2 + 3.75112997 * x - 0.37001483
+    return list(clamp_to_gamut((x, y), GAMUTS.get(MODEL_GAMUTS.get(model_id))))
+
+
+class Keyframe:
+    """Light attrs to reach at seconds into an animation"""
+
+    def __init__(self, at, **attrs):
+        """A keyframe
+            -at [seconds from the animation start]
+            -attrs [hue and sat, xy or ct, optionally bri]
+        """
+        self.at = float(at)
+        self.attrs = attrs
+
+    @property
+    def mode(self):
+        if 'xy' in self.attrs:
+            return 'xy'
+        elif 'ct' in self.attrs:
+            return 'ct'
+        elif 'hue' in self.attrs or 'sat' in self.attrs:
+            return 'hs'
+        return None
+
+    def as_xy(self, model_id=None):
+        """Copy of attrs with the color given as xy"""
+        attrs = dict(self.attrs)
+        if self.mode == 'hs':
+            attrs['xy'] = hue_sat_to_xy(attrs.pop('hue', 0),
+                                        attrs.pop('sat', 254), model_id)
+        elif self.mode == 'ct':
+            attrs['xy'] = ct_to_xy(attrs.pop('ct'), model_id)
+        return attrs
+
+    def __repr__(self):
+        return '<Keyframe %s %s>' % (self.at, self.attrs)
+
+
+def _normalize(keyframes, model_id):
+    """Attrs of every keyframe sharing one color mode"""
+    if len(set(keyframe.mode for keyframe in keyframes)) > 1:
+        frames = [keyframe.as_xy(model_id) for keyframe in keyframes]
+    else:
+        frames = [dict(keyframe.attrs) for keyframe in keyframes]
+    keys = set(frames[0])
+    for attrs in frames:
+        if set(attrs) != keys:
+            raise HueError('Keyframes set different attrs %s %s'
+                                % (sorted(keys), sorted(attrs)))
+    return frames
+
+def _numeric(key):
+    """Range attrs the bridge can interpolate"""
+    return type(ALLOWED_STATES.get(key)) is list
+
+def _discrete(attrs):
+    """Attrs sent as they are, on, alert and the like"""
+    return dict((key, val) for key, val in attrs.items() if not _numeric(key))
+
+def _vector(attrs):
+    vector = []
+    for key in sorted(attrs):
+        if not _numeric(key):
+            continue
+        low, high = ALLOWED_STATES[key][0], ALLOWED_STATES[key][1]
+        values = attrs[key] if type(attrs[key]) in (list, tuple) \
+                    else [attrs[key]]
+        vector.extend((value - low) / float(high - low) for value in values)
+    return vector
+
+def plan_commands(keyframes, tolerance=DEFAULT_TOLERANCE, model_id=None):
+    """Fewest (seconds, attrs) commands reproducing keyframes
+        Each command moves to a later keyframe with a transitiontime the
+        bridge interpolates over, skipping keyframes that lie within
+        tolerance of that interpolation
+        Attrs that cannot be interpolated, like on, keep their value
+        through a transition and change with the command at the keyframe
+        setting them
+    """
+    keyframes = sorted(keyframes, key=lambda keyframe: keyframe.at)
+    if not keyframes:
+        return []
+    frames = _normalize(keyframes, model_id)
+    times = [keyframe.at for keyframe in keyframes]
+    vectors = [_vector(attrs) for attrs in frames]
+    discretes = [_discrete(attrs) for attrs in frames]
+
+    def fits(start, end):
+        span = times[end] - times[start]
+        if span / TRANSITION_STEP > MAX_TRANSITION:
+            return False
+        for middle in range(start + 1, end):
+            if discretes[middle] != discretes[start]:
+                return False
+            fraction = (times[middle] - times[start]) / span if span else 1.0
+            for low, high, actual in zip(vectors[start], vectors[end],
+                                            vectors[middle]):
+                if abs(low + (high - low) * fraction - actual) > tolerance:
+                    return False
+        return True
+
+    first = dict(frames[0])
+    first['transitiontime'] = 0
+    commands = [(times[0], first)]
+    start = 0
+    while start < len(frames) - 1:
+        end = start + 1
+        while end + 1 < len(frames) and fits(start, end + 1):
+            end += 1
+        attrs = dict(frames[end])
+        attrs.update(discretes[start])
+        attrs['transitiontime'] = min(MAX_TRANSITION, int(round(
+                            (times[end] - times[start]) / TRANSITION_STEP)))
+        commands.append((times[start], attrs))
+        sent = discretes[start]
+        start = end
+    if len(frames) > 1 and discretes[-1] != sent:
+        # Nothing follows the last keyframe to carry its changes
+        commands.append((times[-1], dict(discretes[-1])))
+    return commands
+
+
+class KeyframeEffect(HueEffect):
+    """Sends an animation's planned commands as they come due"""
+
+    def __init__(self, animation, interval=FRAME_INTERVAL, priority=0):
+        super().__init__('animation', animation.lights, interval=interval,
+                            priority=priority)
+        self.animation = animation
+        self.commands = animation.commands()
+        self._next = 0
+        self._cycle_start = None
+
+    def frame(self, now):
+        if self._cycle_start is None:
+            self._cycle_start = self.started
+        elapsed = now - self._cycle_start
+        attrs = None
+        # One command per frame, a transition must not replace the jump
+        # to the first keyframe sent at the same time
+        if self._next < len(self.commands) and \
+                self.commands[self._next][0] <= elapsed:
+            attrs = self.commands[self._next][1]
+            self._next += 1
+        if self._next == len(self.commands):
+            if self.animation.loop:
+                self._next = 0
+                self._cycle_start += self.animation.duration
+            else:
+                self.finished = True
+        if attrs is None:
+            return {}
+        return dict((light_id, dict(attrs)) for light_id in self.light_ids())
+
+
+class HueAnimation:
+    """Keyframe animation of a HueLight or HueGroup"""
+
+    def __init__(self, target, keyframes, tolerance=DEFAULT_TOLERANCE,
+                    loop=False):
+        """An animation
+            -target [HueLight or HueGroup]
+            -keyframes [Keyframes, at least one]
+            -tolerance [allowed interpolation error, fraction of range]
+            -loop [restart after the last keyframe]
+        """
+        self.target = target
+        self.keyframes = sorted(keyframes, key=lambda keyframe: keyframe.at)
+        self.tolerance = tolerance
+        self.loop = loop
+        if not self.keyframes:
+            raise HueError('Animation needs keyframes')
+        if loop and self.duration <= 0:
+            raise HueError('Looping animation needs a duration')
+
+    @property
+    def lights(self):
+        return getattr(self.target, 'lights', [self.target])
+
+    @property
+    def model_id(self):
+        for light in self.lights:
+            return getattr(light, 'model_id', None)
+        return None
+
+    @property
+    def duration(self):
+        return self.keyframes[-1].at - self.keyframes[0].at
+
+    def commands(self):
+        """Planned (seconds, attrs) commands"""
+        return plan_commands(self.keyframes, tolerance=self.tolerance,
+                                model_id=self.model_id)
+
+    def play(self, engine=None, priority=0):
+        """Start on the effect engine, returns the effect id"""
+        hue = self.lights[0].manager
+        engine = engine or get_engine(hue)
+        return engine.start(KeyframeEffect(self, priority=priority))
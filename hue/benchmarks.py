@@ -0,0 +1,396 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Hue benchmarks, run with python -m hue.benchmarks
+
+"""
+
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+from threading import Thread
+from time import perf_counter, time
+import tracemalloc
+from urllib.request import Request, urlopen
+from hue.transport import HueConnectionPool
+from hue.validators import ALLOWED_STATES, validate_many
+from hue import Hue, HueLight
+from hue.codec import CODECS, encode_body, current_codec
+from hue.metrics import metrics
+from hue.simulator import HueSimulator
+from hue.events import randomize_all_lights
+from hue.transport import close_pools
+import platform
+import json
+
+
+class _StateHandler(BaseHTTPRequestHandler):
+    """Answer every PUT like a bridge state change"""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def do_PUT(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        body = b'[{"success":{"/lights/1/state/on":true}}]'
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def _serve():
+    server = _Server(('127.0.0.1', 0), _StateHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _timed(func, count):
+    start = perf_counter()
+    for _ in range(count):
+        func()
+    return perf_counter() - start
+
+
+def bench_transport(count=500):
+    """Compare urlopen per command against the keep-alive pool"""
+    server = _serve()
+    host, port = server.server_address
+    path = '/api/key/lights/1/state'
+    body = json.dumps({ 'on' : True }).encode('utf-8')
+
+    def with_urlopen():
+        req = Request('http://%s:%d%s' % (host, port, path), data=body,
+                        method='PUT')
+        urlopen(req).read()
+
+    pool = HueConnectionPool(host, port)
+
+    def with_pool():
+        pool.request('PUT', path, body=body)
+
+    results = {}
+    try:
+        for name, func in (('urlopen', with_urlopen), ('pool', with_pool)):
+            elapsed = _timed(func, count)
+            results[name] = { 'seconds' : elapsed,
+                              'commands_per_sec' : count / elapsed }
+    finally:
+        pool.close()
+        server.shutdown()
+        server.server_close()
+    return results
+
+
+def _legacy_compare(val, accepted_values):
+    """Range check as done before compiled validators"""
+    if type(val) in (list, tuple):
+        return all(_legacy_compare(value, accepted_values) for value in val)
+    return type(val) == accepted_values or \
+            accepted_values[0] <= float(val) <= accepted_values[1]
+
+def _legacy_validate(attr):
+    """Validation as done before compiled validators"""
+    for key in attr.keys():
+        if type(ALLOWED_STATES[key]) == bool:
+            if attr[key] not in (True, False):
+                raise ValueError(key)
+        elif type(ALLOWED_STATES[key]) == tuple:
+            if attr[key] not in ALLOWED_STATES[key]:
+                raise ValueError(key)
+        elif not _legacy_compare(attr[key], ALLOWED_STATES[key]):
+            raise ValueError(key)
+
+
+def bench_validation(count=200000):
+    """Compare type dispatch validation against compiled validators"""
+    attr = { 'on' : True, 'bri' : 200, 'hue' : 40000, 'sat' : 200,
+             'xy' : [0.4, 0.5], 'alert' : 'select' }
+    results = {}
+    for name, func in (('legacy', _legacy_validate),
+                        ('compiled', validate_many)):
+        elapsed = _timed(lambda: func(attr), count)
+        results[name] = { 'seconds' : elapsed,
+                          'payloads_per_sec' : count / elapsed }
+    return results
+
+
+class _DictLight:
+    """The light layout before slots, instance dict and url strings"""
+
+    def __init__(self, manager, id, light_data):
+        self.id = str(id)
+        self.uri = '/lights/%s' % self.id
+        self.state_url = manager.url + self.uri + '/state'
+        self.manager = manager
+        self.name = light_data['name']
+        self.model_id = light_data['modelid']
+        self.version = light_data['swversion']
+        self.light_type = light_data['type']
+        self.point_symbols = light_data['pointsymbol']
+        self.state = dict(light_data['state'])
+
+
+class _Manager:
+    url = 'http://127.0.0.1:80/api/key'
+
+
+def _light_data(index):
+    return { 'name' : 'Light %d' % index, 'modelid' : 'LCT001',
+             'swversion' : '66009461', 'type' : 'Extended color light',
+             'pointsymbol' : {},
+             'state' : { 'on' : True, 'bri' : index % 255,
+                         'hue' : index % 65536, 'sat' : 254,
+                         'xy' : [0.4, 0.5], 'ct' : 300, 'alert' : 'none',
+                         'effect' : 'none', 'colormode' : 'hs',
+                         'reachable' : True } }
+
+
+def bench_object_model(count=5000, reads=20):
+    """Memory and state access of count lights, dict layout against slots"""
+    manager = _Manager()
+    payloads = [_light_data(index) for index in range(count)]
+    results = {}
+    for name, cls in (('dict', _DictLight), ('slots', HueLight)):
+        tracemalloc.start()
+        lights = [cls(manager, index, data)
+                    for index, data in enumerate(payloads)]
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        def read():
+            for light in lights:
+                light.state['bri']
+                light.state['on']
+        elapsed = _timed(read, reads)
+        results[name] = { 'bytes_per_light' : size / count,
+                          'state_reads_per_sec' : count * reads * 2 / elapsed }
+        if name == 'slots':
+            def read_attrs():
+                for light in lights:
+                    light.state.bri
+                    light.state.on
+            elapsed = _timed(read_attrs, reads)
+            results[name]['attr_reads_per_sec'] = count * reads * 2 / elapsed
+            attrs = { 'on' : True, 'bri' : 100, 'hue' : 5,
+                      'transitiontime' : 4 }
+
+            def deltas():
+                for light in lights:
+                    light._state_delta(attrs)
+            elapsed = _timed(deltas, reads)
+            results[name]['state_deltas_per_sec'] = count * reads / elapsed
+        del lights
+    return results
+
+
+def _bridge_dump(light_count):
+    """Synthetic full state document of a large bridge"""
+    lights = dict((str(index), _light_data(index))
+                    for index in range(1, light_count + 1))
+    groups = dict((str(index), { 'name' : 'Group %d' % index,
+                                 'lights' : [str(key) for key in
+                                    range(index, light_count + 1, 16)] })
+                    for index in range(1, 17))
+    config = { 'name' : 'Philips hue', 'mac' : '00:17:88:00:00:00',
+               'dhcp' : True, 'ipaddress' : '192.168.1.2',
+               'netmask' : '255.255.255.0', 'gateway' : '192.168.1.1',
+               'proxyaddress' : ' ', 'proxyport' : 0, 'linkbutton' : False,
+               'portalservices' : True, 'swversion' : '01003542',
+               'swupdate' : { 'updatestate' : 0, 'url' : '', 'text' : '',
+                              'notify' : False },
+               'whitelist' : dict(('key%d' % index,
+                                   { 'name' : 'app %d' % index })
+                                    for index in range(20)) }
+    return { 'lights' : lights, 'groups' : groups, 'config' : config,
+             'schedules' : {} }
+
+
+def bench_codec(light_count=500, count=50, body_count=100000):
+    """Parse and serialize a large bridge dump with every installed codec
+        legacy is the old decode then json.loads path
+    """
+    dump = _bridge_dump(light_count)
+    data = json.dumps(dump).encode('utf-8')
+    results = { 'dump_bytes' : len(data) }
+    elapsed = _timed(lambda: json.loads(data.decode('utf-8')), count)
+    results['legacy'] = { 'parse_per_sec' : count / elapsed }
+    for name, codec_class in CODECS.items():
+        codec = codec_class()
+        parse = _timed(lambda: codec.loads(data), count)
+        serialize = _timed(lambda: codec.dumps(dump), count)
+        results[name] = { 'parse_per_sec' : count / parse,
+                          'serialize_per_sec' : count / serialize }
+    on = { 'on' : True }
+    elapsed = _timed(lambda: json.dumps(on).encode('utf-8'), body_count)
+    results['on_body_legacy_per_sec'] = body_count / elapsed
+    elapsed = _timed(lambda: encode_body(on), body_count)
+    results['on_body_cached_per_sec'] = body_count / elapsed
+    return results
+
+
+class _NullTransport:
+    host = '127.0.0.1'
+
+    def request(self, method, path, body=None):
+        return b'[{"success":{"/lights/1/state/on":true}}]'
+
+
+def bench_metrics(count=100000):
+    """Cost of instrumentation on _connect_hue, against a no-op transport"""
+    hue = Hue('127.0.0.1', 'key', load_now=False)
+    hue.transport = _NullTransport()
+    url = hue.url + '/lights/1/state'
+    on = { 'on' : True }
+    send = lambda: hue._connect_hue(url, data=on, method='PUT')
+    was_enabled = metrics.enabled
+    results = {}
+    try:
+        for name, enable in (('disabled', False), ('enabled', True)):
+            metrics.enabled = enable
+            elapsed = _timed(send, count)
+            results[name] = { 'calls_per_sec' : count / elapsed,
+                              'us_per_call' : elapsed / count * 1e6 }
+    finally:
+        metrics.enabled = was_enabled
+        metrics.reset()
+    return results
+
+
+def _summary(samples):
+    """Mean and percentiles in milliseconds of timings in seconds"""
+    samples = sorted(samples)
+    pick = lambda fraction: samples[min(len(samples) - 1,
+                                        int(len(samples) * fraction))]
+    return { 'count' : len(samples),
+             'mean_ms' : sum(samples) / len(samples) * 1000,
+             'p50_ms' : pick(0.5) * 1000,
+             'p95_ms' : pick(0.95) * 1000,
+             'max_ms' : samples[-1] * 1000 }
+
+
+def _sample(func, count):
+    samples = []
+    for _ in range(count):
+        start = perf_counter()
+        func()
+        samples.append(perf_counter() - start)
+    return samples
+
+
+def bench_load_hue(light_count=50, runs=20, latency=0.0):
+    """load_hue of a simulated bridge, parse and object construction included"""
+    with HueSimulator(light_count=light_count, latency=latency) as bridge:
+        hue = Hue(bridge.host, bridge.app_key, port=bridge.port,
+                    load_now=False)
+        try:
+            results = _summary(_sample(hue.load_hue, runs))
+        finally:
+            close_pools()
+    results['lights'] = light_count
+    return results
+
+
+def bench_command_latency(count=200, latency=0.0):
+    """Round trip of single light state commands to a simulated bridge"""
+    with HueSimulator(light_count=1, latency=latency) as bridge:
+        hue = Hue(bridge.host, bridge.app_key, port=bridge.port)
+        light = hue.lights['1']
+        values = iter(range(count))
+        try:
+            return _summary(_sample(lambda: light.set_light_attr(
+                                        { 'bri' : next(values) % 255 },
+                                        force=True), count))
+        finally:
+            close_pools()
+
+
+def bench_randomize(light_count=20, rounds=20, latency=0.0):
+    """Light commands a second sent by randomize_all_lights"""
+    with HueSimulator(light_count=light_count, latency=latency) as bridge:
+        hue = Hue(bridge.host, bridge.app_key, port=bridge.port)
+        group = hue.groups['0']
+        try:
+            start = bridge.commands
+            elapsed = _timed(lambda: randomize_all_lights(group,
+                                                    ['hue', 'sat', 'bri']),
+                                rounds)
+            commands = bridge.commands - start
+        finally:
+            close_pools()
+    return { 'commands' : commands, 'seconds' : elapsed,
+             'commands_per_sec' : commands / elapsed }
+
+
+def bench_views(count=100):
+    """turn_on and turn_off views against a simulated bridge
+        Skipped unless Django and the views' dependencies are installed
+    """
+    try:
+        from django.conf import settings
+        from django.test import RequestFactory
+    except ImportError as exc:
+        return { 'skipped' : str(exc) }
+    with HueSimulator(light_count=10) as bridge:
+        if not settings.configured:
+            settings.configure(HUE_HOST=bridge.host, HUE_PORT=bridge.port,
+                                HUE_APP_KEY=bridge.app_key)
+        else:
+            settings.HUE_HOST = bridge.host
+            settings.HUE_PORT = bridge.port
+            settings.HUE_APP_KEY = bridge.app_key
+        try:
+            from hue import views
+        except ImportError as exc:
+            return { 'skipped' : str(exc) }
+        request = RequestFactory().get('/')
+        results = {}
+        try:
+            views.turn_on(request)
+            for name, view in (('turn_on', views.turn_on),
+                                ('turn_off', views.turn_off)):
+                samples = _sample(lambda: view(request, light='1'), count)
+                results[name] = _summary(samples)
+                results[name]['requests_per_sec'] = count / sum(samples)
+        finally:
+            views.invalidate()
+            close_pools()
+        return results
+
+
+BENCHMARKS = { 'transport' : bench_transport,
+               'validation' : bench_validation,
+               'object_model' : bench_object_model,
+               'codec' : bench_codec,
+               'metrics' : bench_metrics,
+               'load_hue' : bench_load_hue,
+               'command_latency' : bench_command_latency,
+               'randomize' : bench_randomize,
+               'views' : bench_views }
+
+
+def run(names=None):
+    """Results of the named benchmarks, all when None, with run details"""
+    names = names or list(BENCHMARKS.keys())
+    return { 'meta' : { 'python' : platform.python_version(),
+                        'implementation' : platform.python_implementation(),
+                        'codec' : current_codec().name,
+                        'time' : time() },
+             'results' : dict((name, BENCHMARKS[name]()) for name in names) }
+
+
+def main(names=None):
+    print(json.dumps(run(names), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    import sys
+    main(sys.argv[1:])
@@ -0,0 +1,104 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Circuit breaker failing requests fast while a bridge is unhealthy
+
+"""
+
+from collections import deque
+from threading import Lock
+from time import monotonic
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+DEFAULT_THRESHOLD = 0.5
+DEFAULT_MIN_REQUESTS = 5
+DEFAULT_WINDOW = 20
+DEFAULT_RESET_TIMEOUT = 5.0
+
+
+class CircuitBreaker:
+    """Opens when the error rate of recent requests crosses threshold
+        Once reset_timeout has passed one probe request is let through,
+        closing the circuit on success and reopening it on failure
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD,
+                    min_requests=DEFAULT_MIN_REQUESTS, window=DEFAULT_WINDOW,
+                    reset_timeout=DEFAULT_RESET_TIMEOUT):
+        """A circuit breaker
+            -threshold [failed fraction of the window that opens the circuit]
+            -min_requests [outcomes needed before the rate is trusted]
+            -window [recent outcomes the rate is taken over]
+            -reset_timeout [seconds open before a probe is allowed]
+        """
+        self.threshold = threshold
+        self.min_requests = min_requests
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.opened = 0
+        self._outcomes = deque(maxlen=window)
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = Lock()
+
+    def allow(self):
+        """Whether a request may be sent now"""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+            if self._probing:
+                return False
+            self._probing = True
+            return True
+
+    def record(self, success):
+        """Record the outcome of an allowed request
+            None frees the request's place without counting it
+        """
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probing = False
+                if success is None:
+                    return
+                if success:
+                    self._reset()
+                else:
+                    self._open()
+                return
+            if self.state == OPEN or success is None:
+                # Sent before the circuit opened, or not the bridge's fault
+                return
+            if len(self._outcomes) == self._outcomes.maxlen:
+                self._failures -= not self._outcomes[0]
+            self._outcomes.append(success)
+            self._failures += not success
+            if len(self._outcomes) >= self.min_requests and \
+                    self._failures >= self.threshold * len(self._outcomes):
+                self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened += 1
+        self._opened_at = monotonic()
+
+    def _reset(self):
+        self.state = CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+
+    def stats(self):
+        with self._lock:
+            return { 'state' : self.state, 'opened' : self.opened,
+                     'recent_requests' : len(self._outcomes),
+                     'recent_failures' : self._failures }
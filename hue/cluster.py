@@ -0,0 +1,220 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Several bridges behind one namespace, loaded and commanded in parallel
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from threading import Lock
+from hue import Hue
+from hue.exceptions import HueClusterError, HueLightDoesNotExist, \
+                            HueGroupDoesNotExist
+
+
+SEPARATOR = ':'
+
+
+def split_key(key):
+    """(bridge name, id) of a bridge:id key"""
+    bridge, sep, key_id = str(key).partition(SEPARATOR)
+    if not sep or not bridge or not key_id:
+        raise KeyError(key)
+    return bridge, key_id
+
+def join_key(bridge, key_id):
+    return '%s%s%s' % (bridge, SEPARATOR, key_id)
+
+
+class HueCluster:
+    """Many Hue bridges, lights and groups named bridge:id
+        Commands for several bridges are sent concurrently, so a call
+        takes as long as the slowest bridge rather than all of them
+    """
+
+    def __init__(self, bridges, factory=Hue, lazy=False, max_workers=None,
+                    load_now=True):
+        """A cluster of bridges
+            -bridges [dict of name: { 'host', 'app_key', optional 'port' }]
+            -factory [callable building a Hue(host, app_key, port=, lazy=)]
+            -lazy [build lazy Hue objects]
+            -max_workers [threads talking to bridges, one per bridge default]
+        """
+        self.config = dict((str(name), dict(conf))
+                            for name, conf in bridges.items())
+        for name in self.config:
+            if SEPARATOR in name:
+                raise ValueError('Bridge name %r contains %r'
+                                    % (name, SEPARATOR))
+        self.factory = factory
+        self.lazy = lazy
+        self.bridges = {}
+        self.errors = {}
+        self._executor = ThreadPoolExecutor(
+                            max_workers=max_workers or max(len(bridges), 1),
+                            thread_name_prefix='hue-cluster')
+        if load_now:
+            self.load()
+
+    def _build(self, name):
+        conf = self.config[name]
+        return self.factory(conf['host'], conf['app_key'],
+                            port=conf.get('port', 80), lazy=self.lazy)
+
+    def _run(self, func, names):
+        """func(name) for every name concurrently
+            Returns (dict of name: result, dict of name: exception)
+        """
+        # Each bridge call keeps the caller's deadline
+        futures = dict((name, self._executor.submit(copy_context().run,
+                                                    func, name))
+                        for name in names)
+        results, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except Exception as err:
+                errors[name] = err
+        return results, errors
+
+    def load(self, names=None):
+        """Build and load bridges in parallel
+            Bridges that fail are left out and kept in errors
+            Returns the names loaded
+        """
+        names = list(names or self.config.keys())
+        for name in names:
+            if name not in self.config:
+                raise KeyError(name)
+        results, errors = self._run(self._build, names)
+        for name in names:
+            self.errors.pop(name, None)
+        self.bridges.update(results)
+        for name in errors:
+            self.bridges.pop(name, None)
+        self.errors.update(errors)
+        return sorted(results.keys())
+
+    def map(self, func, names=None):
+        """func(hue) on loaded bridges concurrently, dict of name: result
+            Raises HueClusterError, with the successful results, if any
+            bridge failed
+        """
+        return self._map(lambda name, hue: func(hue), names)
+
+    def _map(self, func, names=None):
+        names = list(self.bridges.keys()) if names is None else list(names)
+        for name in names:
+            if name not in self.bridges:
+                raise KeyError(name)
+        results, errors = self._run(lambda name: func(name, self.bridges[name]),
+                                    names)
+        if errors:
+            raise HueClusterError(errors, results)
+        return results
+
+    def refresh(self):
+        """Refresh every bridge, dict of name: HueChangeSet"""
+        return self.map(lambda hue: hue.refresh())
+
+    @property
+    def lights(self):
+        return dict((join_key(name, light_id), light)
+                        for name, hue in self.bridges.items()
+                        for light_id, light in hue.lights.items())
+
+    @property
+    def groups(self):
+        return dict((join_key(name, group_id), group)
+                        for name, hue in self.bridges.items()
+                        for group_id, group in hue.groups.items())
+
+    def find_lights(self, **criteria):
+        """Hue.find_lights on every bridge, dict of bridge:light_id: light"""
+        return dict((join_key(name, light.id), light)
+                        for name, hue in self.bridges.items()
+                        for light in hue.find_lights(**criteria))
+
+    def light(self, key):
+        """HueLight of a bridge:light_id key"""
+        try:
+            bridge, light_id = split_key(key)
+            return self.bridges[bridge].lights[light_id]
+        except KeyError:
+            raise HueLightDoesNotExist(key)
+
+    def group(self, key):
+        """HueGroup of a bridge:group_id key"""
+        try:
+            bridge, group_id = split_key(key)
+            return self.bridges[bridge].groups[group_id]
+        except KeyError:
+            raise HueGroupDoesNotExist(key)
+
+    def apply_many(self, light_attrs, force=False):
+        """Hue.apply_many across bridges, every bridge at once
+            -light_attrs [dict of bridge:light_id: attrs]
+            Returns dict of bridge:light_id: response
+        """
+        per_bridge = {}
+        for key, attr in light_attrs.items():
+            self.light(key)
+            bridge, light_id = split_key(key)
+            per_bridge.setdefault(bridge, {})[light_id] = attr
+        try:
+            results = self._map(lambda name, hue: hue.apply_many(
+                                                per_bridge[name], force=force),
+                                names=per_bridge.keys())
+        except HueClusterError as err:
+            raise HueClusterError(err.errors, _flatten(err.results))
+        return _flatten(results)
+
+    def turn_on(self, keys=None):
+        """Turn on bridge:light_id keys, every light when None"""
+        if keys is None:
+            return self.map(lambda hue: hue.groups['0'].turn_on())
+        return self.apply_many(dict((key, { 'on' : True }) for key in keys))
+
+    def turn_off(self, keys=None):
+        """Turn off bridge:light_id keys, every light when None"""
+        if keys is None:
+            return self.map(lambda hue: hue.groups['0'].turn_off())
+        return self.apply_many(dict((key, { 'on' : False }) for key in keys))
+
+    def close(self):
+        """Stop the bridge threads"""
+        self._executor.shutdown(wait=False)
+
+
+def _flatten(results):
+    """dict of bridge:light_id: response of per bridge apply_many results"""
+    return dict((join_key(name, light_id), response)
+                    for name, responses in results.items()
+                    for light_id, response in responses.items())
+
+
+_clusters = {}
+_clusters_lock = Lock()
+
+
+def _cluster_key(bridges, lazy):
+    return (tuple(sorted((str(name), tuple(sorted(conf.items())))
+                            for name, conf in bridges.items())), lazy)
+
+def get_cluster(bridges, lazy=False):
+    """Shared loaded cluster of bridges, built once per configuration"""
+    key = _cluster_key(bridges, lazy)
+    with _clusters_lock:
+        if key not in _clusters:
+            _clusters[key] = HueCluster(bridges, lazy=lazy)
+        return _clusters[key]
+
+def invalidate_clusters():
+    """Drop shared clusters, the next get_cluster reloads"""
+    with _clusters_lock:
+        for cluster in _clusters.values():
+            cluster.close()
+        _clusters.clear()
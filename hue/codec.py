@@ -0,0 +1,133 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+JSON encoding and decoding of bridge payloads, bytes in and bytes out,
+through orjson or ujson when installed
+
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+# Request bodies of payloads with only these value types are cached
+CONSTANT_TYPES = (bool, str, type(None))
+MAX_CACHED_BODIES = 256
+
+
+class JsonCodec:
+    """Standard library json"""
+
+    name = 'json'
+
+    def loads(self, data):
+        return json.loads(data)
+
+    def dumps(self, obj, sort_keys=False):
+        return json.dumps(obj, separators=(',', ':'), sort_keys=sort_keys,
+                            ensure_ascii=False).encode('utf-8')
+
+
+class UjsonCodec(JsonCodec):
+    """ujson, parses bytes without decoding first"""
+
+    name = 'ujson'
+
+    def loads(self, data):
+        return ujson.loads(data)
+
+    def dumps(self, obj, sort_keys=False):
+        return ujson.dumps(obj, sort_keys=sort_keys,
+                            ensure_ascii=False).encode('utf-8')
+
+
+class OrjsonCodec(JsonCodec):
+    """orjson, reads and writes bytes natively"""
+
+    name = 'orjson'
+
+    def loads(self, data):
+        return orjson.loads(data)
+
+    def dumps(self, obj, sort_keys=False):
+        if sort_keys:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS |
+                                            orjson.OPT_SORT_KEYS)
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+CODECS = { 'json' : JsonCodec }
+if ujson is not None:
+    CODECS['ujson'] = UjsonCodec
+if orjson is not None:
+    CODECS['orjson'] = OrjsonCodec
+# Fastest first
+PREFERENCE = ('orjson', 'ujson', 'json')
+
+_codec = None
+_bodies = {}
+
+
+def get_codec(name=None):
+    """A codec by name, the fastest installed when None"""
+    if name is None:
+        name = [name for name in PREFERENCE if name in CODECS][0]
+    try:
+        return CODECS[name]()
+    except KeyError:
+        raise ValueError('JSON codec %s is not installed' % name)
+
+def set_codec(name=None):
+    """Use a codec by name for every payload, the fastest when None"""
+    global _codec
+    _codec = get_codec(name)
+    _bodies.clear()
+    return _codec
+
+def current_codec():
+    return _codec
+
+def loads(data):
+    """Python data of a json payload, bytes or str"""
+    return _codec.loads(data)
+
+def dumps(obj, sort_keys=False):
+    """json bytes of obj"""
+    return _codec.dumps(obj, sort_keys=sort_keys)
+
+def encode_body(data):
+    """Request body of a payload, bytes are sent as they are
+        Bodies of constant payloads, like { 'on' : True }, are
+        serialized once and reused
+    """
+    if isinstance(data, bytes):
+        return data
+    if type(data) is not dict:
+        return _codec.dumps(data)
+    key = []
+    for attr, val in data.items():
+        if type(val) not in CONSTANT_TYPES:
+            return _codec.dumps(data)
+        # Typed so { 'on' : 1 } does not find { 'on' : True }
+        key.append((attr, type(val), val))
+    key = frozenset(key)
+    body = _bodies.get(key)
+    if body is None:
+        body = _codec.dumps(data)
+        if len(_bodies) < MAX_CACHED_BODIES:
+            _bodies[key] = body
+    return body
+
+
+set_codec()
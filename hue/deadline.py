@@ -0,0 +1,59 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Deadlines for bridge calls, carried in a context variable so every
+request made inside a view or task shares its time budget
+
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import monotonic
+from hue.exceptions import HueDeadlineExceeded
+
+
+# Seconds a view may spend talking to bridges
+DEFAULT_DEADLINE = 5.0
+
+_deadline = ContextVar('hue_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """Bound every bridge call inside the block to seconds from now
+        Nested deadlines never extend an outer one, None adds no limit
+    """
+    if seconds is None:
+        yield _deadline.get()
+        return
+    expires = monotonic() + seconds
+    current = _deadline.get()
+    if current is not None and current < expires:
+        expires = current
+    token = _deadline.set(expires)
+    try:
+        yield expires
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    """Seconds left before the current deadline, None without one"""
+    expires = _deadline.get()
+    if expires is None:
+        return None
+    return expires - monotonic()
+
+def cap_timeout(timeout):
+    """timeout cut down to the time left
+        Raises HueDeadlineExceeded once the deadline has passed
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise HueDeadlineExceeded('Deadline exceeded')
+    if timeout is None:
+        return left
+    return min(timeout, left)
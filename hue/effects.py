@@ -0,0 +1,269 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Frame based light effects
+
+"""
+
+from itertools import count
+from threading import Lock, Thread, Event
+from time import monotonic
+from hue.exceptions import HueError
+from hue.randomize import random_states
+import logging
+
+
+DEFAULT_TICK = 0.1
+# Frames are skipped while more commands than this wait in the scheduler
+MAX_BACKLOG = 10
+
+logger = logging.getLogger(__name__)
+
+
+class HueEffect:
+    """An effect producing a frame of light attrs every interval seconds
+        Subclasses implement frame(now) returning { light id : attrs },
+        and set finished once they have nothing left to send
+        scene holds the HueScene to restore once the effect stops
+    """
+
+    def __init__(self, name, lights, interval=1.0, priority=0):
+        """An effect on lights
+            -interval [seconds between frames]
+            -priority [higher priority effects win lights they share]
+        """
+        self.name = name
+        self.lights = list(lights)
+        self.interval = float(interval)
+        self.priority = priority
+        self.id = None
+        self.started = None
+        self.next_due = None
+        self.frames = 0
+        self.skipped = 0
+        self.max_lag = 0.0
+        self.total_time = 0.0
+        self.finished = False
+        self.scene = None
+
+    def light_ids(self):
+        return [light.id for light in self.lights]
+
+    def frame(self, now):
+        raise NotImplementedError
+
+    def stats(self):
+        """Timing of this effect"""
+        return { 'id' : self.id,
+                 'name' : self.name,
+                 'lights' : self.light_ids(),
+                 'interval' : self.interval,
+                 'priority' : self.priority,
+                 'frames' : self.frames,
+                 'skipped' : self.skipped,
+                 'max_lag' : self.max_lag,
+                 'avg_frame_time' : self.total_time / self.frames
+                                        if self.frames else 0.0 }
+
+
+class RandomizeEffect(HueEffect):
+    """Random attrs on every light each frame"""
+
+    def __init__(self, lights, attrs, interval=1.0, priority=0, rng=None,
+                    name='randomize'):
+        super().__init__(name, lights, interval=interval, priority=priority)
+        self.attrs = attrs
+        self.rng = rng
+
+    def frame(self, now):
+        states = random_states(len(self.lights), self.attrs,
+                                base={ 'on' : True }, rng=self.rng)
+        return dict(zip(self.light_ids(), states))
+
+
+class HueEffectEngine:
+    """Runs effects on a fixed tick, keeping to schedule without drift"""
+
+    def __init__(self, hue, tick=DEFAULT_TICK, max_backlog=MAX_BACKLOG):
+        """An effect engine for a loaded Hue
+            -tick [seconds between checks for due frames]
+            -max_backlog [queued scheduler commands at which frames skip]
+        """
+        self.hue = hue
+        self.tick = tick
+        self.max_backlog = max_backlog
+        self.sends = 0
+        self.send_time = 0.0
+        self.backlog_skips = 0
+        self._effects = {}
+        self._ids = count(1)
+        self._lock = Lock()
+        # Held while a frame is sent, so stop() returns after its last frame
+        self._sending = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    def start(self, effect):
+        """Run effect, returns its id"""
+        with self._lock:
+            effect.id = str(next(self._ids))
+            effect.started = monotonic()
+            effect.next_due = effect.started
+            self._effects[effect.id] = effect
+        self._ensure_running()
+        return effect.id
+
+    def stop(self, effect_id=None):
+        """Stop effect by id, the most recently started when None
+            Returns the effect once no frame of it is being sent
+        """
+        with self._lock:
+            if effect_id is None:
+                if not self._effects:
+                    raise HueError('No effect running')
+                effect_id = max(self._effects,
+                                key=lambda key: self._effects[key].started)
+            try:
+                effect = self._effects.pop(str(effect_id))
+            except KeyError:
+                raise HueError('No effect %s' % effect_id)
+        with self._sending:
+            return effect
+
+    def rebind(self, hue):
+        """Move running effects to hue, a reloaded client of the same
+            bridge, dropping lights it no longer has
+        """
+        with self._sending:
+            with self._lock:
+                self.hue = hue
+                for effect in self._effects.values():
+                    effect.lights = [hue.lights[light.id]
+                                        for light in effect.lights
+                                        if light.id in hue.lights]
+
+    def list(self):
+        """Stats of every running effect"""
+        with self._lock:
+            return [effect.stats() for effect in self._effects.values()]
+
+    def stats(self):
+        """Engine timing and every running effect's stats"""
+        return { 'tick' : self.tick,
+                 'sends' : self.sends,
+                 'avg_send_time' : self.send_time / self.sends
+                                        if self.sends else 0.0,
+                 'backlog_skips' : self.backlog_skips,
+                 'effects' : self.list() }
+
+    def shutdown(self):
+        """Stop every effect and the engine thread"""
+        with self._lock:
+            self._effects.clear()
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def _ensure_running(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = Thread(target=self._run, name='hue-effects',
+                                        daemon=True)
+                self._thread.start()
+
+    def _owners(self, effects):
+        """Effect owning each light, higher priority then newest wins"""
+        owners = {}
+        for effect in sorted(effects, key=lambda e: (e.priority, e.started)):
+            for light_id in effect.light_ids():
+                owners[light_id] = effect
+        return owners
+
+    def _bridge_behind(self):
+        scheduler = self.hue.scheduler
+        return scheduler is not None and scheduler.depth() >= self.max_backlog
+
+    def run_frame(self, now=None):
+        """Send frames of every due effect, returns lights sent"""
+        with self._sending:
+            return self._run_frame(monotonic() if now is None else now)
+
+    def _run_frame(self, now):
+        with self._lock:
+            effects = list(self._effects.values())
+        due = []
+        for effect in effects:
+            if effect.next_due > now:
+                continue
+            lag = now - effect.next_due
+            effect.max_lag = max(effect.max_lag, lag)
+            # Stay on the original grid, skipping frames we are too late for
+            missed = int(lag // effect.interval)
+            effect.skipped += missed
+            effect.next_due += (missed + 1) * effect.interval
+            due.append(effect)
+        if not due:
+            return {}
+        if self._bridge_behind():
+            self.backlog_skips += 1
+            for effect in due:
+                effect.skipped += 1
+            return {}
+        owners = self._owners(effects)
+        payloads = {}
+        for effect in due:
+            start = monotonic()
+            for light_id, attrs in effect.frame(now).items():
+                if owners.get(light_id) is effect:
+                    payloads[light_id] = attrs
+            effect.frames += 1
+            effect.total_time += monotonic() - start
+            if effect.finished:
+                with self._lock:
+                    self._effects.pop(effect.id, None)
+        if payloads:
+            start = monotonic()
+            self.hue.apply_many(payloads)
+            self.sends += 1
+            self.send_time += monotonic() - start
+        return payloads
+
+    def _run(self):
+        next_tick = monotonic()
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._effects:
+                    self._thread = None
+                    return
+            try:
+                self.run_frame()
+            except Exception:
+                logger.exception('Hue effect frame failed')
+            next_tick += self.tick
+            now = monotonic()
+            if next_tick < now:
+                # Behind a whole tick, resync instead of bursting
+                next_tick = now
+            self._stop.wait(next_tick - now)
+
+
+_engines = {}
+_engines_lock = Lock()
+
+
+def get_engine(hue, tick=DEFAULT_TICK):
+    """The shared effect engine of a Hue's bridge
+        A reloaded Hue of the same bridge takes over its running effects
+    """
+    key = (hue.host, hue.port, hue.app_key)
+    with _engines_lock:
+        engine = _engines.get(key)
+        if engine is None:
+            engine = _engines[key] = HueEffectEngine(hue, tick=tick)
+        elif engine.hue is not hue:
+            engine.rebind(hue)
+        return engine
@@ -1,11 +1,24 @@
+from asyncio import gather
+from hue.randomize import random_states
 
 
-
-def randomize_all_lights(group, attrs):
-    for light in group.lights:
-        data = {}
-        if not light.get_state_status('on'):
-            light.turn_on()
-        for attr in attrs:
-            data[attr] = light.get_light_attr_random(attr)
+def randomize_all_lights(group, attrs, same=False, rng=None):
+    """Set every light in group to random attrs
+        -same [use one random payload for the whole group, sent as one
+                group action]
+        -rng [HueRandom to draw from, seed one for reproducible effects]
+    """
+    if same and group.lights:
+        return group.set_attr(random_states(1, attrs, base={ 'on' : True },
+                                            rng=rng)[0])
+    states = random_states(len(group.lights), attrs, base={ 'on' : True },
+                            rng=rng)
+    for light, data in zip(group.lights, states):
         light.set_light_attr(data)
+
+async def randomize_all_lights_async(group, attrs, rng=None):
+    """randomize_all_lights for AsyncHue, every light is sent at once"""
+    states = random_states(len(group.lights), attrs, base={ 'on' : True },
+                            rng=rng)
+    return await gather(*[light.set_light_attr(data)
+                            for light, data in zip(group.lights, states)])
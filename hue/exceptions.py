@@ -14,6 +14,15 @@ class InvalidLightAttrValue(Exception):
         self.message = "Hue Light Attribute out of allowed range [%s] [%s]" % (key, value)
 
 
+class InvalidLightAttrs(InvalidLightAttr, InvalidLightAttrValue):
+    def __init__(self, errors):
+        self.errors = errors
+        self.message = "Invalid Hue Light Attributes %s" % \
+                    ', '.join(("[%s]" if unknown else "[%s] [%s]") %
+                              ((key, ) if unknown else (key, value))
+                              for key, value, unknown in errors)
+
+
 class InvalidHueHub(Exception):
     pass
 
@@ -40,3 +49,17 @@ class HueGroupInvalid(Exception):
 
 class InvalidLight(Exception):
    pass
+
+class HueClusterError(HueError):
+    def __init__(self, errors, results=None):
+        self.errors = errors
+        self.results = results or {}
+        self.message = "Hue bridges failed %s" % \
+                    ', '.join("[%s] [%s]" % (name, getattr(err, 'message', err))
+                              for name, err in sorted(errors.items()))
+
+class HueDeadlineExceeded(InvalidHueHub):
+    pass
+
+class HueCircuitOpen(InvalidHueHub):
+    pass
@@ -0,0 +1,233 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Light state history, buffered in memory and written to the database in
+batches from a background thread
+
+"""
+
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from threading import Event, Lock, Thread
+from time import monotonic, time
+from hue import codec
+import logging
+
+
+BATCH_SIZE = 500
+FLUSH_INTERVAL = 5.0
+# Changes buffered at most, the oldest are dropped past this
+MAX_BUFFER = 50000
+# Rows older than this are merged into one row per light and bucket
+DOWNSAMPLE_BUCKET = timedelta(minutes=15)
+
+logger = logging.getLogger(__name__)
+
+
+def _timestamp(seconds):
+    """Model datetime of a time() value, aware when settings.USE_TZ"""
+    from django.conf import settings
+    if getattr(settings, 'USE_TZ', False):
+        return datetime.fromtimestamp(seconds, timezone.utc)
+    return datetime.fromtimestamp(seconds)
+
+def write_rows(changes):
+    """bulk_create LightStateChange rows of (bridge, light, at, source,
+        attrs) changes
+    """
+    from hue.models import LightStateChange
+    LightStateChange.objects.bulk_create([
+            LightStateChange(bridge=bridge, light=light_id,
+                                at=_timestamp(at), source=source,
+                                attrs=codec.dumps(attrs).decode('utf-8'))
+            for bridge, light_id, at, source, attrs in changes],
+            batch_size=BATCH_SIZE)
+
+
+class HueHistoryRecorder:
+    """Records changed light attrs, never blocking the caller on I/O
+        record() only appends to a buffer, a writer thread flushes it
+        every batch_size changes or flush_interval seconds
+    """
+
+    def __init__(self, writer=write_rows, batch_size=BATCH_SIZE,
+                    flush_interval=FLUSH_INTERVAL, max_buffer=MAX_BUFFER):
+        """A history recorder
+            -writer [callable writing a list of (bridge, light id, time,
+                        source, attrs) changes]
+            -batch_size [buffered changes that wake the writer early]
+            -flush_interval [most seconds a change waits to be written]
+            -max_buffer [changes kept while the writer falls behind]
+        """
+        self.writer = writer
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.recorded = 0
+        self.written = 0
+        self.dropped = 0
+        self.errors = 0
+        self._buffer = deque(maxlen=max_buffer)
+        self._wake = Event()
+        self._stop = Event()
+        self._flush_lock = Lock()
+        self._thread = None
+
+    def attach(self, hue):
+        """Record hue's light changes, commands and refreshes alike"""
+        hue.history = self
+        self.start()
+        return self
+
+    def record(self, bridge, light_id, attrs, source='command', at=None):
+        """Buffer a light's changed attrs
+            -source [command when sent by us, bridge when found by refresh]
+        """
+        if len(self._buffer) == self._buffer.maxlen:
+            # The append drops the oldest change
+            self.dropped += 1
+        self._buffer.append((bridge, str(light_id),
+                                time() if at is None else at, source,
+                                dict(attrs)))
+        self.recorded += 1
+        if len(self._buffer) >= self.batch_size:
+            self._wake.set()
+
+    def pending(self):
+        return len(self._buffer)
+
+    def flush(self):
+        """Write every buffered change now, returns changes written"""
+        with self._flush_lock:
+            written = 0
+            while self._buffer:
+                batch = []
+                while self._buffer and len(batch) < self.batch_size:
+                    batch.append(self._buffer.popleft())
+                try:
+                    self.writer(batch)
+                except Exception:
+                    # Dropped rather than retried, the command path
+                    # must not wait on a failing database
+                    self.errors += 1
+                    logger.exception('Writing %d Hue history changes failed',
+                                        len(batch))
+                    continue
+                written += len(batch)
+            self.written += written
+            return written
+
+    def start(self):
+        """Start the writer thread"""
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = Thread(target=self._run, name='hue-history',
+                                    daemon=True)
+            self._thread.start()
+
+    def stop(self, flush=True):
+        """Stop the writer thread, writing what is buffered when flush"""
+        self._stop.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if flush:
+            self.flush()
+
+    def stats(self):
+        return { 'recorded' : self.recorded, 'written' : self.written,
+                 'pending' : self.pending(), 'dropped' : self.dropped,
+                 'errors' : self.errors }
+
+    def _run(self):
+        next_flush = monotonic() + self.flush_interval
+        while not self._stop.is_set():
+            self._wake.wait(max(next_flush - monotonic(), 0))
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            if len(self._buffer) >= self.batch_size or \
+                    monotonic() >= next_flush:
+                self.flush()
+                next_flush = monotonic() + self.flush_interval
+
+
+def downsample(rows, bucket=DOWNSAMPLE_BUCKET):
+    """Merge rows into one per light and bucket of time
+        -rows [(bridge, light id, at, source, attrs) in time order]
+        Later attrs win, the merged row keeps the time of the last row
+        Returns the merged rows
+    """
+    merged = {}
+    order = []
+    seconds = bucket.total_seconds()
+    for bridge, light_id, at, source, attrs in rows:
+        stamp = at.timestamp() if isinstance(at, datetime) else at
+        key = (bridge, light_id, int(stamp // seconds))
+        if key not in merged:
+            order.append(key)
+            merged[key] = [bridge, light_id, at, source, {}]
+        row = merged[key]
+        row[2] = at
+        if source != row[3]:
+            row[3] = 'mixed'
+        row[4].update(attrs)
+    return [tuple(merged[key]) for key in order]
+
+
+def prune_history(retention=None, downsample_after=None,
+                    bucket=DOWNSAMPLE_BUCKET, now=None, chunk_size=BATCH_SIZE):
+    """Retention job for LightStateChange rows
+        -retention [timedelta, rows older than this are deleted]
+        -downsample_after [timedelta, older rows are merged per bucket]
+        Returns (rows deleted, rows merged away)
+    """
+    from django.db import transaction
+    from hue.models import LightStateChange
+    now = now or _timestamp(time())
+    deleted = merged = 0
+    if retention is not None:
+        deleted = LightStateChange.objects.filter(
+                                    at__lt=now - retention).delete()
+        # Django 1.9 and later return (count, per model counts)
+        deleted = deleted[0] if isinstance(deleted, tuple) else 0
+    if downsample_after is None:
+        return deleted, merged
+    old = LightStateChange.objects.filter(at__lt=now - downsample_after) \
+                                    .order_by('bridge', 'light', 'at')
+    ids, rows = [], []
+    for change in old.iterator():
+        ids.append(change.pk)
+        rows.append((change.bridge, change.light, change.at, change.source,
+                        codec.loads(change.attrs)))
+    compact = downsample(rows, bucket)
+    if len(compact) == len(rows):
+        return deleted, merged
+    with transaction.atomic():
+        for start in range(0, len(ids), chunk_size):
+            LightStateChange.objects.filter(
+                            pk__in=ids[start:start + chunk_size]).delete()
+        LightStateChange.objects.bulk_create([
+                LightStateChange(bridge=bridge, light=light_id, at=at,
+                                    source=source,
+                                    attrs=codec.dumps(attrs).decode('utf-8'))
+                for bridge, light_id, at, source, attrs in compact],
+                batch_size=chunk_size)
+    merged = len(rows) - len(compact)
+    return deleted, merged
+
+
+_recorder = None
+_recorder_lock = Lock()
+
+
+def get_recorder(**kwargs):
+    """The shared history recorder, started on first use"""
+    global _recorder
+    with _recorder_lock:
+        if _recorder is None:
+            _recorder = HueHistoryRecorder(**kwargs)
+            _recorder.start()
+        return _recorder
@@ -0,0 +1,119 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Secondary indexes of a bridge's lights and groups
+
+"""
+
+from threading import Lock
+
+
+# Indexed light fields, by the find_lights keyword naming them
+LIGHT_FIELDS = { 'name' : lambda light: light.name,
+                 'light_type' : lambda light: light.light_type,
+                 'model_id' : lambda light: light.model_id,
+                 'reachable' : lambda light: getattr(light.state, 'reachable',
+                                                        None) }
+
+
+class HueIndex:
+    """Light ids by name, type, model and reachable, and group ids by light
+        Kept up to date incrementally as lights and groups change
+    """
+
+    def __init__(self):
+        self._fields = dict((field, {}) for field in LIGHT_FIELDS)
+        # light id: indexed values, to find the entries to drop on change
+        self._values = {}
+        # group id: member light ids, light id: group ids
+        self._members = {}
+        self._groups_of = {}
+        self._lock = Lock()
+
+    def _drop_light(self, light_id):
+        values = self._values.pop(light_id, None)
+        if values is None:
+            return
+        for field, value in values.items():
+            ids = self._fields[field].get(value)
+            if ids is not None:
+                ids.discard(light_id)
+                if not ids:
+                    del self._fields[field][value]
+
+    def add_light(self, light):
+        """Index a new or changed light"""
+        with self._lock:
+            self._drop_light(light.id)
+            values = dict((field, get(light))
+                            for field, get in LIGHT_FIELDS.items())
+            for field, value in values.items():
+                self._fields[field].setdefault(value, set()).add(light.id)
+            self._values[light.id] = values
+
+    update_light = add_light
+
+    def remove_light(self, light_id):
+        """Drop a light and its group memberships"""
+        with self._lock:
+            self._drop_light(light_id)
+            for group_id in self._groups_of.pop(light_id, ()):
+                self._members[group_id].discard(light_id)
+
+    def _drop_group(self, group_id):
+        for light_id in self._members.pop(group_id, ()):
+            group_ids = self._groups_of.get(light_id)
+            if group_ids is not None:
+                group_ids.discard(group_id)
+                if not group_ids:
+                    del self._groups_of[light_id]
+
+    def set_group(self, group):
+        """Index a new group or the changed members of a group"""
+        with self._lock:
+            self._drop_group(group.id)
+            members = set(str(getattr(light, 'id', light))
+                            for light in group.lights)
+            self._members[group.id] = members
+            for light_id in members:
+                self._groups_of.setdefault(light_id, set()).add(group.id)
+
+    def remove_group(self, group_id):
+        """Drop a group"""
+        with self._lock:
+            self._drop_group(group_id)
+
+    def clear_lights(self):
+        with self._lock:
+            self._values.clear()
+            for field in self._fields.values():
+                field.clear()
+
+    def clear_groups(self):
+        with self._lock:
+            self._members.clear()
+            self._groups_of.clear()
+
+    def light_ids(self, **criteria):
+        """Ids of lights matching every field=value given, as a set
+            -criteria [name, light_type, model_id, reachable]
+        """
+        with self._lock:
+            matches = None
+            for field, value in criteria.items():
+                if field not in self._fields:
+                    raise TypeError('Unknown light field %s' % field)
+                ids = self._fields[field].get(value, set())
+                matches = set(ids) if matches is None else matches & ids
+                if not matches:
+                    return set()
+            if matches is None:
+                return set(self._values)
+            return matches
+
+    def group_ids(self, light_id):
+        """Ids of the groups a light belongs to, as a set"""
+        with self._lock:
+            return set(self._groups_of.get(str(light_id), ()))
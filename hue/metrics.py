@@ -0,0 +1,197 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Bridge request and load timing, rendered in Prometheus text format
+
+"""
+
+from bisect import bisect_left
+from threading import Lock
+from time import perf_counter
+
+
+# Histogram bucket upper bounds in seconds
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                    10.0)
+PHASE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5,
+                    5.0)
+MAX_ENDPOINTS = 1024
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count of observations"""
+
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(le, count) pairs, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'), ), self.counts):
+            total += count
+            yield bound, total
+
+
+def endpoint(path):
+    """Path template of a bridge api path, the app key and ids removed
+        /api/<key>/lights/3/state is /lights/:id/state
+    """
+    parts = path.strip('/').split('/')
+    if parts[0] == 'api':
+        parts = parts[2:]
+    return '/' + '/'.join(':id' if part.isdigit() else part
+                            for part in parts)
+
+
+class HueMetrics:
+    """Counters and histograms of bridge I/O, off until enabled
+        Disabled, the hot path costs one attribute check
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self._lock = Lock()
+        self._endpoints = {}
+        self.reset()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        """Drop every recorded value"""
+        with self._lock:
+            self.requests = {}
+            self.bytes_sent = {}
+            self.bytes_received = {}
+            self.errors = {}
+            self.bridge_errors = {}
+            self.phases = {}
+
+    def _endpoint(self, path):
+        template = self._endpoints.get(path)
+        if template is None:
+            template = endpoint(path)
+            if len(self._endpoints) < MAX_ENDPOINTS:
+                self._endpoints[path] = template
+        return template
+
+    def request(self, transport, method, path, body=None):
+        """transport.request, timed and counted"""
+        labels = (transport.host, method, self._endpoint(path))
+        start = perf_counter()
+        try:
+            data = transport.request(method, path, body=body)
+        except Exception as exc:
+            self.count_error(labels, exc)
+            raise
+        elapsed = perf_counter() - start
+        with self._lock:
+            histogram = self.requests.get(labels)
+            if histogram is None:
+                histogram = self.requests[labels] = Histogram(REQUEST_BUCKETS)
+            histogram.observe(elapsed)
+            self.bytes_sent[labels] = self.bytes_sent.get(labels, 0) + \
+                                        (len(body) if body else 0)
+            self.bytes_received[labels] = \
+                                self.bytes_received.get(labels, 0) + len(data)
+            # Bridges report failures as 200 responses of error entries
+            if b'"error"' in data:
+                self.bridge_errors[labels] = \
+                                self.bridge_errors.get(labels, 0) + 1
+        return data
+
+    def count_error(self, labels, exc):
+        """Count an exception raised talking to the bridge
+            -labels [(host, method, endpoint)]
+        """
+        key = labels + (type(exc).__name__, )
+        with self._lock:
+            self.errors[key] = self.errors.get(key, 0) + 1
+
+    def phase(self, name, start):
+        """Observe a load phase begun at perf_counter() start
+            Returns now, the start of the next phase
+        """
+        now = perf_counter()
+        with self._lock:
+            histogram = self.phases.get(name)
+            if histogram is None:
+                histogram = self.phases[name] = Histogram(PHASE_BUCKETS)
+            histogram.observe(now - start)
+        return now
+
+    def render(self):
+        """Every metric in Prometheus text exposition format"""
+        lines = []
+        request_labels = ('host', 'method', 'endpoint')
+        with self._lock:
+            _histogram(lines, 'hue_request_seconds',
+                        'Bridge request latency', request_labels,
+                        self.requests)
+            _counter(lines, 'hue_request_bytes_sent_total',
+                        'Request body bytes sent to bridges', request_labels,
+                        self.bytes_sent)
+            _counter(lines, 'hue_response_bytes_received_total',
+                        'Response bytes received from bridges',
+                        request_labels, self.bytes_received)
+            _counter(lines, 'hue_request_errors_total',
+                        'Exceptions raised by bridge requests',
+                        request_labels + ('error', ), self.errors)
+            _counter(lines, 'hue_bridge_error_responses_total',
+                        'Responses holding bridge error entries',
+                        request_labels, self.bridge_errors)
+            _histogram(lines, 'hue_load_phase_seconds',
+                        'Time spent in each phase of load_hue', ('phase', ),
+                        dict(((name, ), histogram)
+                                for name, histogram in self.phases.items()))
+        return '\n'.join(lines) + '\n'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                        .replace('\n', '\\n')
+
+def _labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value))
+                for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs)
+
+def _counter(lines, name, help_text, label_names, values):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s counter' % name)
+    for labels, value in sorted(values.items()):
+        lines.append('%s%s %s' % (name, _labels(label_names, labels), value))
+
+def _histogram(lines, name, help_text, label_names, histograms):
+    lines.append('# HELP %s %s' % (name, help_text))
+    lines.append('# TYPE %s histogram' % name)
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append('%s_bucket%s %d' % (name,
+                            _labels(label_names, labels, 'le="%s"' % le),
+                            count))
+        lines.append('%s_sum%s %r' % (name, _labels(label_names, labels),
+                                        histogram.sum))
+        lines.append('%s_count%s %d' % (name, _labels(label_names, labels),
+                                        histogram.count))
+
+
+metrics = HueMetrics()
@@ -1,3 +1,35 @@
 from django.db import models
 
 # Create your models here.
+
+
+class Scene(models.Model):
+    """A HueScene saved for a bridge, states is its json"""
+    name = models.CharField(max_length=64)
+    bridge = models.CharField(max_length=255)
+    states = models.TextField()
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('bridge', 'name')
+
+    def __unicode__(self):
+        return '%s %s' % (self.bridge, self.name)
+
+
+class LightStateChange(models.Model):
+    """Light attrs that changed at a time, attrs is their json
+        source is command, bridge, or mixed once downsampled
+    """
+    bridge = models.CharField(max_length=255)
+    light = models.CharField(max_length=16)
+    at = models.DateTimeField(db_index=True)
+    source = models.CharField(max_length=8, default='command')
+    attrs = models.TextField()
+
+    class Meta:
+        index_together = [('bridge', 'light', 'at')]
+
+    def __unicode__(self):
+        return '%s %s %s' % (self.bridge, self.light, self.at)
@@ -0,0 +1,97 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Random light states for many lights at once, vectorized with NumPy
+when it is installed
+
+"""
+
+from random import Random
+from hue.exceptions import InvalidLightAttr
+from hue.validators import ALLOWED_STATES, VECTOR_STATES
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class HueRandom:
+    """Random attr values within ALLOWED_STATES, seedable"""
+
+    def __init__(self, seed=None, use_numpy=True):
+        """A random state generator
+            -seed [seed for reproducible values]
+            -use_numpy [use NumPy when installed]
+        """
+        self.use_numpy = bool(use_numpy and numpy is not None)
+        if self.use_numpy:
+            self._rng = numpy.random.default_rng(seed)
+        else:
+            self._rng = Random(seed)
+
+    def values(self, attr, count):
+        """count random values for attr"""
+        try:
+            allowed = ALLOWED_STATES[attr]
+        except KeyError as key_err:
+            raise InvalidLightAttr(key_err.args)
+        if self.use_numpy:
+            return self._numpy_values(attr, allowed, count)
+        return self._python_values(attr, allowed, count)
+
+    def _numpy_values(self, attr, allowed, count):
+        rng = self._rng
+        if allowed is bool:
+            return rng.integers(0, 2, size=count).astype(bool).tolist()
+        elif type(allowed) == tuple:
+            return [allowed[index] for index
+                        in rng.integers(0, len(allowed), size=count)]
+        elif attr in VECTOR_STATES:
+            return rng.uniform(allowed[0], allowed[1],
+                                size=(count, VECTOR_STATES[attr])).tolist()
+        elif type(allowed[1]) == int:
+            return rng.integers(allowed[0], allowed[1] + 1,
+                                size=count).tolist()
+        return rng.uniform(allowed[0], allowed[1], size=count).tolist()
+
+    def _python_values(self, attr, allowed, count):
+        rng = self._rng
+        if allowed is bool:
+            return [rng.random() < 0.5 for _ in range(count)]
+        elif type(allowed) == tuple:
+            return [rng.choice(allowed) for _ in range(count)]
+        elif attr in VECTOR_STATES:
+            length = VECTOR_STATES[attr]
+            return [[rng.uniform(allowed[0], allowed[1])
+                        for _ in range(length)] for _ in range(count)]
+        elif type(allowed[1]) == int:
+            return [rng.randint(allowed[0], allowed[1]) for _ in range(count)]
+        return [rng.uniform(allowed[0], allowed[1]) for _ in range(count)]
+
+    def states(self, count, attrs, base=None):
+        """count random payloads of attrs, each starting from base"""
+        columns = [(attr, self.values(attr, count)) for attr in attrs]
+        states = []
+        for index in range(count):
+            state = dict(base) if base else {}
+            for attr, values in columns:
+                state[attr] = values[index]
+            states.append(state)
+        return states
+
+    def group_states(self, lights, attrs, base=None):
+        """Random payload per light, dict of light id: attrs"""
+        lights = list(lights)
+        states = self.states(len(lights), attrs, base=base)
+        return dict((light.id, state) for light, state in zip(lights, states))
+
+
+default_random = HueRandom()
+
+
+def random_states(count, attrs, base=None, rng=None):
+    """count random payloads of attrs, from rng or the shared generator"""
+    return (rng or default_random).states(count, attrs, base=base)
@@ -0,0 +1,117 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Process wide cache of loaded Hue clients
+
+"""
+
+from threading import Lock
+from time import monotonic
+from hue import Hue
+from hue.snapshot import warm_start, write_snapshot, snapshot_path
+
+
+DEFAULT_TTL = 300
+# ttl of get calls that leave it out, the registry's own ttl
+REGISTRY_TTL = object()
+
+
+class HueRegistry:
+    """Thread safe cache of loaded Hue objects keyed by bridge
+        Expired entries are refreshed from the bridge, not rebuilt
+    """
+
+    def __init__(self, ttl=DEFAULT_TTL, factory=Hue):
+        """A registry of Hue clients
+            -ttl [seconds before a cached Hue is reloaded, None never expires]
+            -factory [callable building a Hue(host, app_key, port=, lazy=)]
+        """
+        self.ttl = ttl
+        self.factory = factory
+        self._entries = {}
+        self._locks = {}
+        self._lock = Lock()
+
+    def _key_lock(self, key):
+        """Get the lock serializing loads of a single bridge"""
+        with self._lock:
+            if key not in self._locks:
+                self._locks[key] = Lock()
+            return self._locks[key]
+
+    def _is_fresh(self, entry, ttl):
+        if ttl is None:
+            return True
+        return monotonic() - entry[1] < ttl
+
+    def get(self, host, app_key, port=80, ttl=REGISTRY_TTL, lazy=False,
+                snapshot_dir=None):
+        """Get a loaded Hue for bridge, loading or revalidating if needed
+            -ttl [seconds before a cached Hue is reloaded, None never expires,
+                    the registry's ttl when left out]
+            -lazy [build a lazy Hue when one has to be created]
+            -snapshot_dir [start new Hue objects from their snapshot in
+                            this directory, and keep it current]
+        """
+        key = (host, app_key, port)
+        if ttl is REGISTRY_TTL:
+            ttl = self.ttl
+        entry = self._entries.get(key)
+        if entry and self._is_fresh(entry, ttl):
+            return entry[0]
+        with self._key_lock(key):
+            # Another thread may have loaded it while we waited
+            entry = self._entries.get(key)
+            if entry and self._is_fresh(entry, ttl):
+                return entry[0]
+            if entry:
+                # Revalidate in place so held references stay current
+                hue = entry[0]
+                hue.refresh()
+                if snapshot_dir:
+                    write_snapshot(hue, snapshot_path(snapshot_dir, host,
+                                                        app_key, port))
+            elif snapshot_dir:
+                hue = warm_start(host, app_key, port=port,
+                                    cache_dir=snapshot_dir, lazy=lazy,
+                                    factory=self.factory)
+            else:
+                hue = self.factory(host, app_key, port=port, lazy=lazy)
+            self._entries[key] = (hue, monotonic())
+            return hue
+
+    def invalidate(self, host=None, app_key=None, port=None):
+        """Drop cached Hue objects, all of them when no bridge is given"""
+        with self._lock:
+            for key in list(self._entries.keys()):
+                if host is not None and key[0] != host:
+                    continue
+                if app_key is not None and key[1] != app_key:
+                    continue
+                if port is not None and key[2] != port:
+                    continue
+                del self._entries[key]
+
+    def clear(self):
+        """Drop every cached Hue object"""
+        self.invalidate()
+
+
+registry = HueRegistry()
+
+
+def get_hue(host, app_key, port=80, ttl=REGISTRY_TTL, lazy=False,
+                snapshot_dir=None):
+    """Get a shared loaded Hue from the process wide registry
+        -ttl [seconds before the cached Hue is reloaded, None never expires,
+                DEFAULT_TTL when left out]
+    """
+    return registry.get(host, app_key, port=port, ttl=ttl, lazy=lazy,
+                        snapshot_dir=snapshot_dir)
+
+
+def invalidate(host=None, app_key=None, port=None):
+    """Invalidate cached Hue objects in the process wide registry"""
+    registry.invalidate(host=host, app_key=app_key, port=port)
@@ -0,0 +1,178 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Scenes, the look of a set of lights captured from cached state and
+restored in as few commands as possible
+
+"""
+
+from threading import Lock
+from hue import codec
+from hue.exceptions import HueError
+from hue.validators import is_valid
+
+
+# Color attrs restored for each colormode
+COLOR_ATTRS = { 'hs' : ('hue', 'sat'), 'xy' : ('xy', ), 'ct' : ('ct', ) }
+
+
+def light_scene_state(light):
+    """Restorable attrs of a light's cached state
+        Off lights only keep on, the bridge refuses changes to them
+    """
+    state = light.state
+    if not getattr(state, 'on', False):
+        return { 'on' : False }
+    attrs = { 'on' : True }
+    for attr in ('bri', ) + COLOR_ATTRS.get(getattr(state, 'colormode', None),
+                                            ()):
+        val = getattr(state, attr, None)
+        if val is not None and is_valid(attr, val):
+            attrs[attr] = val
+    return attrs
+
+
+class HueScene:
+    """Attrs of each light of a scene, by light id"""
+
+    def __init__(self, name, states):
+        """A scene
+            -states [dict of light id: attrs]
+        """
+        self.name = name
+        self.states = dict((str(light_id), dict(attrs))
+                            for light_id, attrs in states.items())
+
+    @classmethod
+    def capture(cls, lights, name=None):
+        """Scene of lights or a HueGroup as cached, sends no requests"""
+        lights = getattr(lights, 'lights', lights)
+        return cls(name, dict((light.id, light_scene_state(light))
+                                for light in lights))
+
+    def plan(self, hue, force=False):
+        """(shared, rest) payloads restoring the scene
+            shared sets every light with the same attrs, sent as one
+            group action, rest are the per light deltas left over
+            Without a group action that saves requests shared is empty
+            and rest holds each light's full delta
+        """
+        deltas = {}
+        for light_id, attrs in self.states.items():
+            try:
+                light = hue.lights[light_id]
+            except KeyError:
+                raise HueError('Scene light %s is not on the bridge' % light_id)
+            delta = attrs if force else light._state_delta(attrs)
+            if delta:
+                deltas[light_id] = dict(delta)
+        if len(deltas) < 2:
+            return {}, deltas
+        # Attrs every light of the scene wants the same value of
+        shared = {}
+        first = self.states[next(iter(deltas))]
+        for attr, val in first.items():
+            if all(attrs.get(attr) == val for attrs in self.states.values()) \
+                    and any(attr in delta for delta in deltas.values()):
+                shared[attr] = val
+        if not shared:
+            return {}, deltas
+        rest = {}
+        for light_id, delta in deltas.items():
+            left = dict((attr, val) for attr, val in delta.items()
+                            if attr not in shared)
+            if left:
+                rest[light_id] = left
+        cost = hue._group_action_cost(list(self.states))
+        if cost is None or cost + len(rest) >= len(deltas):
+            return {}, deltas
+        return dict((light_id, shared) for light_id in self.states), rest
+
+    def restore(self, hue, force=False):
+        """Send the scene to hue's lights, returns dict of light id: response"""
+        shared, rest = self.plan(hue, force=force)
+        results = {}
+        if shared:
+            results.update(hue.apply_many(shared, force=True))
+        if rest:
+            results.update(hue.apply_many(rest, force=True))
+        return results
+
+    def as_dict(self):
+        return { 'name' : self.name, 'states' : self.states }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['states'])
+
+    def __repr__(self):
+        return '<HueScene %s %d lights>' % (self.name, len(self.states))
+
+
+class SceneStore:
+    """Scenes kept in memory by name"""
+
+    def __init__(self):
+        self._scenes = {}
+        self._lock = Lock()
+
+    def save(self, scene):
+        with self._lock:
+            self._scenes[scene.name] = scene
+        return scene
+
+    def get(self, name):
+        """Scene by name, raises HueError when there is none"""
+        with self._lock:
+            try:
+                return self._scenes[name]
+            except KeyError:
+                raise HueError('No scene %s' % name)
+
+    def delete(self, name):
+        with self._lock:
+            self._scenes.pop(name, None)
+
+    def names(self):
+        with self._lock:
+            return sorted(self._scenes)
+
+
+class ModelSceneStore(SceneStore):
+    """Scenes of a bridge kept in the hue Scene model"""
+
+    def __init__(self, bridge):
+        """A store for the scenes of bridge, its host"""
+        super().__init__()
+        self.bridge = bridge
+
+    def _model(self):
+        from hue.models import Scene
+        return Scene
+
+    def save(self, scene):
+        self._model().objects.update_or_create(bridge=self.bridge,
+                    name=scene.name,
+                    defaults={ 'states' : codec.dumps(scene.states)
+                                                .decode('utf-8') })
+        return scene
+
+    def get(self, name):
+        Scene = self._model()
+        try:
+            row = Scene.objects.get(bridge=self.bridge, name=name)
+        except Scene.DoesNotExist:
+            raise HueError('No scene %s' % name)
+        return HueScene(row.name, codec.loads(row.states))
+
+    def delete(self, name):
+        self._model().objects.filter(bridge=self.bridge, name=name).delete()
+
+    def names(self):
+        return list(self._model().objects.filter(bridge=self.bridge)
+                        .order_by('name').values_list('name', flat=True))
+
+
+scenes = SceneStore()
@@ -0,0 +1,166 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Paced Hue command queue, the bridge handles about 10 light commands and
+1 group command per second
+
+"""
+
+from collections import OrderedDict
+from concurrent.futures import Future
+from threading import Condition, Thread
+from time import monotonic
+from hue.exceptions import HueError
+
+
+LIGHT_RATE = 10.0
+GROUP_RATE = 1.0
+
+
+class HueCommandScheduler:
+    """Queue of state commands, coalesced per url and sent at a fixed rate"""
+
+    def __init__(self, manager, light_rate=LIGHT_RATE, group_rate=GROUP_RATE,
+                    max_pending=None):
+        """A command queue in front of manager._connect_hue
+            -light_rate [light commands sent per second]
+            -group_rate [group commands sent per second]
+            -max_pending [queued urls kept, oldest are dropped past this]
+        """
+        self.manager = manager
+        self.intervals = { 'light' : 1.0 / light_rate,
+                           'group' : 1.0 / group_rate }
+        self.max_pending = max_pending
+        self.merged = 0
+        self.dropped = 0
+        self.sent = 0
+        self.errors = 0
+        self._pending = OrderedDict()
+        self._next_send = { 'light' : 0.0, 'group' : 0.0 }
+        self._cond = Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        """Start sending queued commands"""
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = Thread(target=self._run, name='hue-scheduler',
+                                daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sending, queued commands fail with HueError
+            Their attrs are dropped from the manager's cached state
+        """
+        with self._cond:
+            self._running = False
+            pending = list(self._pending.items())
+            self._pending.clear()
+            self._cond.notify()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        for url, (kind, attr, futures) in pending:
+            self._discard(url, attr, futures, 'Scheduler stopped')
+
+    def _claim(self, futures):
+        """Futures of a dequeued command its callers did not cancel"""
+        return [future for future in futures
+                    if future.set_running_or_notify_cancel()]
+
+    def _discard(self, url, attr, futures, reason):
+        """Fail the futures of a command that will not be sent"""
+        for future in self._claim(futures):
+            future.set_exception(HueError('%s %s' % (reason, url)))
+        dropped = getattr(self.manager, '_command_dropped', None)
+        if dropped is not None:
+            dropped(url, attr)
+
+    def submit(self, url, attr, kind='light'):
+        """Queue a state PUT to url, merged into any pending PUT to url
+            -kind [light or group, selects the rate budget]
+            Returns a Future resolved with the bridge response
+        """
+        if kind not in self.intervals:
+            raise HueError('Unknown command kind %s' % kind)
+        future = Future()
+        with self._cond:
+            if url in self._pending:
+                pending = self._pending[url]
+                pending[1].update(attr)
+                pending[2].append(future)
+                self.merged += 1
+                return future
+            dropped = None
+            if self.max_pending and len(self._pending) >= self.max_pending:
+                dropped = self._pending.popitem(last=False)
+                self.dropped += 1
+            self._pending[url] = (kind, dict(attr), [future])
+            self._cond.notify()
+        if dropped:
+            dropped_url, (_, dropped_attr, dropped_futures) = dropped
+            self._discard(dropped_url, dropped_attr, dropped_futures,
+                            'Command dropped')
+        return future
+
+    def depth(self):
+        """Number of urls waiting to be sent"""
+        return len(self._pending)
+
+    def stats(self):
+        """Queue depth and command counters"""
+        with self._cond:
+            return { 'depth' : len(self._pending),
+                     'merged' : self.merged,
+                     'dropped' : self.dropped,
+                     'sent' : self.sent,
+                     'errors' : self.errors }
+
+    def _next_command(self):
+        """Pop oldest command whose budget allows sending, else wait time"""
+        now = monotonic()
+        wait = None
+        for url, (kind, attr, futures) in self._pending.items():
+            ready_at = self._next_send[kind]
+            if ready_at <= now:
+                del self._pending[url]
+                self._next_send[kind] = now + self.intervals[kind]
+                return (url, attr, futures), None
+            if wait is None or ready_at - now < wait:
+                wait = ready_at - now
+        return None, wait
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if not self._running:
+                        return
+                    command, wait = self._next_command()
+                    if command:
+                        break
+                    self._cond.wait(wait)
+            url, attr, futures = command
+            futures = self._claim(futures)
+            if not futures:
+                # Every caller cancelled, the attrs never reach the bridge
+                dropped = getattr(self.manager, '_command_dropped', None)
+                if dropped is not None:
+                    dropped(url, attr)
+                continue
+            try:
+                response = self.manager._connect_hue(url, data=attr,
+                                                        method='PUT')
+            except Exception as error:
+                self.errors += 1
+                for future in futures:
+                    future.set_exception(error)
+            else:
+                self.sent += 1
+                for future in futures:
+                    future.set_result(response)
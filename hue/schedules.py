@@ -0,0 +1,166 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Repeating schedules expanded without recursion, validated up front and
+created concurrently at a pace the bridge keeps up with
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from contextvars import copy_context
+from datetime import datetime, timedelta
+from threading import Lock
+from time import monotonic, sleep
+from hue import HueCommand, HueSchedule, FRMT_STR, validate_state
+from hue.exceptions import (InvalidHueSchedule, InvalidHueHub,
+                                InvalidLightAttr, InvalidLightAttrValue, )
+
+
+# Schedules a bridge holds, and the longest name and description it takes
+MAX_SCHEDULES = 100
+MAX_NAME = 32
+MAX_DESCRIPTION = 64
+# Schedules created per second and at once
+SCHEDULE_RATE = 10.0
+MAX_WORKERS = 4
+
+
+def schedule_times(time=None, repeats=None):
+    """Times of a schedule and each repeat, yielded one at a time
+        -time [datetime, a day from now when None]
+        -repeats [optional dict with keys times = times to repeat,
+                    interval dict of timedelta parameters]
+    """
+    if time is None:
+        time = datetime.now() + timedelta(days=1)
+    yield time
+    if not repeats:
+        return
+    try:
+        times = int(repeats['times'])
+        interval = timedelta(**repeats['interval'])
+    except (KeyError, TypeError, ValueError):
+        raise InvalidHueSchedule(repeats)
+    for _ in range(times):
+        time += interval
+        yield time
+
+def _command(command):
+    if isinstance(command, HueCommand):
+        return command
+    try:
+        return HueCommand(command['address'], command['body'],
+                            command['method'])
+    except (KeyError, TypeError):
+        raise InvalidHueSchedule(command)
+
+def schedule_occurrences(commands, time=None, repeats=None):
+    """(time string, HueCommand) of every schedule to create, in time order
+        Raises InvalidHueSchedule before anything is sent if any is invalid
+    """
+    commands = [_command(command) for command in commands]
+    for command in commands:
+        if command.address.endswith(('/state', '/action')):
+            try:
+                validate_state(command.body)
+            except (InvalidLightAttr, InvalidLightAttrValue) as err:
+                raise InvalidHueSchedule(err.message)
+    occurrences = []
+    for when in schedule_times(time, repeats):
+        try:
+            time_str = when.strftime(FRMT_STR)
+        except AttributeError:
+            raise InvalidHueSchedule(when)
+        occurrences.extend((time_str, command) for command in commands)
+    return occurrences
+
+
+class _Pacer:
+    """Spaces calls from many threads rate a second apart"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+        self._lock = Lock()
+
+    def wait(self):
+        with self._lock:
+            now = monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            sleep(start - now)
+
+
+class ScheduleBatch:
+    """Outcome of create_schedules"""
+
+    def __init__(self, name):
+        self.name = name
+        self.created = []
+        self.failures = []
+
+    @property
+    def ok(self):
+        return not self.failures
+
+    def summary(self):
+        """Created schedule ids and failures as (time, address, error)"""
+        return { 'name' : self.name,
+                 'created' : list(self.created),
+                 'failures' : [{ 'time' : time_str, 'address' : address,
+                                 'error' : error }
+                                for time_str, address, error in self.failures] }
+
+    def __repr__(self):
+        return '<ScheduleBatch %s %d created %d failed>' % (self.name,
+                    len(self.created), len(self.failures))
+
+
+def create_schedules(hue, name, commands, description=None, time=None,
+                        repeats=None, rate=SCHEDULE_RATE,
+                        max_workers=MAX_WORKERS,
+                        max_schedules=MAX_SCHEDULES):
+    """Create a schedule of commands at time and each repeat
+        Every occurrence is checked, against the bridge's limits too,
+        before any is sent, then they are created concurrently no faster
+        than rate a second
+        -max_schedules [schedules the bridge holds, None for no limit]
+        Returns a ScheduleBatch of the ids created and the failures
+    """
+    if len(name) > MAX_NAME:
+        raise InvalidHueSchedule('Name longer than %d characters' % MAX_NAME)
+    description = description or 'N/A'
+    if len(description) > MAX_DESCRIPTION:
+        raise InvalidHueSchedule('Description longer than %d characters'
+                                    % MAX_DESCRIPTION)
+    occurrences = schedule_occurrences(commands, time=time, repeats=repeats)
+    if max_schedules is not None and \
+            len(hue.schedules) + len(occurrences) > max_schedules:
+        raise InvalidHueSchedule('%d schedules exceed the bridge limit of %d'
+                                    % (len(hue.schedules) + len(occurrences),
+                                        max_schedules))
+    batch = ScheduleBatch(name)
+    pacer = _Pacer(rate)
+
+    def create(time_str, command):
+        pacer.wait()
+        return HueSchedule(hue, name, description, time_str, command).id
+
+    with ThreadPoolExecutor(max_workers=max(min(max_workers,
+                                                len(occurrences)), 1),
+                            thread_name_prefix='hue-schedules') as executor:
+        # Each request keeps the caller's deadline
+        futures = [(time_str, command,
+                    executor.submit(copy_context().run, create, time_str,
+                                    command))
+                    for time_str, command in occurrences]
+        for time_str, command, future in futures:
+            try:
+                batch.created.append(future.result())
+            except (InvalidHueSchedule, InvalidHueHub, ValueError) as err:
+                batch.failures.append((time_str, command.address,
+                                        str(getattr(err, 'message', err))))
+    return batch
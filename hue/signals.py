@@ -0,0 +1,21 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Django signals for Hue light changes
+
+"""
+
+from django.dispatch import Signal
+
+
+# Sent with sender=Hue, light=HueLight, changes={ attr : (old, new) }
+light_changed = Signal()
+
+
+def connect_signals(hue, lights=None, groups=None, attrs=None):
+    """Send light_changed for changes found by hue's shared poller"""
+    def send(light, changes):
+        light_changed.send(sender=hue, light=light, changes=changes)
+    return hue.subscribe(send, lights=lights, groups=groups, attrs=attrs)
@@ -0,0 +1,258 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+In process fake Hue bridge for tests and benchmarks
+
+"""
+
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from sys import exc_info
+from threading import Lock, Thread
+from time import monotonic, sleep
+from hue import codec
+
+
+BRIDGE_MAC = '00:17:88:00:00:00'
+
+
+def _light(index):
+    return { 'name' : 'Hue Lamp %d' % index, 'modelid' : 'LCT001',
+             'swversion' : '66009461', 'type' : 'Extended color light',
+             'pointsymbol' : dict((str(point), 'none')
+                                    for point in range(1, 9)),
+             'state' : { 'on' : False, 'bri' : 0, 'hue' : 0, 'sat' : 0,
+                         'xy' : [0.0, 0.0], 'ct' : 153, 'alert' : 'none',
+                         'effect' : 'none', 'colormode' : 'hs',
+                         'reachable' : True } }
+
+def _config(app_key):
+    return { 'name' : 'Simulated hue', 'mac' : BRIDGE_MAC, 'dhcp' : True,
+             'ipaddress' : '127.0.0.1', 'netmask' : '255.255.255.0',
+             'gateway' : '127.0.0.1', 'proxyaddress' : ' ', 'proxyport' : 0,
+             'linkbutton' : False, 'portalservices' : False,
+             'swversion' : '01003542',
+             'swupdate' : { 'updatestate' : 0, 'url' : '', 'text' : '',
+                            'notify' : False },
+             'whitelist' : { app_key : { 'name' : 'django-hue' } } }
+
+def _error(error_type, address, description):
+    return [{ 'error' : { 'type' : error_type, 'address' : address,
+                          'description' : description } }]
+
+
+class _RateLimiter:
+    """Token bucket of rate commands a second"""
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.tokens = self.rate
+        self.updated = monotonic()
+        self.lock = Lock()
+
+    def allow(self):
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.rate,
+                                self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+class _BridgeHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def _respond(self, status, body):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        bridge = self.server.bridge
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if bridge.latency:
+            sleep(bridge.latency)
+        self._respond(*bridge.handle(self.command, self.path, body))
+
+    do_GET = do_PUT = do_POST = do_DELETE = _handle
+
+    def log_message(self, *args):
+        pass
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients giving up on a slow response are expected
+        if not isinstance(exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class HueSimulator:
+    """A fake bridge answering the Hue API over HTTP on localhost"""
+
+    def __init__(self, light_count=3, app_key='simulator', latency=0.0,
+                    rate_limit=None, host='127.0.0.1', port=0):
+        """A simulated bridge
+            -light_count [lights on the bridge]
+            -latency [seconds added to every response]
+            -rate_limit [state commands a second, more are answered 429]
+        """
+        self.app_key = app_key
+        self.latency = latency
+        self.limiter = _RateLimiter(rate_limit) if rate_limit else None
+        self.lights = dict((str(index), _light(index))
+                            for index in range(1, light_count + 1))
+        self.groups = {}
+        self.schedules = {}
+        self.config = _config(app_key)
+        self.requests = 0
+        self.commands = 0
+        self.rejected = 0
+        self._lock = Lock()
+        self._server = _Server((host, port), _BridgeHandler)
+        self._server.bridge = self
+        self._thread = None
+
+    @property
+    def host(self):
+        return self._server.server_address[0]
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        """Serve in a background thread, returns self"""
+        self._thread = Thread(target=self._server.serve_forever,
+                                name='hue-simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stats(self):
+        return { 'requests' : self.requests, 'commands' : self.commands,
+                 'rejected' : self.rejected }
+
+    def handle(self, method, path, body):
+        """(status, json body) of a request"""
+        parts = path.split('?')[0].strip('/').split('/')
+        with self._lock:
+            self.requests += 1
+        if len(parts) < 2 or parts[0] != 'api':
+            return 404, codec.dumps(_error(4, path, 'method not available'))
+        if parts[1] != self.app_key:
+            return 200, codec.dumps(_error(1, '/', 'unauthorized user'))
+        parts = parts[2:]
+        address = '/' + '/'.join(parts)
+        if method != 'GET' and self.limiter and not self.limiter.allow():
+            with self._lock:
+                self.rejected += 1
+            return 429, codec.dumps(_error(901, address, 'rate limited'))
+        try:
+            data = codec.loads(body) if body else None
+        except ValueError:
+            return 200, codec.dumps(_error(2, address,
+                                            'body contains invalid json'))
+        with self._lock:
+            if method != 'GET':
+                self.commands += 1
+            try:
+                payload = self._route(method, parts, data, address)
+            except (KeyError, IndexError, TypeError, AttributeError):
+                payload = _error(3, address,
+                                    'resource, %s, not available' % address)
+            # Serialized under the lock, other requests change the state
+            return 200, codec.dumps(payload)
+
+    def _full_state(self):
+        return { 'lights' : self.lights, 'groups' : self.groups,
+                 'config' : self.config, 'schedules' : self.schedules }
+
+    def _group(self, group_id):
+        if group_id == '0':
+            return { 'name' : 'Lightset 0',
+                     'lights' : sorted(self.lights, key=int) }
+        return self.groups[group_id]
+
+    def _set_state(self, light_ids, data, address):
+        results = []
+        for attr, val in data.items():
+            if attr != 'transitiontime':
+                for light_id in light_ids:
+                    self.lights[light_id]['state'][attr] = val
+            results.append({ 'success' : { '%s/%s' % (address, attr) : val } })
+        return results
+
+    def _next_id(self, resources):
+        return str(max([int(key) for key in resources] or [0]) + 1)
+
+    def _route(self, method, parts, data, address):
+        resource = parts[0] if parts else None
+        if method == 'GET':
+            if not parts:
+                return self._full_state()
+            if resource == 'groups' and len(parts) == 2:
+                return self._group(parts[1])
+            doc = self._full_state()[resource]
+            for part in parts[1:]:
+                doc = doc[part]
+            return doc
+        if resource == 'lights' and len(parts) == 3 and parts[2] == 'state':
+            self.lights[parts[1]]
+            return self._set_state([parts[1]], data, address)
+        if resource == 'lights' and len(parts) == 1 and method == 'POST':
+            return [{ 'success' : { '/lights' : 'Searching for new devices' } }]
+        if resource == 'groups':
+            if len(parts) == 3 and parts[2] == 'action':
+                group = self._group(parts[1])
+                return self._set_state(group['lights'], data, address)
+            if len(parts) == 1 and method == 'POST':
+                group_id = self._next_id(self.groups)
+                for light_id in data['lights']:
+                    self.lights[light_id]
+                self.groups[group_id] = { 'name' : data['name'],
+                                          'lights' : list(data['lights']) }
+                return [{ 'success' : { 'id' : '/groups/%s' % group_id } }]
+            if len(parts) == 2 and method == 'PUT':
+                self.groups[parts[1]].update(data)
+                return [{ 'success' : { '%s/%s' % (address, key) : val } }
+                            for key, val in data.items()]
+            if len(parts) == 2 and method == 'DELETE':
+                del self.groups[parts[1]]
+                return [{ 'success' : '%s deleted' % address }]
+        if resource == 'schedules':
+            if len(parts) == 1 and method == 'POST':
+                schedule_id = self._next_id(self.schedules)
+                self.schedules[schedule_id] = dict(data)
+                return [{ 'success' : { 'id' : '/schedules/%s'
+                                                    % schedule_id } }]
+            if len(parts) == 2 and method == 'DELETE':
+                del self.schedules[parts[1]]
+                return [{ 'success' : '%s deleted' % address }]
+        if resource == 'config' and method == 'PUT':
+            self.config.update(data)
+            return [{ 'success' : { '/config/%s' % key : val } }
+                        for key, val in data.items()]
+        raise KeyError(address)
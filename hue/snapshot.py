@@ -0,0 +1,130 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Bridge state snapshots on disk, so new workers start without waiting on
+the bridge
+
+"""
+
+from hashlib import sha1
+from threading import Thread
+from time import time
+from hue import Hue, codec
+import logging
+import os
+import tempfile
+
+
+SCHEMA_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_path(cache_dir, host, app_key, port=80):
+    """Snapshot file of a bridge, named without exposing the app key"""
+    key = sha1(('%s:%d:%s' % (host, port, app_key)).encode('utf-8'))
+    return os.path.join(cache_dir, 'hue-%s.json' % key.hexdigest())
+
+def bridge_identity(hue):
+    """(mac, version) of a loaded Hue's bridge"""
+    return (hue.config.mac, hue.config.version)
+
+def write_snapshot(hue, path):
+    """Atomically write a loaded Hue's state to path, readable by the
+        owner only
+        The config whitelist, every app key on the bridge, is left out
+    """
+    mac, version = bridge_identity(hue)
+    state = hue.state_document()
+    state['config'] = dict(state['config'], whitelist={})
+    snapshot = { 'schema' : SCHEMA_VERSION,
+                 'bridge' : { 'host' : hue.host, 'port' : hue.port,
+                              'mac' : mac, 'version' : version },
+                 'saved' : time(),
+                 'state' : state }
+    data = codec.dumps(snapshot)
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='.hue-', dir=directory)
+    try:
+        os.chmod(tmp_path, 0o600)
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+            tmp.flush()
+            os.fsync(tmp.fileno())
+        # Readers see the old or the new file, never a partial one
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def read_snapshot(path, host=None, port=None):
+    """Snapshot written by write_snapshot, None when missing or unusable
+        -host, port [reject snapshots of another bridge address]
+    """
+    try:
+        with open(path, 'rb') as snapshot_file:
+            snapshot = codec.loads(snapshot_file.read())
+    except (OSError, ValueError):
+        return None
+    if not isinstance(snapshot, dict) or \
+            snapshot.get('schema') != SCHEMA_VERSION or \
+            'state' not in snapshot or 'bridge' not in snapshot:
+        return None
+    bridge = snapshot['bridge']
+    if (host is not None and bridge.get('host') != host) or \
+            (port is not None and bridge.get('port') != port):
+        return None
+    return snapshot
+
+def revalidate(hue, snapshot, path=None):
+    """Bring a Hue built from snapshot up to date with its bridge
+        A different bridge at the same address is reloaded from scratch
+        Returns the HueChangeSet of the refresh, None after a reload
+    """
+    changes = hue.refresh()
+    bridge = snapshot['bridge']
+    if hue.config.mac != bridge.get('mac'):
+        logger.warning('Hue bridge at %s changed from %s to %s, reloading',
+                        hue.host, bridge.get('mac'), hue.config.mac)
+        hue.load_lights()
+        hue.load_groups()
+        hue.load_schedules()
+        changes = None
+    if path:
+        write_snapshot(hue, path)
+    return changes
+
+
+def warm_start(host, app_key, port=80, cache_dir=None, lazy=False,
+                factory=Hue, background=True):
+    """A Hue served from its snapshot at once, revalidated from the bridge
+        -cache_dir [directory of snapshots]
+        -factory [callable building a Hue(host, app_key, port=, lazy=)]
+        -background [revalidate on a thread instead of before returning]
+        Without a usable snapshot the Hue loads as usual and the snapshot
+        is written
+    """
+    path = snapshot_path(cache_dir, host, app_key, port)
+    hue = factory(host, app_key, port=port, lazy=True)
+    hue.lazy = lazy
+    snapshot = read_snapshot(path, host=host, port=port)
+    if snapshot is None:
+        if not lazy:
+            hue.load_hue()
+            write_snapshot(hue, path)
+        return hue
+    hue._load_document(snapshot['state'])
+
+    def run():
+        try:
+            revalidate(hue, snapshot, path)
+        except Exception:
+            logger.exception('Revalidating Hue snapshot %s failed', path)
+    if background:
+        Thread(target=run, name='hue-snapshot', daemon=True).start()
+    else:
+        run()
+    return hue
@@ -0,0 +1,91 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Fixed layout light state record
+
+"""
+
+from collections.abc import MutableMapping
+
+
+STATE_FIELDS = ('on', 'bri', 'hue', 'sat', 'xy', 'ct', 'alert', 'effect',
+                'colormode', 'reachable')
+# Attrs held in slots, read them with getattr(state, attr, default)
+STATE_KEYS = _FIELDS = frozenset(STATE_FIELDS)
+
+
+class LightState(MutableMapping):
+    """Light state held in slots, used like the bridge's state dict
+        Attrs outside STATE_FIELDS are kept in an extra dict, known attrs
+        can also be read as attributes, state.bri, which is faster
+    """
+
+    __slots__ = STATE_FIELDS + ('_extra', )
+
+    def __init__(self, state=None):
+        self._extra = None
+        if state:
+            for key, val in state.items():
+                self[key] = val
+
+    def __getitem__(self, key):
+        if key in _FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, val):
+        if key in _FIELDS:
+            setattr(self, key, val)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = val
+
+    def __delitem__(self, key):
+        if key in _FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def get(self, key, default=None):
+        if key in _FIELDS:
+            return getattr(self, key, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def __contains__(self, key):
+        if key in _FIELDS:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for key in STATE_FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            for key in self._extra:
+                yield key
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def as_dict(self):
+        """Plain dict copy, for json"""
+        return dict(self.items())
+
+    def __repr__(self):
+        return 'LightState(%r)' % self.as_dict()
+
@@ -0,0 +1,189 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Keep a loaded Hue in sync with its bridge
+
+"""
+
+from asyncio import Queue, get_running_loop
+from threading import Event, Lock, Thread
+import logging
+
+
+DEFAULT_INTERVAL = 5.0
+
+logger = logging.getLogger(__name__)
+
+
+class HueChangeSet:
+    """Changes found by Hue.refresh"""
+
+    def __init__(self):
+        self.lights_added = []
+        self.lights_removed = []
+        self.lights_changed = {}
+        self.groups_added = []
+        self.groups_removed = []
+        self.groups_changed = []
+        self.config_changed = False
+        self.schedules_changed = False
+
+    def light_changed(self, light_id, attr, old, new):
+        """Record a light attr going from old to new"""
+        self.lights_changed.setdefault(light_id, {})[attr] = (old, new)
+
+    def __bool__(self):
+        return bool(self.lights_added or self.lights_removed or
+                    self.lights_changed or self.groups_added or
+                    self.groups_removed or self.groups_changed or
+                    self.config_changed or self.schedules_changed)
+
+    def __repr__(self):
+        return ('<HueChangeSet lights +%s -%s ~%s groups +%s -%s ~%s>' %
+                    (self.lights_added, self.lights_removed,
+                     sorted(self.lights_changed), self.groups_added,
+                     self.groups_removed, self.groups_changed))
+
+
+class HueSubscription:
+    """Callback for light changes, filtered by light, group and attr"""
+
+    def __init__(self, poller, callback, lights=None, groups=None, attrs=None):
+        """Subscribe callback(light, changes) to light changes
+            -lights [light ids to watch, all when None]
+            -groups [group ids whose lights are watched, all when None]
+            -attrs [state attrs to watch, all when None]
+            changes is a dict of attr: (old, new)
+        """
+        self.poller = poller
+        self.callback = callback
+        self.lights = set(str(light) for light in lights) if lights else None
+        self.groups = set(str(group) for group in groups) if groups else None
+        self.attrs = set(attrs) if attrs else None
+
+    def _watches(self, hue, light_id):
+        if self.lights is not None and light_id not in self.lights:
+            return False
+        if self.groups is not None:
+            light = hue.lights.get(light_id)
+            return any(light in hue.groups[group].lights
+                        for group in self.groups if group in hue.groups)
+        return True
+
+    def dispatch(self, hue, changes):
+        """Call back for every watched light with watched changes"""
+        for light_id, light_changes in changes.lights_changed.items():
+            if not self._watches(hue, light_id):
+                continue
+            if self.attrs is not None:
+                light_changes = dict((attr, change) for attr, change
+                                        in light_changes.items()
+                                        if attr in self.attrs)
+                if not light_changes:
+                    continue
+            self.callback(hue.lights[light_id], light_changes)
+
+    def cancel(self):
+        """Stop receiving changes"""
+        self.poller.unsubscribe(self)
+
+
+class HueChangeStream:
+    """Async iterator of (light, changes) from a shared poller"""
+
+    def __init__(self, poller, **filters):
+        self._loop = get_running_loop()
+        self._queue = Queue()
+        self.subscription = poller.subscribe(self._put, **filters)
+
+    def _put(self, light, changes):
+        # Called from the poller thread
+        self._loop.call_soon_threadsafe(self._queue.put_nowait,
+                                        (light, changes))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self._queue.get()
+
+    def close(self):
+        """Stop receiving changes"""
+        self.subscription.cancel()
+
+
+class HuePoller:
+    """Background thread calling Hue.refresh every interval seconds"""
+
+    def __init__(self, hue, interval=DEFAULT_INTERVAL):
+        """Poll a loaded Hue
+            -interval [seconds between refreshes]
+        """
+        self.hue = hue
+        self.interval = interval
+        self.last_changes = None
+        self.polls = 0
+        self.errors = 0
+        self._subscriptions = []
+        self._lock = Lock()
+        self._stop = Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        """Start polling"""
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = Thread(target=self._run, name='hue-poller',
+                                daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop polling"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+
+    def subscribe(self, callback, lights=None, groups=None, attrs=None):
+        """Add a HueSubscription fed by this poller"""
+        subscription = HueSubscription(self, callback, lights=lights,
+                                        groups=groups, attrs=attrs)
+        with self._lock:
+            self._subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+
+    def poll(self):
+        """Refresh once, notify subscribers and return the change set"""
+        changes = self.hue.refresh()
+        self.polls += 1
+        self.last_changes = changes
+        if changes.lights_changed:
+            with self._lock:
+                subscriptions = list(self._subscriptions)
+            for subscription in subscriptions:
+                try:
+                    subscription.dispatch(self.hue, changes)
+                except Exception:
+                    logger.exception('Hue change callback %r failed',
+                                        subscription.callback)
+        return changes
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.poll()
+            except Exception:
+                self.errors += 1
+                logger.exception('Polling Hue %s failed', self.hue.host)
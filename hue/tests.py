@@ -5,7 +5,43 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+import asyncio
+import json
+import os
+import tempfile
+from asyncio import gather
+from datetime import datetime
+from socket import SHUT_RDWR
+from threading import Event, Thread, enumerate as threading_enumerate
+from time import monotonic, sleep
+
 from django.test import TestCase
+from hue import Hue, HueLight, codec
+from hue.aio import AsyncHue
+from hue.animation import HueAnimation, Keyframe, KeyframeEffect, plan_commands
+from hue.breaker import CircuitBreaker
+from hue.cluster import HueCluster
+from hue.deadline import deadline
+from hue.effects import HueEffect, HueEffectEngine, get_engine, _engines
+from hue.exceptions import (HueError, InvalidLightAttr,
+                                InvalidLightAttrValue, InvalidLightAttrs,
+                                HueClusterError, HueLightDoesNotExist,
+                                HueCircuitOpen, HueDeadlineExceeded,
+                                InvalidHueHub, InvalidHueSchedule, )
+from hue.history import HueHistoryRecorder, downsample
+from hue.metrics import HueMetrics, metrics, endpoint
+from hue.randomize import HueRandom
+from hue.registry import HueRegistry
+from hue.scenes import HueScene, SceneStore
+from hue.scheduler import HueCommandScheduler
+from hue.schedules import schedule_times
+from hue.simulator import HueSimulator, _light
+from hue.snapshot import (warm_start, read_snapshot, snapshot_path,
+                            SCHEMA_VERSION, )
+from hue.state import LightState
+from hue.sync import HuePoller
+from hue.transport import close_pools, get_pool, HueConnectionPool
+from hue.validators import validate_many
 
 
 class SimpleTest(TestCase):
@@ -14,3 +50,1197 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class RefreshCounter:
+    def __init__(self):
+        self.refreshes = 0
+
+    def refresh(self):
+        self.refreshes += 1
+
+
+class HueRegistryTest(TestCase):
+    def setUp(self):
+        self.loads = []
+
+        def factory(host, app_key, port=80, lazy=False):
+            self.loads.append((host, app_key, port))
+            return RefreshCounter()
+
+        self.registry = HueRegistry(ttl=None, factory=factory)
+
+    def test_reuses_loaded_hue(self):
+        hue = self.registry.get('10.0.0.2', 'key')
+        self.assertIs(hue, self.registry.get('10.0.0.2', 'key'))
+        self.assertEqual(len(self.loads), 1)
+
+    def test_keyed_by_bridge(self):
+        self.registry.get('10.0.0.2', 'key')
+        self.registry.get('10.0.0.2', 'key', port=8080)
+        self.registry.get('10.0.0.3', 'key')
+        self.assertEqual(len(self.loads), 3)
+
+    def test_ttl_revalidates_in_place(self):
+        hue = self.registry.get('10.0.0.2', 'key')
+        self.assertIs(hue, self.registry.get('10.0.0.2', 'key', ttl=0))
+        self.assertEqual(hue.refreshes, 1)
+        self.assertEqual(len(self.loads), 1)
+
+    def test_ttl_none_never_expires(self):
+        self.registry.ttl = 0
+        hue = self.registry.get('10.0.0.2', 'key', ttl=None)
+        self.assertIs(hue, self.registry.get('10.0.0.2', 'key', ttl=None))
+        self.assertEqual(hue.refreshes, 0)
+        self.registry.get('10.0.0.2', 'key')
+        self.assertEqual(hue.refreshes, 1)
+        self.assertEqual(len(self.loads), 1)
+
+    def test_invalidate(self):
+        hue = self.registry.get('10.0.0.2', 'key')
+        self.registry.invalidate(host='10.0.0.2')
+        self.assertIsNot(hue, self.registry.get('10.0.0.2', 'key'))
+
+
+class RecordingManager:
+    """Stands in for Hue, records requests instead of sending them"""
+
+    url = 'http://10.0.0.2:80/api/key'
+
+    def __init__(self):
+        self.requests = []
+
+    def _connect_hue(self, url, data=None, method=None):
+        self.requests.append((method, url, data))
+        return b'[{"success":{}}]'
+
+    def _send_state(self, url, data, kind='light'):
+        return self._connect_hue(url, data=data, method='PUT')
+
+
+def light_data(name='Hue Lamp', **state):
+    light_state = { 'on' : False, 'bri' : 100, 'hue' : 0, 'sat' : 0,
+                    'xy' : [0.3, 0.3], 'ct' : 200, 'alert' : 'none',
+                    'effect' : 'none', 'colormode' : 'hs',
+                    'reachable' : True }
+    light_state.update(state)
+    return { 'name' : name, 'modelid' : 'LCT001', 'swversion' : '1.0',
+             'type' : 'Extended color light', 'pointsymbol' : {},
+             'state' : light_state }
+
+
+def bridge_document(light_count=3):
+    lights = dict((str(key), light_data('Lamp %d' % key))
+                    for key in range(1, light_count + 1))
+    config = dict((key, key) for key in ('dhcp', 'gateway', 'ipaddress',
+                    'linkbutton', 'mac', 'name', 'netmask', 'portalservices',
+                    'proxyaddress', 'swupdate', 'swversion', 'whitelist'))
+    return { 'lights' : lights, 'config' : config, 'schedules' : {},
+             'groups' : {} }
+
+
+class DocumentHue(Hue):
+    """Hue answering GETs from a bridge document instead of a bridge"""
+
+    def __init__(self, document, **kwargs):
+        self.document = document
+        self.requests = []
+        super().__init__('10.0.0.2', 'key', **kwargs)
+
+    def _connect_hue(self, url, data=None, method=None):
+        if not method:
+            method = 'POST' if data else 'GET'
+        self.requests.append((method, url, data))
+        if method == 'POST' and url == self.url + '/groups':
+            return b'[{"success":{"id":"/groups/9"}}]'
+        if method != 'GET':
+            return b'[{"success":{}}]'
+        parts = url[len(self.url):].split('/')[1:]
+        if parts == ['groups', '0']:
+            # Bridges leave group 0 of all lights out of the full state
+            doc = { 'name' : 'Lightset 0',
+                    'lights' : sorted(self.document['lights']) }
+        else:
+            doc = self.document
+            for part in parts:
+                doc = doc[part]
+        return json.dumps(doc).encode('utf-8')
+
+
+class HueCommandSchedulerTest(TestCase):
+    def setUp(self):
+        self.manager = RecordingManager()
+        self.scheduler = HueCommandScheduler(self.manager, light_rate=1000,
+                                                max_pending=2)
+
+    def tearDown(self):
+        self.scheduler.stop()
+
+    def test_coalesces_pending_commands(self):
+        first = self.scheduler.submit('/lights/1/state', { 'hue' : 1, 'on' : True })
+        second = self.scheduler.submit('/lights/1/state', { 'hue' : 2 })
+        self.assertEqual(self.scheduler.stats()['merged'], 1)
+        self.scheduler.start()
+        self.assertEqual(first.result(1), second.result(1))
+        self.assertEqual(self.manager.requests,
+                    [('PUT', '/lights/1/state', { 'hue' : 2, 'on' : True })])
+
+    def test_drops_oldest_past_max_pending(self):
+        dropped = self.scheduler.submit('/lights/1/state', { 'hue' : 1 })
+        self.scheduler.submit('/lights/2/state', { 'hue' : 1 })
+        self.scheduler.submit('/lights/3/state', { 'hue' : 1 })
+        self.assertEqual(self.scheduler.stats()['dropped'], 1)
+        self.assertEqual(self.scheduler.depth(), 2)
+        self.assertRaises(HueError, dropped.result, 0)
+
+    def test_stop_fails_queued_commands(self):
+        queued = self.scheduler.submit('/lights/1/state', { 'hue' : 1 })
+        self.scheduler.stop()
+        self.assertRaises(HueError, queued.result, 0)
+        self.assertEqual(self.scheduler.depth(), 0)
+
+    def test_cancelled_command_is_skipped(self):
+        cancelled = self.scheduler.submit('/lights/1/state', { 'hue' : 1 })
+        self.assertTrue(cancelled.cancel())
+        queued = self.scheduler.submit('/lights/2/state', { 'hue' : 2 })
+        self.scheduler.start()
+        queued.result(1)
+        later = self.scheduler.submit('/lights/3/state', { 'hue' : 3 })
+        later.result(1)
+        self.assertEqual([url for _, url, _ in self.manager.requests],
+                            ['/lights/2/state', '/lights/3/state'])
+        self.assertEqual(self.scheduler.depth(), 0)
+
+    def test_stop_skips_cancelled_commands(self):
+        cancelled = self.scheduler.submit('/lights/1/state', { 'hue' : 1 })
+        cancelled.cancel()
+        queued = self.scheduler.submit('/lights/2/state', { 'hue' : 1 })
+        self.scheduler.stop()
+        self.assertTrue(cancelled.cancelled())
+        self.assertRaises(HueError, queued.result, 0)
+
+    def test_disable_forgets_unsent_attrs(self):
+        hue = DocumentHue(bridge_document())
+        hue.enable_scheduler(light_rate=0.001)
+        sent = hue.lights['1'].set_light_attr({ 'bri' : 5 })
+        queued = hue.lights['2'].set_light_attr({ 'bri' : 7 })
+        sent.result(1)
+        hue.disable_scheduler()
+        self.assertRaises(HueError, queued.result, 0)
+        self.assertEqual(hue.lights['1'].get_state_status('bri'), 5)
+        self.assertEqual(hue.lights['2'].get_state_status('bri'), None)
+        hue.refresh()
+        self.assertEqual(hue.lights['2'].get_state_status('bri'), 100)
+
+
+class HueLightDeltaTest(TestCase):
+    def setUp(self):
+        self.manager = RecordingManager()
+        self.light = HueLight(self.manager, 1, light_data(bri=100))
+
+    def test_sends_only_changed_attrs(self):
+        self.light.set_light_attr({ 'on' : True, 'bri' : 100, 'hue' : 10 })
+        self.assertEqual(self.manager.requests[0][2], { 'on' : True, 'hue' : 10 })
+        self.assertEqual(self.light.get_state_status('hue'), 10)
+
+    def test_skips_unchanged(self):
+        self.assertIsNone(self.light.set_light_attr({ 'bri' : 100,
+                                                      'xy' : (0.3, 0.3) }))
+        self.assertEqual(self.manager.requests, [])
+
+    def test_force_sends_everything(self):
+        self.light.set_light_attr({ 'bri' : 100 }, force=True)
+        self.assertEqual(self.manager.requests[0][2], { 'bri' : 100 })
+
+
+class LightStateTest(TestCase):
+    def test_behaves_like_state_dict(self):
+        state = LightState({ 'on' : True, 'bri' : 10, 'scene' : 'x' })
+        self.assertEqual(state, { 'on' : True, 'bri' : 10, 'scene' : 'x' })
+        self.assertEqual(state.bri, 10)
+        self.assertIsNone(state.get('hue'))
+        self.assertNotIn('hue', state)
+        del state['scene']
+        self.assertEqual(json.dumps(state.as_dict()), '{"on": true, "bri": 10}')
+
+    def test_light_has_no_instance_dict(self):
+        light = HueLight(RecordingManager(), 1, light_data(on=True))
+        self.assertFalse(hasattr(light, '__dict__'))
+        self.assertTrue(light.state_url.endswith('/lights/1/state'))
+        self.assertEqual(light.get_state_status()['on'], True)
+        status = light.get_state_status()
+        self.assertIs(type(status), dict)
+        self.assertEqual(json.loads(json.dumps(status))['bri'], 100)
+
+
+class HueIndexTest(TestCase):
+    def setUp(self):
+        self.document = bridge_document(3)
+        self.document['lights']['3']['modelid'] = 'LWB004'
+        self.document['lights']['3']['state']['reachable'] = False
+        self.document['groups'] = { '1' : { 'name' : 'Desk',
+                                            'lights' : ['1', '3'] } }
+        self.hue = DocumentHue(self.document)
+
+    def test_find_lights(self):
+        self.assertEqual([light.id for light in
+                            self.hue.find_lights(model_id='LCT001')], ['1', '2'])
+        self.assertEqual([light.id for light in
+                            self.hue.find_lights(name='Lamp 3',
+                                                    reachable=False)], ['3'])
+        self.assertEqual(self.hue.find_lights(name='Lamp 3', reachable=True),
+                            [])
+        self.assertRaises(TypeError, self.hue.find_lights, color='red')
+
+    def test_groups_of(self):
+        self.assertEqual([group.id for group in self.hue.groups_of('3')],
+                            ['0', '1'])
+        self.hue.groups['1'].lights.pop()
+        self.hue.groups['1'].update()
+        self.assertEqual([group.id for group in self.hue.groups_of('3')],
+                            ['0'])
+        self.hue.groups['1'].delete()
+        self.assertEqual(self.hue.index.group_ids('1'), set(['0']))
+
+    def test_refresh_updates_indexes(self):
+        self.document['lights']['2']['name'] = 'Porch'
+        del self.document['lights']['1']
+        self.document['groups']['1']['lights'] = ['3']
+        self.hue.refresh()
+        self.assertEqual([light.id for light in
+                            self.hue.find_lights(name='Porch')], ['2'])
+        self.assertEqual(self.hue.find_lights(name='Lamp 2'), [])
+        self.assertEqual(self.hue.index.group_ids('1'), set())
+        self.assertEqual(self.hue.index.light_ids(), set(['2', '3']))
+
+
+class CodecTest(TestCase):
+    def test_constant_bodies_are_cached(self):
+        body = codec.encode_body({ 'on' : True })
+        self.assertEqual(codec.loads(body), { 'on' : True })
+        self.assertIs(codec.encode_body({ 'on' : True }), body)
+        self.assertIsNot(codec.encode_body({ 'on' : 1 }), body)
+        self.assertEqual(codec.encode_body(b'{}'), b'{}')
+
+    def test_every_codec_round_trips(self):
+        payload = { 'xy' : [0.3, 0.3], 'bri' : 10, 'name' : 'L\u00e4mp' }
+        for name in codec.CODECS:
+            installed = codec.get_codec(name)
+            self.assertEqual(installed.loads(installed.dumps(payload)),
+                                payload)
+            self.assertEqual(installed.dumps(payload, sort_keys=True),
+                                codec.get_codec('json').dumps(payload,
+                                                            sort_keys=True))
+
+
+class HueLazyLoadTest(TestCase):
+    def test_loads_only_accessed_resources(self):
+        hue = DocumentHue(bridge_document(), lazy=True)
+        self.assertEqual(hue.requests, [])
+        self.assertEqual(len(hue.lights), 3)
+        self.assertEqual([request[1] for request in hue.requests],
+                            [hue.url + '/lights'])
+        self.assertIsNone(hue.loaded_at('groups'))
+
+    def test_groups_resolve_lazy_lights(self):
+        hue = DocumentHue(bridge_document(), lazy=True)
+        self.assertIs(hue.groups['0'].lights[0], hue.lights['1'])
+
+    def test_refresh_leaves_unloaded_groups_to_lazy_loader(self):
+        hue = DocumentHue(bridge_document(), lazy=True)
+        hue.lights['1'].turn_on()
+        hue.refresh()
+        self.assertIsNone(hue.loaded_at('groups'))
+        self.assertEqual([light.id for light in hue.groups['0'].lights],
+                            ['1', '2', '3'])
+
+    def test_refresh_before_load_adds_group_zero(self):
+        hue = DocumentHue(bridge_document(), load_now=False)
+        hue.refresh()
+        self.assertEqual(len(hue.groups['0'].lights), 3)
+
+    def test_eager_load(self):
+        hue = DocumentHue(bridge_document())
+        self.assertEqual(len(hue.requests), 2)
+        self.assertEqual(hue.config.mac, 'mac')
+
+
+class HueRefreshTest(TestCase):
+    def setUp(self):
+        self.document = bridge_document()
+        self.hue = DocumentHue(self.document)
+
+    def test_nothing_changed(self):
+        self.hue.refresh()
+        self.assertFalse(self.hue.refresh())
+
+    def test_updates_lights_in_place(self):
+        light = self.hue.lights['1']
+        self.document['lights']['1']['state']['bri'] = 5
+        changes = self.hue.refresh()
+        self.assertEqual(changes.lights_changed, { '1' : { 'bri' : (100, 5) } })
+        self.assertIs(self.hue.lights['1'], light)
+        self.assertEqual(light.get_state_status('bri'), 5)
+
+    def test_added_and_removed_lights(self):
+        del self.document['lights']['3']
+        self.document['lights']['4'] = light_data('Lamp 4')
+        changes = self.hue.refresh()
+        self.assertEqual(changes.lights_added, ['4'])
+        self.assertEqual(changes.lights_removed, ['3'])
+        self.assertEqual(sorted(light.id for light in self.hue.groups['0'].lights),
+                            ['1', '2', '4'])
+
+    def test_load_lights_keeps_group_members(self):
+        group = self.hue.groups['0']
+        light = self.hue.lights['1']
+        self.document['lights']['1']['state']['bri'] = 9
+        del self.document['lights']['3']
+        self.hue.load_lights()
+        self.assertIs(self.hue.lights['1'], light)
+        self.assertEqual(light.get_state_status('bri'), 9)
+        self.assertEqual([member.id for member in group.lights], ['1', '2'])
+        self.assertIs(group.lights[0], light)
+
+    def test_corrects_commands_that_did_not_take(self):
+        self.hue.refresh()
+        light = self.hue.lights['1']
+        light.set_light_attr({ 'bri' : 50 })
+        # The bridge document stays at 100
+        changes = self.hue.refresh()
+        self.assertEqual(changes.lights_changed, { '1' : { 'bri' : (50, 100) } })
+        self.assertEqual(light.get_state_status('bri'), 100)
+        self.hue.requests = []
+        light.set_light_attr({ 'bri' : 50 })
+        self.assertEqual(len(self.hue.requests), 1)
+
+
+class HueSubscriptionTest(TestCase):
+    def setUp(self):
+        self.document = bridge_document()
+        self.hue = DocumentHue(self.document)
+        self.poller = HuePoller(self.hue)
+        self.received = []
+
+    def callback(self, light, changes):
+        self.received.append((light.id, changes))
+
+    def test_filters_by_light_and_attr(self):
+        self.poller.subscribe(self.callback, lights=[1], attrs=['hue'])
+        self.document['lights']['1']['state'].update({ 'hue' : 7, 'bri' : 1 })
+        self.document['lights']['2']['state']['hue'] = 7
+        self.poller.poll()
+        self.assertEqual(self.received, [('1', { 'hue' : (0, 7) })])
+
+    def test_filters_by_group(self):
+        self.poller.subscribe(self.callback, groups=[0])
+        self.document['lights']['3']['state']['on'] = True
+        self.poller.poll()
+        self.assertEqual(self.received, [('3', { 'on' : (False, True) })])
+
+    def test_cancel(self):
+        self.poller.subscribe(self.callback).cancel()
+        self.document['lights']['3']['state']['on'] = True
+        self.poller.poll()
+        self.assertEqual(self.received, [])
+
+
+class HueGroupActionTest(TestCase):
+    def setUp(self):
+        self.hue = DocumentHue(bridge_document())
+        self.hue.requests = []
+        self.group = self.hue.groups['0']
+
+    def test_turn_on_is_one_request(self):
+        self.group.turn_on()
+        self.assertEqual(self.hue.requests,
+                    [('PUT', self.hue.url + '/groups/0/action', { 'on' : True })])
+        self.assertTrue(all(light.get_state_status('on')
+                            for light in self.group.lights))
+
+    def test_skips_when_all_lights_match(self):
+        self.assertIsNone(self.group.set_attr({ 'on' : False, 'bri' : 100 }))
+        self.assertEqual(self.hue.requests, [])
+
+    def test_sends_attrs_differing_for_any_light(self):
+        self.hue.lights['2'].state['bri'] = 50
+        self.group.set_attr({ 'on' : False, 'bri' : 100 })
+        self.assertEqual(self.hue.requests[0][2], { 'bri' : 100 })
+
+
+class HueApplyManyTest(TestCase):
+    def setUp(self):
+        self.hue = DocumentHue(bridge_document(light_count=6))
+        self.hue.requests = []
+
+    def sent(self):
+        return [(method, url[len(self.hue.url):], data)
+                    for method, url, data in self.hue.requests]
+
+    def test_identical_payloads_share_group_action(self):
+        red = { 'on' : True, 'hue' : 0, 'sat' : 254 }
+        results = self.hue.apply_many({ '1' : red, '2' : red, '3' : red,
+                                        '4' : { 'on' : True, 'hue' : 100 } })
+        self.assertEqual(self.sent(), [
+            ('POST', '/groups', { 'lights' : ['1', '2', '3'],
+                                  'name' : 'hue-batch' }),
+            ('PUT', '/groups/9/action', { 'on' : True, 'sat' : 254 }),
+            ('PUT', '/lights/4/state', { 'on' : True, 'hue' : 100 })])
+        self.assertEqual(sorted(results), ['1', '2', '3', '4'])
+        self.assertEqual(self.hue.lights['2'].get_state_status('sat'), 254)
+
+    def test_existing_group_reused(self):
+        results = self.hue.apply_many(dict((str(key), { 'on' : True })
+                                            for key in range(1, 7)))
+        self.assertEqual(self.sent(), [('PUT', '/groups/0/action', { 'on' : True })])
+        self.assertEqual(len(results), 6)
+
+    def test_callers_take_turns_with_batch_group(self):
+        bridge = HueSimulator(light_count=6, latency=0.02).start()
+        self.addCleanup(bridge.stop)
+        self.addCleanup(close_pools)
+        hue = Hue(bridge.host, bridge.app_key, port=bridge.port)
+        payloads = [dict((str(key), { 'bri' : 10 }) for key in (1, 2, 3)),
+                    dict((str(key), { 'bri' : 20 }) for key in (4, 5, 6))]
+        for _ in range(3):
+            threads = [Thread(target=hue.apply_many, args=(payload, True))
+                        for payload in payloads]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(dict((key, light['state']['bri'])
+                                    for key, light in bridge.lights.items()),
+                             { '1' : 10, '2' : 10, '3' : 10,
+                               '4' : 20, '5' : 20, '6' : 20 })
+            for light in bridge.lights.values():
+                light['state']['bri'] = 0
+        self.assertEqual(len(bridge.groups), 1)
+
+    def test_validates_before_sending(self):
+        self.assertRaises(InvalidLightAttrValue, self.hue.apply_many,
+                            { '1' : { 'on' : True }, '2' : { 'bri' : 900 } })
+        self.assertEqual(self.hue.requests, [])
+
+
+class ValidatorTest(TestCase):
+    def test_valid_payload(self):
+        validate_many({ 'on' : True, 'bri' : 254, 'xy' : (0.2, 0.9),
+                        'alert' : 'select', 'effect' : None })
+
+    def test_reports_every_error(self):
+        try:
+            validate_many({ 'on' : 1.5, 'bri' : 300, 'hue' : 10, 'color' : 'red' })
+        except InvalidLightAttrs as error:
+            self.assertEqual(sorted(key for key, value, unknown in error.errors),
+                                ['bri', 'color', 'on'])
+        else:
+            self.fail('InvalidLightAttrs not raised')
+
+    def test_xy_needs_two_values(self):
+        self.assertRaises(InvalidLightAttrValue, validate_many, { 'xy' : [0.2] })
+        self.assertRaises(InvalidLightAttrValue, validate_many,
+                            { 'xy' : [0.2, 1.0] })
+
+    def test_unknown_attr(self):
+        self.assertRaises(InvalidLightAttr, validate_many, { 'colour' : 1 })
+
+
+class HueRandomTest(TestCase):
+    attrs = ['on', 'bri', 'hue', 'sat', 'xy', 'ct', 'alert']
+
+    def test_values_are_valid(self):
+        for state in HueRandom(seed=1).states(200, self.attrs):
+            validate_many(state)
+
+    def test_seed_is_reproducible(self):
+        self.assertEqual(HueRandom(seed=7).states(5, self.attrs),
+                            HueRandom(seed=7).states(5, self.attrs))
+
+    def test_group_states(self):
+        hue = DocumentHue(bridge_document())
+        states = HueRandom(seed=1).group_states(hue.groups['0'].lights,
+                                                ['hue'], base={ 'on' : True })
+        self.assertEqual(sorted(states), ['1', '2', '3'])
+        self.assertTrue(states['1']['on'])
+
+
+class StaticEffect(HueEffect):
+    def __init__(self, lights, attrs, **kwargs):
+        super().__init__('static', lights, **kwargs)
+        self.attrs = attrs
+
+    def frame(self, now):
+        return dict((light_id, dict(self.attrs)) for light_id in self.light_ids())
+
+
+class HueEffectEngineTest(TestCase):
+    def setUp(self):
+        self.hue = DocumentHue(bridge_document())
+        self.engine = HueEffectEngine(self.hue)
+        self.lights = self.hue.groups['0'].lights
+
+    def tearDown(self):
+        self.engine.shutdown()
+
+    def add(self, effect, started):
+        effect.id = str(len(self.engine._effects) + 1)
+        effect.started = effect.next_due = started
+        self.engine._effects[effect.id] = effect
+        return effect
+
+    def test_priority_then_newest_wins_shared_lights(self):
+        self.add(StaticEffect(self.lights, { 'hue' : 1 }, priority=1), 0.0)
+        self.add(StaticEffect(self.lights[:2], { 'hue' : 2 }), 1.0)
+        self.add(StaticEffect(self.lights[2:], { 'hue' : 3 }, priority=1), 2.0)
+        payloads = self.engine.run_frame(now=2.0)
+        self.assertEqual(payloads, { '1' : { 'hue' : 1 }, '2' : { 'hue' : 1 },
+                                     '3' : { 'hue' : 3 } })
+
+    def test_late_frames_skip_without_drift(self):
+        effect = self.add(StaticEffect(self.lights, { 'hue' : 1 },
+                                        interval=1.0), 0.0)
+        self.engine.run_frame(now=3.5)
+        self.assertEqual((effect.frames, effect.skipped), (1, 3))
+        self.assertEqual(effect.next_due, 4.0)
+        self.assertEqual(self.engine.run_frame(now=3.9), {})
+
+    def test_stop_by_id(self):
+        effect_id = self.engine.start(StaticEffect(self.lights, { 'on' : True },
+                                                    interval=60))
+        self.assertEqual([stats['id'] for stats in self.engine.list()], [effect_id])
+        self.engine.stop(effect_id)
+        self.assertEqual(self.engine.list(), [])
+        self.assertRaises(HueError, self.engine.stop, effect_id)
+
+    def test_concurrent_starts_run_one_thread(self):
+        starters = [Thread(target=self.engine.start,
+                            args=(StaticEffect(self.lights, { 'on' : True },
+                                                interval=60), ))
+                        for _ in range(8)]
+        for starter in starters:
+            starter.start()
+        for starter in starters:
+            starter.join()
+        self.assertEqual(len([thread for thread in threading_enumerate()
+                                if thread.name == 'hue-effects']), 1)
+
+    def test_reloaded_hue_takes_over_effects(self):
+        engine = get_engine(self.hue)
+        self.addCleanup(_engines.clear)
+        self.addCleanup(engine.shutdown)
+        effect_id = engine.start(StaticEffect(self.lights, { 'on' : True },
+                                                interval=60))
+        reloaded = DocumentHue(bridge_document())
+        self.assertIs(get_engine(reloaded), engine)
+        self.assertIs(engine.hue, reloaded)
+        effect = engine.stop(effect_id)
+        self.assertIs(effect.lights[0], reloaded.lights['1'])
+
+
+class HueSceneTest(TestCase):
+    def setUp(self):
+        document = bridge_document(light_count=4)
+        for key, hue in (('1', 100), ('2', 200), ('3', 300)):
+            document['lights'][key]['state'].update(on=True, bri=200,
+                                                    hue=hue, sat=254)
+        self.hue = DocumentHue(document)
+        self.hue.requests = []
+
+    def sent(self):
+        return [(method, url[len(self.hue.url):], data)
+                    for method, url, data in self.hue.requests]
+
+    def test_capture_uses_cached_state(self):
+        scene = HueScene.capture(self.hue.groups['0'], name='evening')
+        self.assertEqual(self.hue.requests, [])
+        self.assertEqual(scene.states['1'], { 'on' : True, 'bri' : 200,
+                                              'hue' : 100, 'sat' : 254 })
+        self.assertEqual(scene.states['4'], { 'on' : False })
+
+    def test_restore_shares_group_action(self):
+        self.hue.document['groups']['1'] = { 'name' : 'Trio',
+                                             'lights' : ['1', '2', '3'] }
+        self.hue.load_hue()
+        lights = [self.hue.lights[key] for key in ('1', '2', '3')]
+        scene = HueScene.capture(lights)
+        self.hue.apply_many(dict((light.id, { 'bri' : 50 })
+                                    for light in lights))
+        self.hue.lights['1'].set_light_attr({ 'hue' : 0 })
+        self.hue.requests = []
+        results = scene.restore(self.hue)
+        self.assertEqual(self.sent(), [
+            ('PUT', '/groups/1/action', { 'bri' : 200 }),
+            ('PUT', '/lights/1/state', { 'hue' : 100 })])
+        self.assertEqual(sorted(results), ['1', '2', '3'])
+        self.hue.requests = []
+        self.assertEqual(scene.restore(self.hue), {})
+        self.assertEqual(self.hue.requests, [])
+
+    def test_restore_without_group_sends_full_deltas(self):
+        for keys in (('1', '2'), ('1', '2', '3')):
+            lights = [self.hue.lights[key] for key in keys]
+            scene = HueScene.capture(lights)
+            self.hue.apply_many(dict((light.id, { 'bri' : 50, 'hue' : 0 })
+                                        for light in lights))
+            self.hue.requests = []
+            scene.restore(self.hue)
+            self.assertEqual(self.sent(), [
+                ('PUT', '/lights/%s/state' % light.id,
+                    { 'bri' : 200, 'hue' : scene.states[light.id]['hue'] })
+                for light in lights])
+
+    def test_capture_after_colour_command(self):
+        light = self.hue.lights['1']
+        light.set_light_attr({ 'ct' : 300 })
+        self.assertEqual(light.get_state_status('colormode'), 'ct')
+        scene = HueScene.capture([light])
+        self.assertEqual(scene.states['1'], { 'on' : True, 'bri' : 200,
+                                              'ct' : 300 })
+        light.set_light_attr({ 'xy' : [0.5, 0.4] })
+        self.assertEqual(HueScene.capture([light]).states['1']['xy'],
+                            [0.5, 0.4])
+
+    def test_store_round_trip(self):
+        store = SceneStore()
+        scene = HueScene.capture(self.hue.groups['0'], name='evening')
+        store.save(HueScene.from_dict(json.loads(json.dumps(scene.as_dict()))))
+        self.assertEqual(store.names(), ['evening'])
+        self.assertEqual(store.get('evening').states, scene.states)
+        store.delete('evening')
+        self.assertRaises(HueError, store.get, 'evening')
+
+
+class KeyframeAnimationTest(TestCase):
+    def test_linear_keyframes_become_one_transition(self):
+        keyframes = [Keyframe(second, hue=second * 1000, sat=200)
+                        for second in range(30)]
+        self.assertEqual(plan_commands(keyframes), [
+            (0.0, { 'hue' : 0, 'sat' : 200, 'transitiontime' : 0 }),
+            (0.0, { 'hue' : 29000, 'sat' : 200, 'transitiontime' : 290 })])
+
+    def test_turning_points_are_kept(self):
+        keyframes = [Keyframe(0, bri=0), Keyframe(1, bri=100),
+                     Keyframe(2, bri=200), Keyframe(3, bri=0)]
+        self.assertEqual([attrs for at, attrs in plan_commands(keyframes)], [
+            { 'bri' : 0, 'transitiontime' : 0 },
+            { 'bri' : 200, 'transitiontime' : 20 },
+            { 'bri' : 0, 'transitiontime' : 10 }])
+
+    def test_discrete_attrs_change_at_their_keyframe(self):
+        keyframes = [Keyframe(0, bri=0, on=True), Keyframe(5, bri=127, on=True),
+                     Keyframe(10, bri=254, on=False)]
+        self.assertEqual(plan_commands(keyframes), [
+            (0.0, { 'bri' : 0, 'on' : True, 'transitiontime' : 0 }),
+            (0.0, { 'bri' : 254, 'on' : True, 'transitiontime' : 100 }),
+            (10.0, { 'on' : False })])
+        keyframes = [Keyframe(0, bri=0, on=True), Keyframe(1, bri=100, on=False),
+                     Keyframe(2, bri=200, on=True)]
+        self.assertEqual([(at, attrs['on']) for at, attrs in
+                            plan_commands(keyframes)],
+                         [(0.0, True), (0.0, True), (1.0, False), (2.0, True)])
+
+    def test_mixed_modes_use_xy(self):
+        commands = plan_commands([Keyframe(0, hue=0, sat=254),
+                                  Keyframe(1, ct=300)], model_id='LCT001')
+        self.assertEqual(commands[0][1]['xy'], [0.675, 0.322])
+        validate_many(commands[1][1])
+
+    def test_effect_sends_due_commands(self):
+        hue = DocumentHue(bridge_document())
+        engine = HueEffectEngine(hue)
+        animation = HueAnimation(hue.groups['0'], [Keyframe(0, bri=10),
+                                                    Keyframe(2, bri=250)])
+        effect = KeyframeEffect(animation)
+        effect.id, effect.started, effect.next_due = '1', 0.0, 0.0
+        engine._effects['1'] = effect
+        hue.requests = []
+        engine.run_frame(now=0.0)
+        engine.run_frame(now=0.1)
+        self.assertEqual([data for method, url, data in hue.requests],
+                    [{ 'bri' : 10, 'transitiontime' : 0 },
+                     { 'bri' : 250, 'transitiontime' : 20 }])
+        self.assertEqual(engine.list(), [])
+
+
+class HueClusterTest(TestCase):
+    def setUp(self):
+        self.bridges = { 'hall' : { 'host' : '10.0.0.2', 'app_key' : 'key' },
+                         'den' : { 'host' : '10.0.0.3', 'app_key' : 'key' },
+                         'down' : { 'host' : '10.0.0.4', 'app_key' : 'key' } }
+
+        def factory(host, app_key, port=80, lazy=False):
+            if host == '10.0.0.4':
+                raise HueError('unreachable')
+            return DocumentHue(bridge_document(2), lazy=lazy)
+        self.cluster = HueCluster(self.bridges, factory=factory)
+        self.addCleanup(self.cluster.close)
+
+    def test_namespaced_lights(self):
+        self.assertEqual(sorted(self.cluster.lights),
+                            ['den:1', 'den:2', 'hall:1', 'hall:2'])
+        self.assertIs(self.cluster.light('den:2'),
+                        self.cluster.bridges['den'].lights['2'])
+        self.assertRaises(HueLightDoesNotExist, self.cluster.light, 'down:1')
+        self.assertEqual(list(self.cluster.errors), ['down'])
+
+    def test_apply_many_splits_by_bridge(self):
+        results = self.cluster.apply_many({ 'hall:1' : { 'bri' : 5 },
+                                            'den:2' : { 'bri' : 6 } })
+        self.assertEqual(sorted(results), ['den:2', 'hall:1'])
+        hall = self.cluster.bridges['hall'].requests[-1]
+        self.assertEqual((hall[0], hall[2]), ('PUT', { 'bri' : 5 }))
+        self.assertTrue(hall[1].endswith('/lights/1/state'))
+
+    def test_failed_bridge_keeps_other_results(self):
+        def fails_on_den(hue):
+            if hue is self.cluster.bridges['den']:
+                raise HueError('den')
+            return 'ok'
+        with self.assertRaises(HueClusterError) as raised:
+            self.cluster.map(fails_on_den)
+        self.assertEqual(raised.exception.results, { 'hall' : 'ok' })
+        self.assertEqual(list(raised.exception.errors), ['den'])
+
+    def test_partial_apply_many_keeps_keys(self):
+        def fails(*args, **kwargs):
+            raise HueError('den')
+        self.cluster.bridges['den'].apply_many = fails
+        with self.assertRaises(HueClusterError) as raised:
+            self.cluster.apply_many({ 'hall:1' : { 'bri' : 5 },
+                                      'den:2' : { 'bri' : 6 } })
+        self.assertEqual(sorted(raised.exception.results), ['hall:1'])
+        self.assertEqual(list(raised.exception.errors), ['den'])
+
+
+class HueSnapshotTest(TestCase):
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.document = bridge_document(3)
+        self.built = []
+
+        def factory(host, app_key, port=80, lazy=False):
+            hue = DocumentHue(self.document, lazy=lazy)
+            self.built.append(hue)
+            return hue
+        self.factory = factory
+        self.path = snapshot_path(self.cache_dir, '10.0.0.2', 'key')
+
+    def tearDown(self):
+        for name in os.listdir(self.cache_dir):
+            os.unlink(os.path.join(self.cache_dir, name))
+        os.rmdir(self.cache_dir)
+
+    def warm_start(self):
+        return warm_start('10.0.0.2', 'key', cache_dir=self.cache_dir,
+                            factory=self.factory, background=False)
+
+    def test_cold_start_writes_snapshot(self):
+        self.warm_start()
+        snapshot = read_snapshot(self.path, host='10.0.0.2', port=80)
+        self.assertEqual(snapshot['schema'], SCHEMA_VERSION)
+        self.assertEqual(snapshot['bridge']['mac'], 'mac')
+        self.assertEqual(sorted(snapshot['state']['lights']), ['1', '2', '3'])
+        self.assertEqual(os.listdir(self.cache_dir),
+                            [os.path.basename(self.path)])
+
+    def test_snapshot_keeps_app_keys_private(self):
+        self.document['config']['whitelist'] = { 'key' : { 'name' : 'app' } }
+        self.warm_start()
+        self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+        with open(self.path, 'rb') as snapshot_file:
+            self.assertNotIn(b'"app"', snapshot_file.read())
+        hue = self.warm_start()
+        self.assertEqual(hue.config.whitelist, { 'key' : { 'name' : 'app' } })
+
+    def test_warm_start_serves_snapshot_then_revalidates(self):
+        self.warm_start()
+        self.document['lights']['2']['state']['bri'] = 7
+        hue = self.warm_start()
+        self.assertEqual(hue.lights['2'].state['bri'], 7)
+        self.assertEqual([request[1] for request in hue.requests], [hue.url])
+        self.assertEqual(read_snapshot(self.path)['state']['lights']['2']
+                            ['state']['bri'], 7)
+
+    def test_unusable_snapshot_is_ignored(self):
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write('{"schema": 0}')
+        self.assertIsNone(read_snapshot(self.path))
+        hue = self.warm_start()
+        self.assertEqual(len(hue.lights), 3)
+        self.assertEqual(read_snapshot(self.path)['schema'], SCHEMA_VERSION)
+
+
+class StaticTransport:
+    host = '10.0.0.2'
+
+    def __init__(self, data=b'[{"success":{}}]', error=None):
+        self.data = data
+        self.error = error
+
+    def request(self, method, path, body=None):
+        if self.error:
+            raise self.error
+        return self.data
+
+
+class HueMetricsTest(TestCase):
+    def test_endpoint_hides_key_and_ids(self):
+        self.assertEqual(endpoint('/api/secret/lights/12/state'),
+                            '/lights/:id/state')
+        self.assertEqual(endpoint('/api/secret'), '/')
+
+    def test_requests_and_errors_are_rendered(self):
+        recorder = HueMetrics(enabled=True)
+        recorder.request(StaticTransport(), 'PUT', '/api/k/lights/1/state',
+                            body=b'{"on":true}')
+        recorder.request(StaticTransport(b'[{"error":{}}]'), 'PUT',
+                            '/api/k/lights/1/state', body=b'{"on":true}')
+        self.assertRaises(InvalidHueHub, recorder.request,
+                            StaticTransport(error=InvalidHueHub('down')),
+                            'GET', '/api/k')
+        text = recorder.render()
+        labels = 'host="10.0.0.2",method="PUT",endpoint="/lights/:id/state"'
+        self.assertIn('hue_request_seconds_count{%s} 2' % labels, text)
+        self.assertIn('hue_request_seconds_bucket{%s,le="+Inf"} 2' % labels,
+                        text)
+        self.assertIn('hue_request_bytes_sent_total{%s} 22' % labels, text)
+        self.assertIn('hue_bridge_error_responses_total{%s} 1' % labels, text)
+        self.assertIn('hue_request_errors_total{host="10.0.0.2",method="GET",'
+                        'endpoint="/",error="InvalidHueHub"} 1', text)
+
+    def test_load_phases(self):
+        metrics.enable()
+        self.addCleanup(metrics.reset)
+        self.addCleanup(metrics.disable)
+        DocumentHue(bridge_document())
+        self.assertEqual(sorted(metrics.phases), ['config', 'fetch', 'groups',
+                                            'lights', 'parse', 'schedules'])
+
+
+class HueSimulatorTest(TestCase):
+    def start(self, **kwargs):
+        bridge = HueSimulator(light_count=4, **kwargs).start()
+        self.addCleanup(bridge.stop)
+        self.addCleanup(close_pools)
+        return bridge, Hue(bridge.host, bridge.app_key, port=bridge.port)
+
+    def test_load_and_commands_round_trip(self):
+        bridge, hue = self.start()
+        self.assertEqual(len(hue.lights), 4)
+        hue.lights['2'].set_light_attr({ 'on' : True, 'bri' : 30 })
+        group = hue.create_group([hue.lights['1'], hue.lights['3']], 'Pair')
+        group.set_attr({ 'on' : True, 'hue' : 500 })
+        self.assertEqual(bridge.lights['2']['state']['bri'], 30)
+        self.assertEqual(bridge.lights['3']['state']['hue'], 500)
+        group.delete()
+        self.assertEqual(bridge.groups, {})
+        self.assertFalse(hue.refresh())
+
+    def test_rate_limit(self):
+        bridge, hue = self.start(rate_limit=2)
+        hue.transport.retries = 0
+        light = hue.lights['1']
+        light.turn_on()
+        light.turn_off()
+        self.assertRaises(InvalidHueHub, light.turn_on)
+        self.assertEqual(bridge.stats()['rejected'], 1)
+
+    def test_rate_limited_put_is_retried(self):
+        bridge, hue = self.start(rate_limit=20)
+        hue.transport.retries = 10
+        hue.transport.backoff = 0.2
+        for _ in range(25):
+            hue.lights['1'].turn_on()
+        self.assertTrue(bridge.stats()['rejected'] > 0)
+        self.assertEqual(bridge.stats()['commands'], 25)
+
+
+class HueConnectionPoolTest(TestCase):
+    def start(self, **kwargs):
+        bridge = HueSimulator(**kwargs).start()
+        self.addCleanup(bridge.stop)
+        self.addCleanup(close_pools)
+        return bridge
+
+    def test_bridge_pool_is_shared(self):
+        bridge = self.start()
+        first = Hue(bridge.host, bridge.app_key, port=bridge.port)
+        second = Hue(bridge.host, bridge.app_key, port=bridge.port)
+        self.assertTrue(first.transport is second.transport)
+        self.assertTrue(get_pool(bridge.host, bridge.port) is first.transport)
+        with self.assertWarns(RuntimeWarning):
+            pool = get_pool(bridge.host, bridge.port, pool_size=8)
+        self.assertTrue(pool is first.transport)
+        self.assertEqual(pool.pool_size, first.transport.pool_size)
+
+    def test_stale_connection_is_replaced(self):
+        bridge = self.start()
+        pool = get_pool(bridge.host, bridge.port, retries=0)
+        pool.request('GET', '/api/simulator/lights')
+        self.assertEqual(pool._idle.qsize(), 1)
+        # The bridge drops idle keep-alive connections
+        stale = pool._idle.queue[0]
+        stale.sock.shutdown(SHUT_RDWR)
+        data = codec.loads(pool.request('GET', '/api/simulator/lights'))
+        self.assertEqual(len(data), 3)
+        self.assertFalse(pool._idle.queue[0] is stale)
+        self.assertEqual(pool.breaker.stats()['recent_failures'], 0)
+
+    def test_stale_connection_post_is_not_resent(self):
+        bridge = self.start()
+        pool = get_pool(bridge.host, bridge.port, retries=0)
+        pool.request('GET', '/api/simulator/lights')
+        pool._idle.queue[0].sock.shutdown(SHUT_RDWR)
+        self.assertRaises(InvalidHueHub, pool.request, 'POST',
+                            '/api/simulator/groups',
+                            b'{"lights":["1"],"name":"Once"}')
+        self.assertEqual(bridge.groups, {})
+        self.assertEqual(pool._idle.qsize(), 0)
+
+    def test_pool_size_bounds_connections(self):
+        bridge = self.start(latency=0.3)
+        pool = get_pool(bridge.host, bridge.port, pool_size=1,
+                            pool_timeout=0.05, retries=0)
+        busy = Thread(target=pool.request, args=('GET', '/api/simulator'))
+        busy.start()
+        self.addCleanup(busy.join)
+        sleep(0.05)
+        self.assertRaises(InvalidHueHub, pool.request, 'GET', '/api/simulator')
+        busy.join()
+        pool.request('GET', '/api/simulator')
+        self.assertEqual(pool._idle.qsize(), 1)
+
+
+class AsyncHueTest(TestCase):
+    def setUp(self):
+        self.bridge = HueSimulator(light_count=4).start()
+        self.addCleanup(self.bridge.stop)
+        self.addCleanup(close_pools)
+
+    def run_hue(self, coro_func):
+        async def main():
+            hue = AsyncHue(self.bridge.host, self.bridge.app_key,
+                            port=self.bridge.port)
+            try:
+                await hue.load_hue()
+                return await coro_func(hue)
+            finally:
+                hue.close()
+        return asyncio.run(main())
+
+    def test_refresh_and_scan(self):
+        async def check(hue):
+            self.bridge.lights['2']['state']['bri'] = 77
+            changes = await hue.refresh()
+            self.assertEqual(changes.lights_changed, { '2' : { 'bri' : (0, 77) } })
+            self.bridge.lights['5'] = _light(5)
+            self.assertEqual(await hue.scan_lights(), ['5'])
+            self.assertIn('5', hue.lights)
+        self.run_hue(check)
+
+    def test_concurrent_apply_many_take_turns(self):
+        for key in (5, 6):
+            self.bridge.lights[str(key)] = _light(key)
+
+        async def check(hue):
+            await gather(
+                hue.apply_many(dict((key, { 'bri' : 10 })
+                                    for key in ('1', '2', '3')), force=True),
+                hue.apply_many(dict((key, { 'bri' : 20 })
+                                    for key in ('4', '5', '6')), force=True))
+            self.assertEqual(dict((key, light['state']['bri'])
+                                    for key, light in self.bridge.lights.items()),
+                             { '1' : 10, '2' : 10, '3' : 10,
+                               '4' : 20, '5' : 20, '6' : 20 })
+            self.assertEqual(len(self.bridge.groups), 1)
+        self.run_hue(check)
+
+    def test_apply_many_and_group_update(self):
+        async def check(hue):
+            red = { 'on' : True, 'hue' : 0, 'sat' : 254 }
+            results = await hue.apply_many({ '1' : red, '2' : red, '3' : red,
+                                             '4' : { 'on' : True, 'hue' : 9 } })
+            self.assertEqual(sorted(results), ['1', '2', '3', '4'])
+            self.assertEqual(self.bridge.groups['1']['lights'], ['1', '2', '3'])
+            self.assertEqual([self.bridge.lights[key]['state']['sat']
+                                for key in ('1', '2', '3', '4')], [254, 254, 254, 0])
+            group = hue.groups['1']
+            group.lights = [hue.lights['4']]
+            await group.update()
+            self.assertEqual(self.bridge.groups['1']['lights'], ['4'])
+            await group.delete()
+            self.assertEqual(self.bridge.groups, {})
+        self.run_hue(check)
+
+    def test_sync_only_methods_raise(self):
+        async def check(hue):
+            self.assertRaises(TypeError, hue.enable_scheduler)
+            self.assertRaises(TypeError, hue.create_schedule, 'wake', [])
+            self.assertRaises(TypeError, hue.load_lights)
+        self.run_hue(check)
+
+
+class HueBatchScheduleTest(TestCase):
+    def setUp(self):
+        self.time = datetime(2030, 1, 1, 8)
+        self.command = { 'address' : '/api/simulator/lights/1/state',
+                         'body' : { 'on' : True }, 'method' : 'PUT' }
+
+    def start(self, **kwargs):
+        bridge = HueSimulator(light_count=2, **kwargs).start()
+        self.addCleanup(bridge.stop)
+        self.addCleanup(close_pools)
+        return bridge, Hue(bridge.host, bridge.app_key, port=bridge.port)
+
+    def test_repeats_expand_without_recursion(self):
+        times = list(schedule_times(self.time, { 'times' : 5000,
+                                                 'interval' : { 'hours' : 1 } }))
+        self.assertEqual(len(times), 5001)
+        self.assertEqual((times[-1] - times[0]).total_seconds(), 5000 * 3600)
+
+    def test_validates_before_sending(self):
+        hue = DocumentHue(bridge_document())
+        hue.requests = []
+        bad = dict(self.command, body={ 'bri' : 900 })
+        self.assertRaises(InvalidHueSchedule, hue.create_schedules, 'wake',
+                            [self.command, bad], time=self.time)
+        self.assertRaises(InvalidHueSchedule, hue.create_schedules, 'wake',
+                            [self.command], time=self.time,
+                            repeats={ 'times' : 100, 'interval' : { 'days' : 1 } })
+        self.assertEqual(hue.requests, [])
+
+    def test_paced_batch_creates_every_occurrence(self):
+        bridge, hue = self.start(rate_limit=20)
+        batch = hue.create_schedules('wake', [self.command], time=self.time,
+                        repeats={ 'times' : 24, 'interval' : { 'days' : 1 } },
+                        rate=20)
+        self.assertTrue(batch.ok)
+        self.assertEqual(len(set(batch.created)), 25)
+        self.assertEqual(sorted(hue.schedules), sorted(bridge.schedules))
+        self.assertEqual(bridge.stats()['rejected'], 0)
+
+    def test_failures_are_summarized(self):
+        bridge, hue = self.start(rate_limit=3)
+        batch = hue.create_schedules('wake', [self.command], time=self.time,
+                        repeats={ 'times' : 5, 'interval' : { 'days' : 1 } },
+                        rate=None)
+        summary = batch.summary()
+        self.assertFalse(batch.ok)
+        self.assertEqual(len(summary['created']) + len(summary['failures']), 6)
+        self.assertEqual(len(summary['created']), len(bridge.schedules))
+        self.assertEqual(summary['failures'][0]['address'],
+                            self.command['address'])
+
+
+class HueHistoryTest(TestCase):
+    def setUp(self):
+        self.rows = []
+        self.hue = DocumentHue(bridge_document())
+
+    def recorder(self, **kwargs):
+        recorder = HueHistoryRecorder(writer=self.rows.extend, **kwargs)
+        self.addCleanup(recorder.stop, flush=False)
+        return recorder.attach(self.hue)
+
+    def test_records_changed_attrs_only(self):
+        recorder = self.recorder(flush_interval=60)
+        self.hue.lights['1'].set_light_attr({ 'on' : True, 'bri' : 100,
+                                              'hue' : 500 }, force=True)
+        self.hue.lights['1'].turn_on()
+        self.hue.groups['0'].set_attr({ 'bri' : 10 })
+        self.assertEqual(recorder.flush(), 4)
+        self.assertEqual([(light_id, source, attrs)
+                            for bridge, light_id, at, source, attrs in self.rows],
+                         [('1', 'command', { 'on' : True, 'hue' : 500 }),
+                          ('1', 'command', { 'bri' : 10 }),
+                          ('2', 'command', { 'bri' : 10 }),
+                          ('3', 'command', { 'bri' : 10 })])
+
+    def test_refresh_records_bridge_changes(self):
+        recorder = self.recorder(flush_interval=60)
+        self.hue.document['lights']['2']['state']['bri'] = 42
+        self.hue.refresh()
+        recorder.flush()
+        self.assertEqual([(row[1], row[3], row[4]) for row in self.rows],
+                         [('2', 'bridge', { 'bri' : 42 })])
+
+    def test_commands_do_not_wait_on_writes(self):
+        release = Event()
+        writing = Event()
+
+        def slow_writer(batch):
+            writing.set()
+            release.wait(5)
+            self.rows.extend(batch)
+        recorder = HueHistoryRecorder(writer=slow_writer, batch_size=1,
+                                        flush_interval=60)
+        recorder.attach(self.hue)
+        self.hue.lights['1'].turn_on()
+        self.assertTrue(writing.wait(5))
+        start = monotonic()
+        self.hue.lights['2'].turn_on()
+        self.assertTrue(monotonic() - start < 0.5)
+        release.set()
+        recorder.stop()
+        self.assertEqual([row[1] for row in self.rows], ['1', '2'])
+
+    def test_downsample_merges_per_bucket(self):
+        rows = [('hub', '1', 0.0, 'command', { 'bri' : 1 }),
+                ('hub', '1', 60.0, 'bridge', { 'bri' : 2, 'on' : True }),
+                ('hub', '2', 70.0, 'command', { 'hue' : 5 }),
+                ('hub', '1', 1000.0, 'command', { 'bri' : 3 })]
+        self.assertEqual(downsample(rows), [
+                ('hub', '1', 60.0, 'mixed', { 'bri' : 2, 'on' : True }),
+                ('hub', '2', 70.0, 'command', { 'hue' : 5 }),
+                ('hub', '1', 1000.0, 'command', { 'bri' : 3 })])
+
+
+class HueResilienceTest(TestCase):
+    def test_breaker_opens_and_probes(self):
+        breaker = CircuitBreaker(min_requests=4, reset_timeout=0.05)
+        for outcome in (True, False, True, False):
+            self.assertTrue(breaker.allow())
+            breaker.record(outcome)
+        self.assertEqual(breaker.state, 'open')
+        self.assertFalse(breaker.allow())
+        start = monotonic()
+        while not breaker.allow():
+            self.assertTrue(monotonic() - start < 1)
+        self.assertFalse(breaker.allow())
+        breaker.record(True)
+        self.assertEqual(breaker.state, 'closed')
+
+    def test_dead_bridge_fails_fast(self):
+        bridge = HueSimulator().start()
+        host, port = bridge.host, bridge.port
+        bridge.stop()
+        pool = HueConnectionPool(host, port, retries=0,
+                                    breaker=CircuitBreaker(min_requests=3))
+        for _ in range(3):
+            self.assertRaises(InvalidHueHub, pool.request, 'GET', '/api/x')
+        self.assertRaises(HueCircuitOpen, pool.request, 'GET', '/api/x')
+
+    def test_deadline_bounds_slow_bridge(self):
+        bridge = HueSimulator(latency=0.5).start()
+        self.addCleanup(bridge.stop)
+        pool = HueConnectionPool(bridge.host, bridge.port)
+        self.addCleanup(pool.close)
+        start = monotonic()
+        with deadline(0.1):
+            self.assertRaises(InvalidHueHub, pool.request, 'GET',
+                                '/api/simulator')
+            self.assertRaises(HueDeadlineExceeded, pool.request, 'GET',
+                                '/api/simulator')
+        self.assertTrue(monotonic() - start < 0.4)
+        self.assertEqual(pool.breaker.stats()['recent_failures'], 0)
+
+    def test_no_timeout(self):
+        bridge = HueSimulator(latency=0.2).start()
+        self.addCleanup(bridge.stop)
+        self.addCleanup(close_pools)
+        hue = Hue(bridge.host, bridge.app_key, port=bridge.port, timeout=None)
+        self.assertEqual(len(hue.lights), 3)
+        with deadline(0.05):
+            self.assertRaises(InvalidHueHub, hue.refresh)
+        self.assertEqual(hue.transport.breaker.stats()['recent_failures'], 0)
@@ -0,0 +1,217 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Keep-alive HTTP transport for Hue bridges
+
+"""
+
+from http.client import HTTPConnection, HTTPException
+from socket import IPPROTO_TCP, TCP_NODELAY, timeout as SocketTimeout
+from queue import LifoQueue, Empty, Full
+from random import uniform
+from threading import BoundedSemaphore, Lock
+from time import sleep
+from warnings import warn
+from hue.breaker import CircuitBreaker
+from hue.deadline import cap_timeout, remaining
+from hue.exceptions import (InvalidHueHub, HueCircuitOpen,
+                                HueDeadlineExceeded, )
+
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = 10.0
+DEFAULT_CONNECT_TIMEOUT = 3.0
+HEADERS = { 'Content-Type' : 'application/json',
+            'Connection' : 'keep-alive' }
+# Only idempotent requests are sent again after a failure
+RETRY_METHODS = frozenset(('GET', 'PUT'))
+DEFAULT_RETRIES = 2
+DEFAULT_BACKOFF = 0.05
+MAX_BACKOFF = 1.0
+
+
+class HueConnectionPool:
+    """Bounded pool of persistent HTTP/1.1 connections to one bridge"""
+
+    def __init__(self, host, port=80, pool_size=DEFAULT_POOL_SIZE,
+                    timeout=DEFAULT_TIMEOUT,
+                    connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+                    pool_timeout=None, retries=DEFAULT_RETRIES,
+                    backoff=DEFAULT_BACKOFF, breaker=None):
+        """A pool of connections to a Hue Hub
+            -pool_size [max open connections to the bridge]
+            -timeout [seconds to wait on a response]
+            -connect_timeout [seconds to wait on the TCP connect]
+            -pool_timeout [seconds to wait for a free connection, None blocks]
+            -retries [extra attempts of failed GET and PUT requests]
+            -backoff [first retry delay in seconds, doubled per retry]
+            -breaker [CircuitBreaker of this bridge, a default one if None]
+            Every wait is cut short by the current hue.deadline
+        """
+        self.host = host
+        self.port = port
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.pool_timeout = pool_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._idle = LifoQueue(pool_size)
+        self._slots = BoundedSemaphore(pool_size)
+
+    def _new_connection(self, timeout):
+        conn = HTTPConnection(self.host, self.port,
+                    timeout=_shortest(self.connect_timeout, timeout))
+        conn.connect()
+        conn.sock.settimeout(timeout)
+        # Commands are small, do not let Nagle hold them back
+        conn.sock.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        return conn
+
+    def _get_connection(self, timeout):
+        """Get an idle connection, opening one if none is idle"""
+        try:
+            conn = self._idle.get_nowait()
+        except Empty:
+            return self._new_connection(timeout), False
+        conn.sock.settimeout(timeout)
+        return conn, True
+
+    def _put_connection(self, conn):
+        try:
+            self._idle.put_nowait(conn)
+        except Full:
+            conn.close()
+
+    def _send(self, conn, method, path, body):
+        conn.request(method, path, body=body, headers=HEADERS)
+        response = conn.getresponse()
+        return response, response.read()
+
+    def _exchange(self, method, path, body):
+        """One attempt over a pooled connection, returns (response, data)"""
+        timeout = cap_timeout(self.timeout)
+        pool_timeout = cap_timeout(self.pool_timeout)
+        if not self._slots.acquire(timeout=pool_timeout):
+            raise InvalidHueHub('No free connection to %s:%d'
+                                    % (self.host, self.port))
+        conn = None
+        try:
+            if not self.breaker.allow():
+                raise HueCircuitOpen('Circuit open to %s:%d'
+                                        % (self.host, self.port))
+            try:
+                conn, reused = self._get_connection(timeout)
+                try:
+                    response, data = self._send(conn, method, path, body)
+                except (HTTPException, ConnectionError):
+                    # The bridge may have handled it, only resend idempotent
+                    if not reused or method not in RETRY_METHODS:
+                        raise
+                    # Bridge dropped an idle keep-alive connection, retry fresh
+                    conn.close()
+                    conn = self._new_connection(timeout)
+                    response, data = self._send(conn, method, path, body)
+            except (HTTPException, OSError) as error:
+                if conn:
+                    conn.close()
+                # Running out of our own deadline says nothing of the bridge
+                cut_short = timeout is not None and \
+                                (self.timeout is None or
+                                    timeout < self.timeout) and \
+                                isinstance(error, SocketTimeout)
+                self.breaker.record(None if cut_short else False)
+                raise InvalidHueHub(error)
+            if response.will_close:
+                conn.close()
+            else:
+                self._put_connection(conn)
+            # A busy bridge answering 429 is still healthy
+            self.breaker.record(response.status < 500)
+            return response, data
+        finally:
+            self._slots.release()
+
+    def _retry_delay(self, attempt):
+        """Jittered exponential backoff, None when the deadline forbids"""
+        delay = uniform(0, min(MAX_BACKOFF, self.backoff * 2 ** attempt))
+        left = remaining()
+        if left is not None and delay >= left:
+            return None
+        return delay
+
+    def request(self, method, path, body=None):
+        """Send request over a pooled connection and return response body
+            Failed GET and PUT requests are retried with backoff, server
+            errors and 429 included, within the current deadline
+        """
+        attempts = 1 + (self.retries if method in RETRY_METHODS else 0)
+        for attempt in range(attempts):
+            try:
+                response, data = self._exchange(method, path, body)
+            except (HueCircuitOpen, HueDeadlineExceeded):
+                raise
+            except InvalidHueHub as error:
+                failure = error
+            else:
+                if response.status < 400:
+                    return data
+                failure = InvalidHueHub('%d %s' % (response.status,
+                                                    response.reason))
+                if response.status < 500 and response.status != 429:
+                    raise failure
+            delay = self._retry_delay(attempt) \
+                        if attempt + 1 < attempts else None
+            if delay is None:
+                raise failure
+            sleep(delay)
+
+    def close(self):
+        """Close every idle connection"""
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except Empty:
+                return
+
+
+def _shortest(*timeouts):
+    """Shortest of timeouts, None meaning no timeout"""
+    timeouts = [timeout for timeout in timeouts if timeout is not None]
+    return min(timeouts) if timeouts else None
+
+
+_pools = {}
+_pools_lock = Lock()
+
+
+def get_pool(host, port=80, **kwargs):
+    """Get the shared connection pool for a bridge, creating it if needed
+        kwargs only configure a new pool, a RuntimeWarning names any that
+        differ from the settings of the bridge's existing pool
+    """
+    key = (host, port)
+    with _pools_lock:
+        if key not in _pools:
+            _pools[key] = HueConnectionPool(host, port, **kwargs)
+            return _pools[key]
+        pool = _pools[key]
+    ignored = sorted(name for name, value in kwargs.items()
+                        if getattr(pool, name) != value)
+    if ignored:
+        warn('Pool for %s:%d exists, ignoring %s' % (host, port,
+                    ', '.join('%s=%r' % (name, kwargs[name])
+                                for name in ignored)),
+             RuntimeWarning, stacklevel=2)
+    return pool
+
+
+def close_pools():
+    """Close idle connections of every shared pool"""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
@@ -1,12 +1,30 @@
 
 from django.conf.urls.defaults import *
-from webservices.hue.views import turn_on, turn_off, start_randomize, stop_randomize 
+from webservices.hue.views import turn_on, turn_off, start_randomize, stop_randomize, \
+                                    reload_hue, scheduler_stats, list_effects, \
+                                    cluster_turn_on, cluster_turn_off, cluster_lights, \
+                                    cluster_reload, metrics_view, save_scene, \
+                                    restore_scene
 
 urlpatterns = patterns('',
     url(r'^$', turn_on),
+    url(r'^cluster/turn_on$', cluster_turn_on),
+    url(r'^cluster/turn_on/(?P<light>[\w-]+:[0-9]+)$', cluster_turn_on),
+    url(r'^cluster/turn_off$', cluster_turn_off),
+    url(r'^cluster/turn_off/(?P<light>[\w-]+:[0-9]+)$', cluster_turn_off),
+    url(r'^cluster/lights$', cluster_lights),
+    url(r'^cluster/reload$', cluster_reload),
+    url(r'^metrics$', metrics_view),
+    url(r'^scenes/(?P<name>[\w-]+)/save$', save_scene),
+    url(r'^scenes/(?P<name>[\w-]+)/save/(?P<group_id>[0-9]{1,3})$', save_scene),
+    url(r'^scenes/(?P<name>[\w-]+)/restore$', restore_scene),
     url(r'^turn_on$', turn_on),
     url(r'turn_off$', turn_off),
     url(r'randomize$', start_randomize),
     url(r'randomize/(?P<group_id>[0-9]+){1,3}$', start_randomize),
     url(r'randomize/(?P<group_id>[0-9]{1,3})/(?P<secs>[0-9]{1,4})$', start_randomize),
-    url(r'randomize/stop', stop_randomize), )
+    url(r'randomize/stop$', stop_randomize),
+    url(r'randomize/stop/(?P<effect_id>[0-9]+)$', stop_randomize),
+    url(r'effects$', list_effects),
+    url(r'reload$', reload_hue),
+    url(r'scheduler$', scheduler_stats), )
@@ -0,0 +1,90 @@
+"""
+(c) 2013 Sean McCully
+# Licensed under the MIT license: http://www.opensource.org/licenses/mit-license.php
+# Also licenced under the Apache License, 2.0: http://opensource.org/licenses/apache2.0.php
+
+Hue light attribute validators, compiled once from ALLOWED_STATES
+
+"""
+
+from hue.exceptions import InvalidLightAttrs
+
+
+ALLOWED_STATES = { 'on' : bool,
+                   'bri' : [0, 254],
+                    'hue' : [0, 65535],
+                    'sat' : [0, 254],
+                    'xy' : [0, 0.9],
+                    'ct' : [154, 500],
+                    'alert' : ('select', 'lselect'),
+                    'effect' : (None, ),
+                    'reachable' : bool,
+                    'transitiontime' : [0, 65535] }
+# Range attrs taking a list of values, with the list length
+VECTOR_STATES = { 'xy' : 2 }
+
+_NUMBERS = (int, float)
+
+
+def _bool_validator():
+    def check(val):
+        return val is True or val is False
+    return check
+
+def _choice_validator(choices):
+    def check(val):
+        return val in choices
+    return check
+
+def _range_validator(low, high):
+    def check(val):
+        return type(val) in _NUMBERS and low <= val <= high
+    return check
+
+def _vector_validator(low, high, length):
+    def check(val):
+        if type(val) not in (list, tuple) or len(val) != length:
+            return False
+        for item in val:
+            if type(item) not in _NUMBERS or not low <= item <= high:
+                return False
+        return True
+    return check
+
+def compile_validators(allowed_states):
+    """Build one check function per attr of allowed_states"""
+    validators = {}
+    for key, allowed in allowed_states.items():
+        if allowed is bool:
+            validators[key] = _bool_validator()
+        elif type(allowed) == tuple:
+            validators[key] = _choice_validator(allowed)
+        elif key in VECTOR_STATES:
+            validators[key] = _vector_validator(allowed[0], allowed[1],
+                                                VECTOR_STATES[key])
+        else:
+            validators[key] = _range_validator(allowed[0], allowed[1])
+    return validators
+
+
+VALIDATORS = compile_validators(ALLOWED_STATES)
+
+
+def is_valid(key, val):
+    """Check a single attr value, unknown attrs are invalid"""
+    check = VALIDATORS.get(key)
+    return check is not None and check(val)
+
+def validate_many(attr):
+    """Check every attr of a payload in one pass
+        Raises InvalidLightAttrs listing every unknown attr and bad value
+    """
+    errors = None
+    for key, val in attr.items():
+        check = VALIDATORS.get(key)
+        if check is None or not check(val):
+            if errors is None:
+                errors = []
+            errors.append((key, val, check is None))
+    if errors:
+        raise InvalidLightAttrs(errors)
@@ -2,54 +2,207 @@
 
 
 from django.conf import settings
-from hue import Hue
-from hue.events import randomize_all_lights
+from hue.registry import get_hue, invalidate, REGISTRY_TTL
+from hue.cluster import get_cluster, invalidate_clusters
+from hue.scheduler import GROUP_RATE
+from hue.effects import get_engine, RandomizeEffect, DEFAULT_TICK
+from hue.scenes import HueScene, ModelSceneStore, scenes
+from hue import codec
+from hue.metrics import metrics
+from hue.history import get_recorder
+from hue.exceptions import HueError, HueLightDoesNotExist, InvalidHueHub, \
+                            HueClusterError
+from hue.deadline import deadline, DEFAULT_DEADLINE
 from django.http import HttpResponse, Http404
-from twisted.internet.task import LoopingCall
+from functools import wraps
 from twisted.internet import reactor
 
 
+def _bridge_view(view):
+    """Bound a view's bridge calls by settings.HUE_REQUEST_DEADLINE,
+        answering 503 when the bridge is unreachable or too slow
+    """
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        seconds = getattr(settings, 'HUE_REQUEST_DEADLINE', DEFAULT_DEADLINE)
+        try:
+            with deadline(seconds):
+                return view(request, *args, **kwargs)
+        except InvalidHueHub as exc:
+            return HttpResponse('Hue bridge unavailable: %s' % exc, status=503)
+    return wrapper
 
+def _get_hue():
+    """Shared loaded Hue for the configured bridge"""
+    if getattr(settings, 'HUE_METRICS', False) and not metrics.enabled:
+        metrics.enable()
+    hue = get_hue(settings.HUE_HOST, settings.HUE_APP_KEY,
+                    port=settings.HUE_PORT,
+                    ttl=getattr(settings, 'HUE_CACHE_TTL', REGISTRY_TTL),
+                    lazy=getattr(settings, 'HUE_LAZY_LOAD', False),
+                    snapshot_dir=getattr(settings, 'HUE_SNAPSHOT_DIR', None))
+    light_rate = getattr(settings, 'HUE_LIGHT_RATE', None)
+    if light_rate and not hue.scheduler:
+        hue.enable_scheduler(light_rate=light_rate,
+                    group_rate=getattr(settings, 'HUE_GROUP_RATE', GROUP_RATE),
+                    max_pending=getattr(settings, 'HUE_MAX_PENDING', None))
+    if getattr(settings, 'HUE_HISTORY', False) and hue.history is None:
+        get_recorder().attach(hue)
+    return hue
+
+@_bridge_view
 def turn_on(request, light=None):
-    hue = Hue(settings.HUE_HOST, settings.HUE_APP_KEY, port=settings.HUE_PORT)
+    hue = _get_hue()
     if not light:
-        for light_id in hue.lights:
-            hue.lights[light_id].turn_on()
+        hue.groups['0'].turn_on(force=True)
     else:
         hue.lights[light].turn_on()
 
     return HttpResponse('Success')
 
+@_bridge_view
 def turn_off(request, light=None):
-    hue = Hue(settings.HUE_HOST, settings.HUE_APP_KEY, port=settings.HUE_PORT)
+    hue = _get_hue()
     if not light:
-        for light_id in hue.lights:
-            hue.lights[light_id].turn_off()
+        hue.groups['0'].turn_off(force=True)
     else:
         hue.lights[light].turn_off()
 
     return HttpResponse('Success')
 
+def _get_engine():
+    return get_engine(_get_hue(),
+                        tick=getattr(settings, 'HUE_EFFECT_TICK', DEFAULT_TICK))
+
+@_bridge_view
 def start_randomize(request, group_id=0, secs=1):
-    hue = Hue(settings.HUE_HOST, settings.HUE_APP_KEY, port=settings.HUE_PORT)
-    looping_call = LoopingCall(randomize_all_lights,
-                        *(hue.groups[group_id], ['hue', 'sat'], ))
-    looping_call.start(int(secs))
-    settings.TWISTED_STACK.append(looping_call)
-    return HttpResponse('Looping Call Started')
-
-def stop_randomize(request, pos=-1):
+    engine = _get_engine()
+    try:
+        group = engine.hue.groups[str(group_id)]
+    except KeyError:
+        raise Http404
+    effect = RandomizeEffect(group.lights, ['hue', 'sat'],
+                                interval=float(secs))
+    # Cached state, capturing sends nothing to the bridge
+    effect.scene = HueScene.capture(group)
+    return HttpResponse(engine.start(effect))
+
+@_bridge_view
+def stop_randomize(request, effect_id=None):
+    engine = _get_engine()
     try:
-        if pos==-1:
-            looping_call = settings.TWISTED_STACK.pop()
-        else:
-            looping_call = settings.TWISTED_STACK[pos]
-            del settings.TWISTED_STACK[pos]
-        if looping_call.running:
-            looping_call.stop()
-        return HttpResponse(len(settings.TWISTED_STACK))
-    except IndexError:
+        effect = engine.stop(effect_id)
+    except HueError:
+        raise Http404
+    if effect.scene and getattr(settings, 'HUE_RESTORE_SCENE', True):
+        effect.scene.restore(engine.hue)
+    return HttpResponse(len(engine.list()))
+
+def _get_scenes():
+    """Scene store, the hue Scene model when settings.HUE_STORE_SCENES"""
+    if getattr(settings, 'HUE_STORE_SCENES', False):
+        return ModelSceneStore(settings.HUE_HOST)
+    return scenes
+
+@_bridge_view
+def save_scene(request, name, group_id=0):
+    hue = _get_hue()
+    try:
+        group = hue.groups[str(group_id)]
+    except KeyError:
+        raise Http404
+    _get_scenes().save(HueScene.capture(group, name=name))
+    return HttpResponse('Saved')
+
+@_bridge_view
+def restore_scene(request, name):
+    try:
+        scene = _get_scenes().get(name)
+    except HueError:
+        raise Http404
+    results = scene.restore(_get_hue())
+    return HttpResponse(codec.dumps(sorted(results, key=int)),
+                        content_type='application/json')
+
+@_bridge_view
+def list_effects(request):
+    return HttpResponse(codec.dumps(_get_engine().stats()),
+                        content_type='application/json')
+
+@_bridge_view
+def reload_hue(request):
+    invalidate(settings.HUE_HOST, settings.HUE_APP_KEY, settings.HUE_PORT)
+    _get_hue()
+    return HttpResponse('Reloaded')
+
+@_bridge_view
+def scheduler_stats(request):
+    hue = _get_hue()
+    if not hue.scheduler:
+        raise Http404
+    return HttpResponse(codec.dumps(hue.scheduler.stats()),
+                        content_type='application/json')
+
+def _get_cluster():
+    """Shared loaded cluster of settings.HUE_BRIDGES"""
+    bridges = getattr(settings, 'HUE_BRIDGES', None)
+    if not bridges:
+        raise Http404
+    return get_cluster(bridges, lazy=getattr(settings, 'HUE_LAZY_LOAD', False))
+
+def _cluster_response(cluster, results=None, errors=None):
+    """Bridges, load and command errors by bridge, and keys sent"""
+    errors = dict(cluster.errors, **(errors or {}))
+    return HttpResponse(codec.dumps({
+                'bridges' : sorted(cluster.bridges.keys()),
+                'errors' : dict((name, str(getattr(err, 'message', err)))
+                                    for name, err in errors.items()),
+                'sent' : sorted(results.keys()) if results else [] }),
+                content_type='application/json')
+
+@_bridge_view
+def cluster_turn_on(request, light=None):
+    cluster = _get_cluster()
+    try:
+        results = cluster.turn_on([light] if light else None)
+    except HueLightDoesNotExist:
+        raise Http404
+    except HueClusterError as err:
+        # Bridges that answered still report what they were sent
+        return _cluster_response(cluster, err.results, err.errors)
+    return _cluster_response(cluster, results)
+
+@_bridge_view
+def cluster_turn_off(request, light=None):
+    cluster = _get_cluster()
+    try:
+        results = cluster.turn_off([light] if light else None)
+    except HueLightDoesNotExist:
+        raise Http404
+    except HueClusterError as err:
+        # Bridges that answered still report what they were sent
+        return _cluster_response(cluster, err.results, err.errors)
+    return _cluster_response(cluster, results)
+
+@_bridge_view
+def cluster_lights(request):
+    cluster = _get_cluster()
+    lights = dict((key, { 'name' : light.name,
+                          'state' : light.state.as_dict() })
+                    for key, light in cluster.lights.items())
+    return HttpResponse(codec.dumps(lights), content_type='application/json')
+
+@_bridge_view
+def cluster_reload(request):
+    invalidate_clusters()
+    return _cluster_response(_get_cluster())
+
+def metrics_view(request):
+    if not getattr(settings, 'HUE_METRICS', False):
         raise Http404
+    metrics.enable()
+    return HttpResponse(metrics.render(),
+                        content_type='text/plain; version=0.0.4')
 
 def reactor_running(request):
     return HttpResponse(reactor.running)